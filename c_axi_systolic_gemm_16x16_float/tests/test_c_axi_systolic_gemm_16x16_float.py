@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 from pathlib import Path
 import numpy as np
 from sabana import Instance, Program
 
+sys.path.append(str(Path(__file__).resolve().parents[2].joinpath("common")))
+from sabana_batch import BatchedGemm
+
 
 def create_program(a, b):
     cols = np.array([a.shape[0]], np.int32)
@@ -42,6 +46,93 @@ def create_program(a, b):
     return program
 
 
+class Session:
+    """
+    Session allocates the MMIO region and bufA, bufB and bufC once, large
+    enough for 16x16 matrices, so that every multiplication only writes
+    the matrices, starts the instance, waits for it and reads the result.
+    The matrix dimensions are written again only when they change.
+    The buffers are deallocated by close, or at the end of a with
+    statement.
+    """
+
+    max_size = 16
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.dims = None
+        nbytes = self.max_size * self.max_size * np.dtype(np.float32).itemsize
+        program = Program()
+        program.mmio_alloc(name="c0", size=0x00010000, base_address=0xA0000000)
+        program.buffer_alloc(name="bufA", size=nbytes, mmio_name="c0", mmio_offset=0x28)
+        program.buffer_alloc(name="bufB", size=nbytes, mmio_name="c0", mmio_offset=0x34)
+        program.buffer_alloc(name="bufC", size=nbytes, mmio_name="c0", mmio_offset=0x40)
+        self.driver.run(program)
+        self.allocated = True
+
+    def create_program(self, a, b):
+        dims = (a.shape[0], a.shape[1], b.shape[1])
+        if a.shape[1] != b.shape[0] or max(dims) > self.max_size:
+            raise ValueError(
+                "cannot multiply matrices of shapes {} and {}".format(a.shape, b.shape)
+            )
+        start = np.ones([1], np.int32)
+        finish = np.array([14], np.int32)
+
+        program = Program()
+        if dims != self.dims:
+            program.mmio_write(np.array([dims[0]], np.int32), name="c0", offset=0x10)
+            program.mmio_write(np.array([dims[1]], np.int32), name="c0", offset=0x18)
+            program.mmio_write(np.array([dims[2]], np.int32), name="c0", offset=0x20)
+        program.buffer_write(a, name="bufA", offset=0)
+        program.buffer_write(b, name="bufB", offset=0)
+        program.mmio_write(start, name="c0", offset=0x0)
+        program.mmio_wait(finish, name="c0", offset=0x0, timeout=4)
+        program.buffer_read(
+            name="bufC", offset=0, dtype=a.dtype.type, shape=(dims[0], dims[2])
+        )
+        return program, dims
+
+    def run(self, a, b):
+        program, dims = self.create_program(a, b)
+        try:
+            res = self.driver.run(program)
+        except Exception:
+            # the dimensions may not have been written
+            self.dims = None
+            raise
+        self.dims = dims
+        return res[0]
+
+    def close(self):
+        if not self.allocated:
+            return
+        program = Program()
+        program.mmio_dealloc(name="c0")
+        program.buffer_dealloc(name="bufA")
+        program.buffer_dealloc(name="bufB")
+        program.buffer_dealloc(name="bufC")
+        self.driver.run(program)
+        self.allocated = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create_batch(driver, capacity=64):
+    return BatchedGemm(
+        driver,
+        pointer_offsets=(0x28, 0x34, 0x40),
+        max_shape=(16, 16, 16),
+        dtype=np.float32,
+        dims_offsets=(0x10, 0x18, 0x20),
+        capacity=capacity,
+    )
+
+
 class Driver:
     def __init__(self):
         image_file = Path(__file__).resolve().parent.parent.joinpath("sabana.json")
@@ -66,6 +157,10 @@ def create_function():
     return func
 
 
+def create_session():
+    return Session(Driver())
+
+
 # You need to be authenticated in Sabana to run this code.
 # Go to https://sabana.io to sign-up
 def test_main():
@@ -86,5 +181,39 @@ def test_main():
     print("Multiplication of two random 16x16 float matrices in Sabana successful!")
 
 
+def test_session():
+    """
+    Multiplies several pairs of matrices in a session, that allocates
+    the buffers of the instance once
+    """
+    with create_session() as session:
+        for n in [16, 16, 8]:
+            a = np.random.random(size=(n, n)).astype(np.float32) * 255
+            b = np.random.random(size=(n, n)).astype(np.float32) * 255
+            res = session.run(a, b)
+            np.testing.assert_allclose(res, np.matmul(a, b), rtol=1e-3)
+    assert not session.allocated
+    print("Multiplications in a session in Sabana successful!")
+
+
+def test_batch():
+    """
+    Multiplies a stack of pairs of matrices, launching the kernel once per
+    pair in a single program
+    """
+    batch = create_batch(Driver())
+
+    count = 32
+    a = np.random.random(size=(count, 16, 16)).astype(np.float32) * 255
+    b = np.random.random(size=(count, 16, 16)).astype(np.float32) * 255
+    res = batch.run(a, b)
+    batch.free()
+    np.testing.assert_allclose(res, np.matmul(a, b), rtol=1e-3)
+    assert batch.programs == 1
+    print("Batch of {} multiplications in Sabana successful!".format(count))
+
+
 if __name__ == "__main__":
     test_main()
+    test_session()
+    test_batch()
@@ -0,0 +1,61 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import numpy as np
+from test_c_axi_systolic_gemm_16x16_int import Driver
+from tiled_gemm import TiledGemm
+
+
+def bench(func, *args, repeat=3):
+    res = func(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return res, (time.perf_counter() - start) / repeat
+
+
+# You need to be authenticated in Sabana to run this code.
+# Go to https://sabana.io to sign-up
+def bench_tiled_gemm(sizes=(16, 32, 64, 128, 256)):
+    gemm = TiledGemm(Driver())
+    row = "{:>6}{:>10}{:>10}{:>18}{:>18}{:>10}"
+    print(
+        row.format("size", "launches", "programs", "instance", "np.matmul", "seconds")
+    )
+    for n in sizes:
+        a = np.random.randint(0, 8192, size=(n, n), dtype=np.int32)
+        b = np.random.randint(0, 8192, size=(n, n), dtype=np.int32)
+        flop = 2 * n**3
+        launches, programs = gemm.launches, gemm.programs
+        gemm.matmul(a, b)
+        launches, programs = gemm.launches - launches, gemm.programs - programs
+        res, elapsed = bench(gemm.matmul, a, b)
+        expected, reference = bench(np.matmul, a, b)
+        assert np.array_equal(res, expected)
+        print(
+            row.format(
+                n,
+                launches,
+                programs,
+                "{:.4f} GFLOP/s".format(flop / elapsed / 1e9),
+                "{:.4f} GFLOP/s".format(flop / reference / 1e9),
+                "{:.3f}".format(elapsed),
+            )
+        )
+    gemm.free()
+
+
+if __name__ == "__main__":
+    bench_tiled_gemm()
@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 from pathlib import Path
 import numpy as np
 from sabana import Instance, Program
 
+sys.path.append(str(Path(__file__).resolve().parents[2].joinpath("common")))
+from sabana_batch import BatchedGemm
+from tiled_gemm import TiledGemm
+
 
 def create_program(a, b):
     cols = np.array([a.shape[0]], np.int32)
@@ -42,6 +47,17 @@ def create_program(a, b):
     return program
 
 
+def create_batch(driver, capacity=64):
+    return BatchedGemm(
+        driver,
+        pointer_offsets=(0x28, 0x34, 0x40),
+        max_shape=(16, 16, 16),
+        dtype=np.int32,
+        dims_offsets=(0x10, 0x18, 0x20),
+        capacity=capacity,
+    )
+
+
 class Driver:
     def __init__(self):
         image_file = Path(__file__).resolve().parent.parent.joinpath("sabana.json")
@@ -86,5 +102,38 @@ def test_main():
     print("Multiplication of two random 16x16 int matrices in Sabana successful!")
 
 
+def test_tiled():
+    """
+    Multiplies matrices larger than the systolic array, tile by tile
+    """
+    gemm = TiledGemm(Driver(), launches_per_program=16)
+
+    a = np.random.randint(0, 8192, size=(40, 24), dtype=np.int32)
+    b = np.random.randint(0, 8192, size=(24, 50), dtype=np.int32)
+    res = gemm.matmul(a, b)
+    gemm.free()
+    assert np.array_equal(res, np.matmul(a, b))
+    print("Multiplication of 40x24 and 24x50 int matrices in Sabana successful!")
+
+
+def test_batch():
+    """
+    Multiplies a stack of pairs of matrices, launching the kernel once per
+    pair in a single program
+    """
+    batch = create_batch(Driver())
+
+    count = 32
+    a = np.random.randint(0, 8192, size=(count, 16, 16), dtype=np.int32)
+    b = np.random.randint(0, 8192, size=(count, 16, 16), dtype=np.int32)
+    res = batch.run(a, b)
+    batch.free()
+    assert np.array_equal(res, np.matmul(a, b))
+    assert batch.programs == 1
+    print("Batch of {} multiplications in Sabana successful!".format(count))
+
+
 if __name__ == "__main__":
     test_main()
+    test_batch()
+    test_tiled()
@@ -0,0 +1,133 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from sabana.common import ndarray_from_values
+from sabana.requests import is_buffer, is_mmio, is_read, is_write
+from tiled_gemm import TiledGemm, TILE
+
+
+class SimulatedDriver:
+    """
+    A driver that executes the programs of TiledGemm on the host: buffer
+    writes are kept, and every start of the instance multiplies the tiles
+    in bufA and bufB into bufC
+    """
+
+    def __init__(self):
+        self.buffers = dict()
+        self.programs = []
+
+    def run(self, program):
+        self.programs.append(program)
+        res = []
+        for req in program.req.requests:
+            if is_buffer(req) and is_write(req):
+                values = ndarray_from_values(req.write.values, req.write.datatype)
+                self.buffers[req.write.name] = values.reshape(TILE, TILE)
+            elif is_mmio(req) and is_write(req) and req.write.offset == 0x0:
+                self.buffers["bufC"] = self.buffers["bufA"] @ self.buffers["bufB"]
+            elif is_buffer(req) and is_read(req):
+                res.append(self.buffers["bufC"].astype(np.int32))
+        return res
+
+    def writes(self, name):
+        """Returns the number of writes to the buffer name, by program"""
+        return [
+            sum(
+                1
+                for req in program.req.requests
+                if is_buffer(req) and is_write(req) and req.write.name == name
+            )
+            for program in self.programs
+        ]
+
+
+def random_matrix(rng, shape):
+    return rng.integers(0, 64, size=shape, dtype=np.int32)
+
+
+@pytest.mark.parametrize(
+    "shape", [(40, 24, 50), (1, 1, 1), (17, 33, 15), (16, 16, 16), (32, 48, 16)]
+)
+def test_tiled_shapes(shape):
+    m, k, n = shape
+    rng = np.random.default_rng(0)
+    a, b = random_matrix(rng, (m, k)), random_matrix(rng, (k, n))
+    gemm = TiledGemm(SimulatedDriver(), launches_per_program=4)
+    res = gemm.matmul(a, b)
+    assert res.shape == (m, n) and res.dtype == np.int32
+    np.testing.assert_array_equal(res, a @ b)
+    tiles = [-(-size // TILE) for size in shape]
+    assert gemm.launches == tiles[0] * tiles[1] * tiles[2]
+    assert gemm.programs == -(-gemm.launches // 4)
+
+
+@pytest.mark.parametrize("launches_per_program", [1, 5, 6, 7, 64])
+def test_tiled_launches_per_program(launches_per_program):
+    # 2 x 1 x 3 tiles, 6 launches
+    rng = np.random.default_rng(0)
+    a, b = random_matrix(rng, (20, 10)), random_matrix(rng, (10, 40))
+    driver = SimulatedDriver()
+    gemm = TiledGemm(driver, launches_per_program=launches_per_program)
+    np.testing.assert_array_equal(gemm.matmul(a, b), a @ b)
+    # the first program allocates the buffers
+    assert len(driver.programs) == 1 + -(-6 // launches_per_program)
+    assert sum(driver.writes("bufB")) == 6
+
+
+def test_tiled_resident_a():
+    rng = np.random.default_rng(0)
+    # a single tile of A, multiplied by 3 tiles of B in two programs
+    a, b = random_matrix(rng, (16, 16)), random_matrix(rng, (16, 48))
+    driver = SimulatedDriver()
+    gemm = TiledGemm(driver, launches_per_program=2)
+    np.testing.assert_array_equal(gemm.matmul(a, b), a @ b)
+    # the second program uses the tile of A written by the first one
+    assert driver.writes("bufA")[1:] == [1, 0]
+
+    # a new call writes its tile of A again, even if it is the same one
+    np.testing.assert_array_equal(gemm.matmul(a, b), a @ b)
+    assert driver.writes("bufA")[3:] == [1, 0]
+
+    # a tile of A is written once for every row of tiles of B it multiplies
+    a, b = random_matrix(rng, (16, 32)), random_matrix(rng, (32, 48))
+    np.testing.assert_array_equal(gemm.matmul(a, b), a @ b)
+    assert sum(driver.writes("bufA")[5:]) == 2
+    gemm.free()
+    assert not gemm.allocated
+
+
+def test_tiled_failed_program():
+    class FailingDriver(SimulatedDriver):
+        def run(self, program):
+            if len(self.programs) == 2:
+                self.programs.append(program)
+                raise RuntimeError("timeout")
+            return super().run(program)
+
+    rng = np.random.default_rng(0)
+    a, b = random_matrix(rng, (16, 16)), random_matrix(rng, (16, 48))
+    gemm = TiledGemm(FailingDriver(), launches_per_program=2)
+    with pytest.raises(RuntimeError):
+        gemm.matmul(a, b)
+    # bufA may not hold the tile the failed program wrote
+    assert gemm.resident_a is None
+
+
+def test_tiled_shapes_mismatch():
+    gemm = TiledGemm(SimulatedDriver())
+    with pytest.raises(ValueError):
+        gemm.matmul(np.zeros((4, 3), np.int32), np.zeros((4, 3), np.int32))
@@ -0,0 +1,145 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sabana import Program
+
+# The systolic array multiplies matrices of up to TILE x TILE elements
+TILE = 16
+
+
+class TiledGemm:
+    """
+    TiledGemm multiplies MxK by KxN int32 matrices of any size on a
+    c_axi_systolic_gemm_16x16_int instance. Matrices are padded with zeros
+    to multiples of 16 and split into 16x16 tiles. Every tile of C is the
+    sum of the products of a row of tiles of A by a column of tiles of B:
+    the instance computes the products, and they are added on the host.
+
+    The MMIO region and the bufA, bufB and bufC buffers are allocated once
+    and kept across tiles and calls. Launches are batched, up to
+    launches_per_program of them are sent to the instance in one program,
+    and a tile of A is written only when it changes.
+
+    Parameters
+    ----------
+    driver : Driver
+        The driver of the instance, programs are executed with driver.run
+    launches_per_program : int
+        Largest number of tile multiplications in a program
+    """
+
+    def __init__(self, driver, launches_per_program=64):
+        self.driver = driver
+        self.launches_per_program = launches_per_program
+        self.tile = np.zeros((TILE, TILE), dtype=np.int32)
+        self.allocated = False
+        # the tile of A held by bufA, as (row, column) of tiles
+        self.resident_a = None
+        self.launches = 0
+        self.programs = 0
+
+    def allocate(self):
+        dims = np.array([TILE], np.int32)
+        program = Program()
+        program.mmio_alloc(name="c0", size=0x00010000, base_address=0xA0000000)
+        program.buffer_alloc(
+            name="bufA", size=self.tile.nbytes, mmio_name="c0", mmio_offset=0x28
+        )
+        program.buffer_alloc(
+            name="bufB", size=self.tile.nbytes, mmio_name="c0", mmio_offset=0x34
+        )
+        program.buffer_alloc(
+            name="bufC", size=self.tile.nbytes, mmio_name="c0", mmio_offset=0x40
+        )
+        program.mmio_write(dims, name="c0", offset=0x10)
+        program.mmio_write(dims, name="c0", offset=0x18)
+        program.mmio_write(dims, name="c0", offset=0x20)
+        self.driver.run(program)
+        self.allocated = True
+        self.resident_a = None
+
+    def free(self):
+        if not self.allocated:
+            return
+        program = Program()
+        program.mmio_dealloc(name="c0")
+        program.buffer_dealloc(name="bufA")
+        program.buffer_dealloc(name="bufB")
+        program.buffer_dealloc(name="bufC")
+        self.driver.run(program)
+        self.allocated = False
+        self.resident_a = None
+
+    @staticmethod
+    def tiles(x):
+        """
+        Returns x padded with zeros and split into tiles, as an array of
+        shape (rows of tiles, columns of tiles, TILE, TILE)
+        """
+        rows = -(-x.shape[0] // TILE)
+        cols = -(-x.shape[1] // TILE)
+        padded = np.zeros((rows * TILE, cols * TILE), dtype=np.int32)
+        padded[: x.shape[0], : x.shape[1]] = x
+        return np.ascontiguousarray(
+            padded.reshape(rows, TILE, cols, TILE).transpose(0, 2, 1, 3)
+        )
+
+    def launch(self, program, a_tile, b_tile, a_index):
+        if self.resident_a != a_index:
+            program.buffer_write(a_tile, name="bufA", offset=0)
+            self.resident_a = a_index
+        program.buffer_write(b_tile, name="bufB", offset=0)
+        program.mmio_write(np.ones([1], np.int32), name="c0", offset=0x0)
+        program.mmio_wait(np.array([14], np.int32), name="c0", offset=0x0, timeout=4)
+        program.buffer_read(name="bufC", offset=0, dtype=np.int32, shape=(TILE, TILE))
+
+    def matmul(self, a, b):
+        """Returns the product of a and b as an int32 array"""
+        if a.ndim != 2 or b.ndim != 2 or a.shape[1] != b.shape[0]:
+            raise ValueError(
+                "cannot multiply matrices of shapes {} and {}".format(a.shape, b.shape)
+            )
+        if not self.allocated:
+            self.allocate()
+        # bufA holds a tile of a previous call
+        self.resident_a = None
+
+        a_tiles = self.tiles(a)
+        b_tiles = self.tiles(b)
+        rows, inner, _, _ = a_tiles.shape
+        cols = b_tiles.shape[1]
+        c_tiles = np.zeros((rows, cols, TILE, TILE), dtype=np.int32)
+
+        # keep each tile of A resident while it is multiplied by a row of B
+        launches = [
+            (i, k, j) for i in range(rows) for k in range(inner) for j in range(cols)
+        ]
+        for start in range(0, len(launches), self.launches_per_program):
+            batch = launches[start : start + self.launches_per_program]
+            program = Program()
+            for i, k, j in batch:
+                self.launch(program, a_tiles[i, k], b_tiles[k, j], (i, k))
+            try:
+                res = self.driver.run(program)
+            except Exception:
+                self.resident_a = None
+                raise
+            for (i, _, j), product in zip(batch, res):
+                c_tiles[i, j] += product
+            self.launches += len(batch)
+            self.programs += 1
+
+        c = c_tiles.transpose(0, 2, 1, 3).reshape(rows * TILE, cols * TILE)
+        return np.ascontiguousarray(c[: a.shape[0], : b.shape[1]])
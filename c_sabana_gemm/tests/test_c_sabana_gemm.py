@@ -12,10 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import os
+import sys
 from pathlib import Path
 import numpy as np
+import pytest
 from sabana import Instance, Program
 
+sys.path.append(str(Path(__file__).resolve().parents[2].joinpath("common")))
+from sabana_async import AsyncDriverGroup
+from sabana_batch import BatchedGemm
+from sabana_pool import InstancePool
+
+# tests that deploy instances of their own only run with SABANA_MULTI_INSTANCE=1
+multi_instance = pytest.mark.skipif(
+    not os.environ.get("SABANA_MULTI_INSTANCE"),
+    reason="deploys more instances, set SABANA_MULTI_INSTANCE=1 to run",
+)
+
 
 class Driver:
     def __init__(self, image=None):
@@ -54,8 +69,19 @@ def create_program(a, b):
     return program
 
 
-def create_function(image=None):
-    driver = Driver(image)
+def create_batch(driver, capacity=64):
+    return BatchedGemm(
+        driver,
+        pointer_offsets=(0x10, 0x1C, 0x28),
+        max_shape=(4, 4, 4),
+        dtype=np.uint32,
+        capacity=capacity,
+    )
+
+
+def create_function(image=None, driver=None):
+    if driver is None:
+        driver = Driver(image)
 
     def func(a, b):
         prog = create_program(a, b)
@@ -65,6 +91,11 @@ def create_function(image=None):
     return func
 
 
+@pytest.fixture(scope="module")
+def driver():
+    return Driver()
+
+
 def test_main():
     n = 4
     m = 32
@@ -76,5 +107,56 @@ def test_main():
     print("Matrix multiplication passed")
 
 
+def test_async(driver):
+    n = 4
+    m = 32
+    pairs = [
+        (
+            np.random.randint(m, size=(n, n), dtype=np.uint32),
+            np.random.randint(m, size=(n, n), dtype=np.uint32),
+        )
+        for _ in range(8)
+    ]
+    # every program allocates the same names, so one in flight per instance
+    group = AsyncDriverGroup([driver], max_in_flight=1)
+    res = asyncio.run(group.map([create_program(a, b) for a, b in pairs]))
+    group.close()
+    for (a, b), r in zip(pairs, res):
+        assert np.array_equal(r[3], np.matmul(a, b))
+    print("Async matrix multiplication passed")
+
+
+@multi_instance
+def test_pool():
+    n = 4
+    m = 32
+    file = Path(__file__).resolve().parent.parent.joinpath("sabana.json")
+    with InstancePool(image_file=file, warm=1) as pool:
+        f = create_function(driver=pool)
+        for _ in range(2):
+            a = np.random.randint(m, size=(n, n), dtype=np.uint32)
+            b = np.random.randint(m, size=(n, n), dtype=np.uint32)
+            assert np.array_equal(f(a, b), np.matmul(a, b))
+    print("Pooled matrix multiplication passed")
+
+
+def test_batch(driver):
+    m = 32
+    count = 64
+    a = np.random.randint(m, size=(count, 4, 4), dtype=np.uint32)
+    b = np.random.randint(m, size=(count, 4, 4), dtype=np.uint32)
+    batch = create_batch(driver)
+    res = batch.run(a, b)
+    batch.free()
+    assert np.array_equal(res, np.matmul(a, b))
+    assert batch.programs == 1
+    print("Batched matrix multiplication passed")
+
+
 if __name__ == "__main__":
+    drv = Driver()
     test_main()
+    test_async(drv)
+    if os.environ.get("SABANA_MULTI_INSTANCE"):
+        test_pool()
+    test_batch(drv)
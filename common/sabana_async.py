@@ -0,0 +1,165 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+REQUEST_FIELDS = ("alloc", "write", "read", "wait", "dealloc")
+
+
+def program_resources(program):
+    """
+    Returns the (resource, name) of every MMIO region and buffer that a
+    Program uses, or an empty set for anything that is not a Program
+    """
+    requests = getattr(getattr(program, "req", None), "requests", None)
+    if requests is None:
+        return frozenset()
+    resources = set()
+    for req in requests:
+        for field in REQUEST_FIELDS:
+            if req.HasField(field):
+                resources.add((req.resource, getattr(req, field).name))
+    return frozenset(resources)
+
+
+class AsyncDriver:
+    """
+    AsyncDriver wraps the Driver of an example, or anything with a blocking
+    run(program) method, so that programs can be awaited:
+
+        driver = AsyncDriver(Driver())
+        res = await driver.run(program)
+
+    At most max_in_flight programs are executed at the same time on the
+    wrapped driver, others wait for their turn. Programs in flight on the
+    same instance share its MMIO regions, buffers and kernel registers, so
+    the default of 1 is the only safe one for programs that allocate the
+    same names, like the create_program functions of the examples. Use an
+    AsyncDriverGroup to run programs on several instances at once. With a
+    larger max_in_flight every program must use its own MMIO regions and
+    buffers, and running a program that shares a name with one in flight
+    raises an AsyncDriverError. Blocking calls are done in
+    executor, a thread pool with one thread per program in flight by
+    default, so the event loop stays free while programs travel to and
+    from the instance.
+
+    Parameters
+    ----------
+    driver : Driver
+        The driver to wrap, programs are executed with driver.run(program)
+    max_in_flight : int
+        Largest number of programs executed at the same time
+    executor : concurrent.futures.Executor (optional)
+        Executor for the blocking calls, can be shared between drivers
+    """
+
+    def __init__(self, driver, max_in_flight=1, executor=None):
+        if not isinstance(max_in_flight, int) or max_in_flight < 1:
+            raise AsyncDriverError("max_in_flight must be a positive integer")
+        self.driver = driver
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.completed = 0
+        self.own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.executor = executor
+        # resources of the programs in flight
+        self.resources = []
+        # created for every event loop the driver is used in
+        self.semaphore = None
+        self.loop = None
+
+    async def run(self, program):
+        """Executes program in the wrapped driver and returns its results"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.loop = loop
+        async with self.semaphore:
+            resources = frozenset()
+            if self.max_in_flight > 1:
+                resources = program_resources(program)
+                for others in self.resources:
+                    shared = resources & others
+                    if shared:
+                        raise AsyncDriverError(
+                            "programs in flight on the same instance share {}, "
+                            "every program needs its own MMIO regions and "
+                            "buffers".format(sorted(name for _, name in shared))
+                        )
+            self.resources.append(resources)
+            self.in_flight += 1
+            try:
+                return await loop.run_in_executor(
+                    self.executor, self.driver.run, program
+                )
+            finally:
+                self.resources.remove(resources)
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def map(self, programs):
+        """Executes every program in programs, returns their results in order"""
+        return await asyncio.gather(*[self.run(p) for p in programs])
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=True)
+
+
+class AsyncDriverGroup:
+    """
+    AsyncDriverGroup fans programs out across several drivers, for example
+    one for every instance deployed from the same image. Every program goes
+    to the driver with the fewest programs in flight or waiting.
+
+    Parameters
+    ----------
+    drivers : list
+        The drivers of the group, each one with a blocking run(program)
+    max_in_flight : int
+        Largest number of programs executed at the same time per driver
+    """
+
+    def __init__(self, drivers, max_in_flight=1):
+        if len(drivers) == 0:
+            raise AsyncDriverError("an AsyncDriverGroup needs at least one driver")
+        self.executor = ThreadPoolExecutor(max_workers=len(drivers) * max_in_flight)
+        self.drivers = [
+            AsyncDriver(d, max_in_flight, executor=self.executor) for d in drivers
+        ]
+        # programs assigned to every driver and not finished yet
+        self.pending = [0] * len(self.drivers)
+
+    async def run(self, program):
+        """Executes program in the least busy driver and returns its results"""
+        index = min(range(len(self.drivers)), key=lambda i: self.pending[i])
+        self.pending[index] += 1
+        try:
+            return await self.drivers[index].run(program)
+        finally:
+            self.pending[index] -= 1
+
+    async def map(self, programs):
+        """Executes every program in programs, returns their results in order"""
+        return await asyncio.gather(*[self.run(p) for p in programs])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncDriverError(Exception):
+    pass
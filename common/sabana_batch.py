@@ -0,0 +1,185 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sabana import Program
+
+
+def pointer(address):
+    """Returns a device address as the two 32 bit words of an MMIO pointer"""
+    address = int(address)
+    return np.array([address & 0xFFFFFFFF, address >> 32], np.uint32)
+
+
+class BatchedGemm:
+    """
+    BatchedGemm executes many launches of an HLS GEMM kernel in a single
+    program. A stack of (A, B) pairs is written at once to device buffers
+    large enough for capacity pairs, then, for every pair, the a, b and c
+    pointers of the kernel are rewritten to its slice of the buffers and
+    the kernel is started and waited for. The stacked results are read
+    back at once at the end of the program.
+
+    The buffers are allocated once, on the first batch, since their device
+    addresses are needed to build the programs. Batches larger than
+    capacity are split into several programs.
+
+    Parameters
+    ----------
+    driver : Driver
+        The driver of the instance, programs are executed with driver.run
+    pointer_offsets : tuple
+        MMIO offsets of the a, b and c pointers of the kernel
+    max_shape : tuple
+        Largest (rows, inner, cols) dimensions of a multiplication
+    dtype : numpy.dtype
+        Type of the elements of the matrices
+    dims_offsets : tuple (optional)
+        MMIO offsets of the rows, inner and cols registers of the kernel,
+        for kernels that multiply matrices of any size up to max_shape
+    capacity : int
+        Largest number of pairs in a program
+    finish : int
+        Value of the control register once the kernel is done
+    """
+
+    def __init__(
+        self,
+        driver,
+        pointer_offsets,
+        max_shape,
+        dtype,
+        dims_offsets=None,
+        capacity=64,
+        finish=14,
+    ):
+        self.driver = driver
+        self.pointer_offsets = pointer_offsets
+        self.max_shape = tuple(max_shape)
+        self.dtype = np.dtype(dtype)
+        self.dims_offsets = dims_offsets
+        self.capacity = capacity
+        self.finish = finish
+        self.addresses = None
+        self.dims = None
+        self.launches = 0
+        self.programs = 0
+
+    def buffer_sizes(self):
+        rows, inner, cols = self.max_shape
+        itemsize = self.dtype.itemsize
+        return [
+            self.capacity * rows * inner * itemsize,
+            self.capacity * inner * cols * itemsize,
+            self.capacity * rows * cols * itemsize,
+        ]
+
+    def allocate(self):
+        program = Program()
+        program.mmio_alloc(name="c0", size=0x00010000, base_address=0xA0000000)
+        for name, size, offset in zip(
+            ["batchA", "batchB", "batchC"], self.buffer_sizes(), self.pointer_offsets
+        ):
+            program.buffer_alloc(
+                name=name, size=size, mmio_name="c0", mmio_offset=offset
+            )
+        self.addresses = [int(address) for address in self.driver.run(program)]
+        self.dims = None
+
+    def free(self):
+        if self.addresses is None:
+            return
+        program = Program()
+        program.mmio_dealloc(name="c0")
+        program.buffer_dealloc(name="batchA")
+        program.buffer_dealloc(name="batchB")
+        program.buffer_dealloc(name="batchC")
+        self.driver.run(program)
+        self.addresses = None
+
+    def create_program(self, a, b):
+        """
+        Returns a program that multiplies every pair of matrices of the
+        stacks a and b, of at most capacity pairs
+        """
+        count, rows, inner = a.shape
+        cols = b.shape[2]
+        strides = [rows * inner, inner * cols, rows * cols]
+        start = np.ones([1], np.int32)
+        finish = np.array([self.finish], np.int32)
+
+        program = Program()
+        if self.dims_offsets is not None and self.dims != (rows, inner, cols):
+            for dim, offset in zip((rows, inner, cols), self.dims_offsets):
+                program.mmio_write(np.array([dim], np.int32), name="c0", offset=offset)
+        program.buffer_write(a, name="batchA", offset=0)
+        program.buffer_write(b, name="batchB", offset=0)
+        for i in range(count):
+            for address, stride, offset in zip(
+                self.addresses, strides, self.pointer_offsets
+            ):
+                program.mmio_write(
+                    pointer(address + i * stride * self.dtype.itemsize),
+                    name="c0",
+                    offset=offset,
+                )
+            program.mmio_write(start, name="c0", offset=0x0)
+            program.mmio_wait(finish, name="c0", offset=0x0, timeout=4)
+        program.buffer_read(
+            name="batchC", offset=0, dtype=self.dtype.type, shape=(count, rows, cols)
+        )
+        return program
+
+    def run(self, a, b):
+        """
+        Multiplies every pair of matrices of the stacks a and b, of shapes
+        (n, rows, inner) and (n, inner, cols), returns the stack of results
+        """
+        if (
+            a.ndim != 3
+            or b.ndim != 3
+            or a.shape[0] != b.shape[0]
+            or a.shape[2] != b.shape[1]
+        ):
+            raise ValueError(
+                "cannot multiply stacks of shapes {} and {}".format(a.shape, b.shape)
+            )
+        dims = (a.shape[1], a.shape[2], b.shape[2])
+        if self.dims_offsets is None and dims != self.max_shape:
+            raise ValueError(
+                "the kernel only multiplies {} matrices".format(self.max_shape)
+            )
+        if any(d > m for d, m in zip(dims, self.max_shape)):
+            raise ValueError(
+                "{} matrices do not fit in {}".format(dims, self.max_shape)
+            )
+        if self.addresses is None:
+            self.allocate()
+
+        a = np.ascontiguousarray(a, dtype=self.dtype)
+        b = np.ascontiguousarray(b, dtype=self.dtype)
+        c = np.empty((a.shape[0], dims[0], dims[2]), dtype=self.dtype)
+        for start in range(0, a.shape[0], self.capacity):
+            end = start + self.capacity
+            program = self.create_program(a[start:end], b[start:end])
+            try:
+                res = self.driver.run(program)
+            except Exception:
+                self.dims = None
+                raise
+            self.dims = dims
+            c[start:end] = res[0]
+            self.launches += len(res[0])
+            self.programs += 1
+        return c
@@ -0,0 +1,418 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from sabana import Instance, Program
+
+
+def mmio_health_check(inst, base_address=0xA0000000, offset=0x0, name="pool_health"):
+    """
+    Returns whether inst answers a read of one word of its MMIO region,
+    the cheapest program every example image can execute. The region is
+    allocated under its own name, as a failed program of the caller may
+    have left its regions, such as c0, allocated
+    """
+    program = Program()
+    program.mmio_alloc(name=name, size=0x00010000, base_address=base_address)
+    program.mmio_read(name=name, offset=offset, dtype=np.uint32, shape=(1,))
+    program.mmio_dealloc(name=name)
+    try:
+        inst.execute(program)
+    except Exception:
+        return False
+    return True
+
+
+class PooledInstance:
+    """
+    An instance that is up and belongs to an InstancePool. It has the
+    run(program) method of the Driver of the examples.
+    """
+
+    def __init__(self, inst):
+        self.inst = inst
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.last_check = self.created
+        self.runs = 0
+        # set when a program fails, the instance is checked on release
+        self.suspect = False
+
+    def run(self, program):
+        try:
+            res = self.inst.execute(program)
+        except Exception:
+            self.suspect = True
+            raise
+        self.runs += 1
+        return res
+
+
+class InstancePool:
+    """
+    InstancePool keeps instances of an image up, so that callers do not
+    wait for an instance to be brought up. Instances are leased to one
+    caller at a time:
+
+        pool = InstancePool(image="user/image:0.1.0", warm=2)
+        with pool.lease() as inst:
+            res = inst.run(program)
+
+    A background thread keeps warm idle instances on standby, up to
+    max_size instances in total. It health checks idle instances every
+    health_interval seconds, replaces the ones that fail, and shuts down
+    the idle instances in excess of warm that were not used for idle_ttl
+    seconds. An instance whose program raised is health checked when it
+    is released, and replaced if the check fails.
+
+    When bringing up an instance fails, in acquire or in the background
+    thread, the background thread waits backoff seconds before it tries
+    again, twice as long after every
+    failure in a row, up to max_backoff. The failures in a row are kept in
+    start_failures, and the error in last_error.
+
+    The pool has a run(program) method as well, so it can be used as the
+    driver of create_function, or wrapped by an AsyncDriver, as long as
+    every program allocates and deallocates what it uses: every run may
+    go to a different instance. Stateful users such as BatchedGemm or
+    Session, that keep buffers in one instance across programs, must be
+    given a leased instance instead of the pool:
+
+        with pool.lease() as inst:
+            gemm = BatchedGemm(inst, pointer_offsets, max_shape, dtype)
+
+    The background thread is stopped by close, or at the end of a with
+    statement. A pool that is not closed keeps its instances up.
+
+    Parameters
+    ----------
+    image : str (optional)
+        The image of the instances, as in Instance(image=image)
+    image_file : str (optional)
+        The image file of the instances, used if image is not given
+    warm : int
+        Number of idle instances kept on standby
+    max_size : int (optional)
+        Largest number of instances up at the same time, warm if not given
+    idle_ttl : float (optional)
+        Seconds after which idle instances in excess of warm are shut down,
+        None keeps them up
+    health_check : function (optional)
+        Called with an Instance, returns whether it is healthy.
+        mmio_health_check by default, None disables health checks
+    health_interval : float
+        Seconds between health checks of an idle instance
+    interval : float
+        Seconds between runs of the background thread
+    backoff : float
+        Seconds before bringing up an instance again after a failure
+    max_backoff : float
+        Largest number of seconds between failed bring ups
+    factory : function (optional)
+        Returns a new Instance, not up yet. Overrides image and image_file
+    verbose : bool
+        Passed to the instances created from image or image_file
+    """
+
+    def __init__(
+        self,
+        image=None,
+        image_file=None,
+        warm=1,
+        max_size=None,
+        idle_ttl=300.0,
+        health_check=mmio_health_check,
+        health_interval=60.0,
+        interval=1.0,
+        backoff=1.0,
+        max_backoff=300.0,
+        factory=None,
+        verbose=False,
+    ):
+        if max_size is None:
+            max_size = max(warm, 1)
+        if warm < 0 or max_size < 1 or warm > max_size:
+            raise PoolError("the pool needs 0 <= warm <= max_size and max_size >= 1")
+        if factory is None:
+            if image is None and image_file is None:
+                raise PoolError("the pool needs an image, an image_file or a factory")
+
+            def factory():
+                if image:
+                    return Instance(image=image, verbose=verbose)
+                return Instance(image_file=image_file, verbose=verbose)
+
+        self.factory = factory
+        self.warm = warm
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.health_check = health_check
+        self.health_interval = health_interval
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Condition()
+        # idle instances, least recently released first
+        self.idle = deque()
+        self.leased = set()
+        # idle instances being health checked by the background thread
+        self.checking = set()
+        # instances to be shut down by the background thread
+        self.retiring = []
+        # instances being brought up
+        self.starting = 0
+        self.closed = False
+        self.last_error = None
+        # failed bring ups in a row, and when the next one may be tried
+        self.start_failures = 0
+        self.next_start = 0.0
+        self.stats = {
+            "started": 0,
+            "stopped": 0,
+            "failed_starts": 0,
+            "failed_checks": 0,
+            "leases": 0,
+        }
+
+        self.thread = threading.Thread(target=self.maintain, daemon=True)
+        self.thread.start()
+
+    @property
+    def size(self):
+        """Number of instances up, or being brought up"""
+        return len(self.idle) + len(self.leased) + len(self.checking) + self.starting
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until warm instances are idle, returns whether they are.
+        Bring up errors are kept in last_error
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while len(self.idle) < self.warm and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+            return len(self.idle) >= self.warm
+
+    def acquire(self, timeout=None):
+        """
+        Returns an idle PooledInstance, bringing one up if there is none
+        and the pool is not full, otherwise waits up to timeout seconds for
+        one to be released. Instances must be given back with release
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise PoolError("the pool is closed")
+                if self.idle:
+                    pooled = self.idle.pop()
+                    self.leased.add(pooled)
+                    self.stats["leases"] += 1
+                    # wake the background thread to refill the standby
+                    self.lock.notify_all()
+                    return pooled
+                if self.size < self.max_size:
+                    self.starting += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolError("no instance was released in time")
+                self.lock.wait(remaining)
+
+        pooled = None
+        try:
+            pooled = self.start()
+        except Exception as e:
+            self.start_failed(e)
+            raise
+        finally:
+            with self.lock:
+                self.starting -= 1
+                if pooled is not None:
+                    self.leased.add(pooled)
+                    self.stats["leases"] += 1
+                    self.start_failures = 0
+                self.lock.notify_all()
+        return pooled
+
+    def release(self, pooled):
+        """Gives back a PooledInstance obtained with acquire"""
+        healthy = True
+        if pooled.suspect:
+            healthy = self.check(pooled)
+            pooled.suspect = False
+        with self.lock:
+            self.leased.discard(pooled)
+            closed = self.closed
+            if healthy and not closed:
+                pooled.last_used = time.monotonic()
+                self.idle.append(pooled)
+            elif not closed:
+                self.retiring.append(pooled)
+            self.lock.notify_all()
+        if closed:
+            self.stop(pooled)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Leases a PooledInstance for the body of a with statement"""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled
+        finally:
+            self.release(pooled)
+
+    def run(self, program):
+        """Executes program in an instance of the pool"""
+        with self.lease() as pooled:
+            return pooled.run(program)
+
+    def start(self):
+        inst = self.factory()
+        inst.up()
+        with self.lock:
+            self.stats["started"] += 1
+        return PooledInstance(inst)
+
+    def stop(self, pooled):
+        try:
+            pooled.inst.down()
+        except Exception as e:
+            self.last_error = e
+        with self.lock:
+            self.stats["stopped"] += 1
+
+    def check(self, pooled):
+        if self.health_check is None:
+            return True
+        healthy = self.health_check(pooled.inst)
+        pooled.last_check = time.monotonic()
+        if not healthy:
+            with self.lock:
+                self.stats["failed_checks"] += 1
+        return healthy
+
+    def maintain(self):
+        """Body of the background thread"""
+        first = True
+        while True:
+            with self.lock:
+                if not first and not self.closed:
+                    self.lock.wait(self.interval)
+                first = False
+                if self.closed:
+                    return
+                now = time.monotonic()
+                retiring, self.retiring = self.retiring, []
+                while (
+                    self.idle_ttl is not None
+                    and len(self.idle) > self.warm
+                    and now - self.idle[0].last_used > self.idle_ttl
+                ):
+                    retiring.append(self.idle.popleft())
+                due = []
+                if self.health_check is not None:
+                    due = [
+                        p
+                        for p in self.idle
+                        if now - p.last_check >= self.health_interval
+                    ]
+                    for pooled in due:
+                        self.idle.remove(pooled)
+                        self.checking.add(pooled)
+                standby = len(self.idle) + len(self.checking) + self.starting
+                missing = max(0, min(self.warm - standby, self.max_size - self.size))
+                if now < self.next_start:
+                    missing = 0
+                self.starting += missing
+
+            for pooled in retiring:
+                self.stop(pooled)
+
+            for pooled in due:
+                healthy = self.check(pooled)
+                with self.lock:
+                    self.checking.discard(pooled)
+                    keep = healthy and not self.closed
+                    if keep:
+                        self.idle.appendleft(pooled)
+                    self.lock.notify_all()
+                if not keep:
+                    self.stop(pooled)
+
+            failed = False
+            for _ in range(missing):
+                pooled = None
+                # the rest of the refill waits for the backoff of a failure
+                if not failed:
+                    try:
+                        pooled = self.start()
+                    except Exception as e:
+                        failed = True
+                        self.start_failed(e)
+                with self.lock:
+                    self.starting -= 1
+                    if pooled is not None:
+                        if self.closed:
+                            self.retiring.append(pooled)
+                        else:
+                            self.idle.append(pooled)
+                    self.lock.notify_all()
+            if missing and not failed:
+                with self.lock:
+                    self.start_failures = 0
+
+    def start_failed(self, error):
+        """Records a failed bring up, and delays the next one"""
+        with self.lock:
+            self.last_error = error
+            self.start_failures += 1
+            self.stats["failed_starts"] += 1
+            delay = self.backoff * 2 ** (self.start_failures - 1)
+            self.next_start = time.monotonic() + min(delay, self.max_backoff)
+
+    def close(self):
+        """
+        Shuts down the idle instances and the background thread, leased
+        instances are shut down when they are released
+        """
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.thread.join()
+        with self.lock:
+            pooled = list(self.idle) + self.retiring
+            self.idle.clear()
+            self.retiring = []
+        for p in pooled:
+            self.stop(p)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PoolError(Exception):
+    pass
@@ -0,0 +1,119 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sabana import Program
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from sabana_async import AsyncDriver, AsyncDriverGroup, AsyncDriverError
+from sabana_async import program_resources
+
+
+class SleepDriver:
+    """A blocking driver whose programs are a number of seconds to sleep"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.programs = []
+
+    def run(self, program):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.programs.append(program)
+        time.sleep(program)
+        with self.lock:
+            self.in_flight -= 1
+        return [program]
+
+
+def test_async_driver_bounds_in_flight():
+    sleeper = SleepDriver()
+    driver = AsyncDriver(sleeper, max_in_flight=2)
+    programs = [0.02] * 6
+    res = asyncio.run(driver.map(programs))
+    driver.close()
+    assert res == [[p] for p in programs]
+    assert sleeper.max_in_flight == 2
+    assert driver.completed == len(programs)
+
+
+def test_async_driver_group_fans_out():
+    sleepers = [SleepDriver() for _ in range(3)]
+    group = AsyncDriverGroup(sleepers, max_in_flight=1)
+    programs = [0.05 + i / 1000 for i in range(6)]
+    res = asyncio.run(group.map(programs))
+    group.close()
+    assert res == [[p] for p in programs]
+    # two programs for every driver, one at a time
+    assert all(len(s.programs) == 2 for s in sleepers)
+    assert all(s.max_in_flight == 1 for s in sleepers)
+
+
+def gemm_program(suffix=""):
+    """A program of c_sabana_gemm, with names that end in suffix"""
+    program = Program()
+    program.mmio_alloc(name="c0" + suffix, size=0x00010000, base_address=0xA0000000)
+    program.buffer_alloc(name="a" + suffix, size=64)
+    program.buffer_write(np.zeros(16, np.uint32), name="a" + suffix, offset=0)
+    program.buffer_dealloc(name="a" + suffix)
+    program.mmio_dealloc(name="c0" + suffix)
+    return program
+
+
+def test_async_driver_shared_names():
+    class ProgramDriver:
+        def run(self, program):
+            time.sleep(0.05)
+            return [len(program_resources(program))]
+
+    assert len(program_resources(gemm_program())) == 2
+    assert not program_resources(gemm_program()) & program_resources(gemm_program("1"))
+
+    # programs with the same names can not be in flight on one instance
+    driver = AsyncDriver(ProgramDriver(), max_in_flight=2)
+    with pytest.raises(AsyncDriverError, match="share"):
+        asyncio.run(driver.map([gemm_program(), gemm_program()]))
+    assert asyncio.run(driver.map([gemm_program(), gemm_program("1")])) == [[2]] * 2
+    driver.close()
+
+    # one at a time they can
+    driver = AsyncDriver(ProgramDriver())
+    assert asyncio.run(driver.map([gemm_program(), gemm_program()])) == [[2]] * 2
+    driver.close()
+
+
+def test_async_driver_errors():
+    class FailingDriver:
+        def run(self, program):
+            raise RuntimeError("failed")
+
+    driver = AsyncDriver(FailingDriver())
+    with pytest.raises(RuntimeError):
+        asyncio.run(driver.run(None))
+    assert driver.in_flight == 0
+    driver.close()
+    with pytest.raises(AsyncDriverError):
+        AsyncDriver(FailingDriver(), max_in_flight=0)
+    with pytest.raises(AsyncDriverError):
+        AsyncDriverGroup([])
@@ -0,0 +1,82 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sabana.common import ndarray_from_values
+from sabana.responses import is_mmio, is_read, is_write
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from sabana_batch import BatchedGemm, pointer
+
+
+def mmio_writes(program):
+    return [
+        (req.write.offset, ndarray_from_values(req.write.values, req.write.datatype))
+        for req in program.req.requests
+        if is_mmio(req) and is_write(req)
+    ]
+
+
+def test_pointer():
+    assert pointer(0x1_2345_6780).tolist() == [0x23456780, 0x1]
+
+
+def test_batch_program():
+    batch = BatchedGemm(
+        None,
+        pointer_offsets=(0x28, 0x34, 0x40),
+        max_shape=(16, 16, 16),
+        dtype=np.int32,
+        dims_offsets=(0x10, 0x18, 0x20),
+        capacity=8,
+    )
+    batch.addresses = [0x10000, 0x20000, 0x30000]
+    a = np.zeros((3, 4, 8), dtype=np.int32)
+    b = np.zeros((3, 8, 2), dtype=np.int32)
+    program = batch.create_program(a, b)
+
+    # dims, then the pointers and start of every launch
+    writes = mmio_writes(program)
+    assert [(o, v.ravel().tolist()) for o, v in writes[:3]] == [
+        (0x10, [4]),
+        (0x18, [8]),
+        (0x20, [2]),
+    ]
+    launches = writes[3:]
+    assert len(launches) == 3 * 4
+    for i in range(3):
+        pointers = {o: v.ravel().tolist()[0] for o, v in launches[4 * i : 4 * i + 3]}
+        assert pointers == {
+            0x28: 0x10000 + i * 4 * 8 * 4,
+            0x34: 0x20000 + i * 8 * 2 * 4,
+            0x40: 0x30000 + i * 4 * 2 * 4,
+        }
+    reads = [req for req in program.req.requests if is_read(req)]
+    assert len(reads) == 1 and tuple(reads[0].read.shape) == (3, 4, 2)
+
+    # dims are not written again while they do not change
+    batch.dims = (4, 8, 2)
+    assert len(mmio_writes(batch.create_program(a, b))) == 3 * 4
+
+
+def test_batch_shapes():
+    batch = BatchedGemm(None, (0x10, 0x1C, 0x28), (4, 4, 4), np.uint32)
+    with pytest.raises(ValueError):
+        batch.run(np.zeros((2, 4, 4)), np.zeros((3, 4, 4)))
+    with pytest.raises(ValueError):
+        batch.run(np.zeros((2, 2, 4)), np.zeros((2, 4, 4)))
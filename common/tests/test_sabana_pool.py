@@ -0,0 +1,194 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from sabana_async import program_resources
+from sabana_pool import InstancePool, PoolError, mmio_health_check
+
+
+class FakeInstance:
+    """An instance that answers every program, until it is killed"""
+
+    def __init__(self):
+        self.is_up = False
+        self.dead = False
+        self.executed = 0
+
+    def up(self):
+        self.is_up = True
+
+    def down(self):
+        self.is_up = False
+
+    def execute(self, program):
+        if self.dead or not self.is_up:
+            raise RuntimeError("instance is not responding")
+        self.executed += 1
+        return [program]
+
+
+class LeakingInstance(FakeInstance):
+    """An instance whose failed programs leave their names allocated"""
+
+    def __init__(self):
+        super().__init__()
+        self.allocated = set()
+
+    def execute(self, program):
+        names = {name for _, name in program_resources(program)}
+        if names & self.allocated:
+            raise RuntimeError("{} already allocated".format(names & self.allocated))
+        if program == "fail":
+            self.allocated.add("c0")
+            raise RuntimeError("timeout")
+        return super().execute(program)
+
+
+class Factory:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = []
+
+    def __call__(self):
+        inst = FakeInstance()
+        with self.lock:
+            self.created.append(inst)
+        return inst
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_pool_warm_standby():
+    factory = Factory()
+    with InstancePool(warm=2, max_size=3, factory=factory, interval=0.01) as pool:
+        assert pool.wait_ready(timeout=2)
+        assert len(factory.created) == 2
+        with pool.lease() as a:
+            assert a.run("p") == ["p"]
+            # the leased instance is replaced on standby
+            assert wait_for(lambda: len(pool.idle) == 2)
+            with pool.lease() as b:
+                with pool.lease() as c:
+                    assert len({a, b, c}) == 3
+                    with pytest.raises(PoolError):
+                        pool.acquire(timeout=0.01)
+        assert pool.run("q") == ["q"]
+    assert all(not inst.is_up for inst in factory.created)
+
+
+def test_pool_replaces_dead_instances():
+    factory = Factory()
+    with InstancePool(
+        warm=1,
+        factory=factory,
+        health_interval=0.01,
+        interval=0.01,
+    ) as pool:
+        assert pool.wait_ready(timeout=2)
+        factory.created[0].dead = True
+        assert wait_for(lambda: pool.stats["failed_checks"] >= 1)
+        assert wait_for(lambda: len(factory.created) == 2 and len(pool.idle) == 1)
+        assert not factory.created[0].is_up
+        assert pool.run("p") == ["p"]
+
+        # an instance whose program fails is checked when it is released
+        with pytest.raises(RuntimeError):
+            with pool.lease() as inst:
+                inst.inst.dead = True
+                inst.run("p")
+        assert wait_for(lambda: len(factory.created) == 3 and len(pool.idle) == 1)
+
+
+def test_pool_idle_ttl():
+    factory = Factory()
+    with InstancePool(
+        warm=1, max_size=3, idle_ttl=0.05, factory=factory, interval=0.01
+    ) as pool:
+        leases = [pool.acquire() for _ in range(3)]
+        for pooled in leases:
+            pool.release(pooled)
+        assert len(pool.idle) == 3
+        assert wait_for(lambda: len(pool.idle) == 1)
+        assert sum(inst.is_up for inst in factory.created) == 1
+
+
+def test_pool_keeps_instances_after_failed_programs():
+    with InstancePool(warm=0, factory=LeakingInstance, interval=0.01) as pool:
+        with pytest.raises(RuntimeError):
+            with pool.lease() as pooled:
+                pooled.run("fail")
+        # the health check does not collide with the c0 left by the program
+        assert pool.stats["failed_checks"] == 0
+        assert list(pool.idle) == [pooled]
+
+
+def test_pool_acquire_start_failure():
+    def failing():
+        raise RuntimeError("no capacity")
+
+    with InstancePool(warm=0, factory=failing, interval=0.01, backoff=10) as pool:
+        with pytest.raises(RuntimeError):
+            pool.acquire()
+        assert pool.stats["failed_starts"] == 1
+        assert pool.start_failures == 1
+        assert isinstance(pool.last_error, RuntimeError)
+        assert pool.next_start > time.monotonic()
+        assert pool.size == 0
+
+
+def test_pool_start_backoff():
+    factory = Factory()
+    attempts = []
+
+    def failing():
+        attempts.append(time.monotonic())
+        if len(attempts) <= 3:
+            raise RuntimeError("no capacity")
+        return factory()
+
+    with InstancePool(
+        warm=1, factory=failing, interval=0.01, backoff=0.05, max_backoff=0.1
+    ) as pool:
+        assert pool.wait_ready(timeout=2)
+        assert len(attempts) == 4
+        assert pool.stats["failed_starts"] == 3
+        assert pool.start_failures == 0
+        assert isinstance(pool.last_error, RuntimeError)
+        # 0.05, 0.1 and 0.1 seconds after every failure
+        delays = np.diff(attempts)
+        assert np.all(delays >= [0.05, 0.1, 0.1])
+    assert not pool.thread.is_alive()
+
+
+def test_mmio_health_check():
+    inst = FakeInstance()
+    inst.up()
+    assert mmio_health_check(inst)
+    inst.dead = True
+    assert not mmio_health_check(inst)
@@ -0,0 +1,55 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tcu_sabana.driver import Driver, tensil
+from tcu_sabana.simulator import SimulatedInstance
+from tcu_sabana.trace import Tracer
+import numpy as np
+
+
+def bench_model(model_filename, inputs, runs):
+    """
+    Runs a model on a simulated instance and prints where time goes.
+    The simulation itself is part of the dma_send round trips
+    """
+    tracer = Tracer()
+    driver = Driver(instance=SimulatedInstance(tensil), tracer=tracer)
+    driver.load_model(model_filename)
+    tracer.reset()
+    for _ in range(runs):
+        driver.run(inputs)
+    print("{} ({} runs)".format(model_filename, runs))
+    row = "{:<16}{:>8}{:>14}"
+    print(row.format("span", "count", "ms per run"))
+    for name, total in sorted(tracer.totals().items()):
+        print(
+            row.format(name, total["count"], "{:.3f}".format(total["ns"] / runs / 1e6))
+        )
+    for name, value in sorted(tracer.counters.items()):
+        print("{}: {:.1f} per run".format(name, value / runs))
+    print()
+    driver.close()
+
+
+def bench_driver():
+    x = np.zeros(tensil.array_size)
+    x[:2] = 1.0
+    bench_model("./xor4_pb_tensil.tmodel", {"x": x}, 100)
+    img = np.zeros((1024, tensil.array_size))
+    img[:, :3] = np.random.default_rng(0).uniform(-0.5, 0.5, (1024, 3))
+    bench_model("./resnet20v2_cifar_onnx_tensil.tmodel", {"x:0": img}, 3)
+
+
+if __name__ == "__main__":
+    bench_driver()
@@ -0,0 +1,66 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tcu_pynq.instruction import Layout, DataMoveFlag
+from tcu_sabana.driver import tensil
+from tcu_sabana.encoder import InstructionEncoder
+import numpy as np
+import time
+
+
+def gen_program(layout, n):
+    program = []
+    for i in range(n):
+        if i % 4 == 0:
+            program.append(layout.data_move(DataMoveFlag.dram0_to_memory, i, i, 7))
+        elif i % 4 == 1:
+            program.append(layout.matmul(False, i, i, 7))
+        elif i % 4 == 2:
+            program.append(layout.data_move(DataMoveFlag.memory_to_dram0, i, i, 7))
+        else:
+            program.append(layout.no_op())
+    return program
+
+
+def encode_concat(layout, program):
+    prog = bytes()
+    for i in program:
+        prog = prog + layout.to_bytes(i)
+    return np.frombuffer(prog, dtype=np.uint8)
+
+
+def bench(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def bench_encoder():
+    layout = Layout(tensil)
+    encoder = InstructionEncoder(layout)
+    print("instructions\tconcat\t\tencoder\t\tspeedup")
+    for n in (10000, 100000):
+        program = gen_program(layout, n)
+        expected, concat = bench(encode_concat, layout, program)
+        result, encoded = bench(encoder.encode, program)
+        np.testing.assert_array_equal(result, expected)
+        print(
+            "{}\t\t{:.4f}s\t{:.4f}s\t{:.1f}x".format(
+                n, concat, encoded, concat / encoded
+            )
+        )
+
+
+if __name__ == "__main__":
+    bench_encoder()
@@ -0,0 +1,82 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tcu_pynq.data_type import data_type_numpy
+from tcu_pynq.util import vector_to_fixed_point, vector_from_fixed_point
+from tcu_sabana.driver import tensil
+from tcu_sabana.fixed import FixedPointCodec
+import numpy as np
+import time
+
+
+def bench(func, *args, repeat=5):
+    res = func(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return res, (time.perf_counter() - start) / repeat
+
+
+def vectorized_to_fixed(arr):
+    width = tensil.data_type.value.width
+    binary_point = tensil.data_type.value.binary_point
+    return vector_to_fixed_point(width, binary_point)(arr).astype(
+        data_type_numpy(tensil.data_type)
+    )
+
+
+def vectorized_from_fixed(arr):
+    width = tensil.data_type.value.width
+    binary_point = tensil.data_type.value.binary_point
+    return vector_from_fixed_point(width, binary_point)(arr)
+
+
+def bench_fixed_point():
+    codec = FixedPointCodec(tensil.data_type)
+    rng = np.random.default_rng(0)
+    # a resnet20 cifar image padded to the array size, a batch of 32 of
+    # them, and a 32x32x128 activation
+    shapes = {
+        "image": (1024, tensil.array_size),
+        "batch": (32 * 1024, tensil.array_size),
+        "activation": (16384, tensil.array_size),
+    }
+    row = "{:<12}{:<12}{:>12}{:>12}{:>10}"
+    print(row.format("tensor", "direction", "vectorize", "codec", "speedup"))
+    for name, shape in shapes.items():
+        x = rng.uniform(-130.0, 130.0, size=shape)
+        fixed = np.empty(shape, dtype=codec.dtype)
+        floats = np.empty(shape, dtype=np.float64)
+        expected, vectorized = bench(vectorized_to_fixed, x)
+        result, encoded = bench(codec.to_fixed, x, fixed)
+        np.testing.assert_array_equal(result, expected)
+        timings = [("to_fixed", vectorized, encoded)]
+        expected, vectorized = bench(vectorized_from_fixed, result)
+        decoded, encoded = bench(codec.from_fixed, result, floats)
+        np.testing.assert_array_equal(decoded, expected)
+        timings.append(("from_fixed", vectorized, encoded))
+        for direction, vectorized, encoded in timings:
+            print(
+                row.format(
+                    name,
+                    direction,
+                    "{:.5f}s".format(vectorized),
+                    "{:.5f}s".format(encoded),
+                    "{:.1f}x".format(vectorized / encoded),
+                )
+            )
+
+
+if __name__ == "__main__":
+    bench_fixed_point()
@@ -1 +1,3 @@
+set -e
+PYTHONPATH=../../3rd_party/tensil/drivers python3 -m pytest test_completion.py test_fixed_point.py
 PYTHONPATH=../../3rd_party/tensil/drivers python3 test_diagnostics.py
@@ -0,0 +1,160 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+
+class PollPolicy:
+    """
+    PollPolicy describes how to poll a remote instance for the completion
+    of a flush.
+
+    Parameters
+    ----------
+    initial_delay : float
+        Seconds to sleep after the first unsuccessful poll
+    backoff : float
+        Factor applied to the delay after every unsuccessful poll
+    max_delay : float
+        Upper bound in seconds of the delay between polls
+    deadline : float or None
+        Seconds after which polling is aborted, None to poll forever
+    max_polls : int or None
+        Number of polls after which polling is aborted, None for no limit
+    fold_reads : bool
+        Whether reads that depend on the flush are done in the same
+        program as the probe readback. Folding saves a round trip once the
+        flush is complete, but every unsuccessful poll reads all the outputs
+        as well. It pays off when the first poll is expected to succeed,
+        e.g. with an initial_delay close to the run time of the model.
+        False by default, so that polls only read the probe
+    """
+
+    def __init__(
+        self,
+        initial_delay=0.001,
+        backoff=2.0,
+        max_delay=0.1,
+        deadline=30.0,
+        max_polls=None,
+        fold_reads=False,
+    ):
+        if initial_delay < 0 or max_delay < initial_delay:
+            raise CompletionError("delays must satisfy 0 <= initial_delay <= max_delay")
+        if backoff < 1:
+            raise CompletionError("backoff must be greater or equal than 1")
+        if max_polls is not None and max_polls < 1:
+            raise CompletionError("max_polls must be a positive integer")
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.max_polls = max_polls
+        self.fold_reads = fold_reads
+
+    def delay(self, polls):
+        """Returns the seconds to sleep after polls unsuccessful polls"""
+        return min(self.initial_delay * self.backoff ** (polls - 1), self.max_delay)
+
+
+class FlushStats:
+    """
+    FlushStats accumulates the number of polls and the time it takes
+    for flushes to complete.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.flushes = 0
+        self.polls = 0
+        self.seconds = 0.0
+        self.max_polls = 0
+        self.max_seconds = 0.0
+        self.last_polls = 0
+        self.last_seconds = 0.0
+
+    def record(self, polls, seconds):
+        self.flushes += 1
+        self.polls += polls
+        self.seconds += seconds
+        self.max_polls = max(self.max_polls, polls)
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.last_polls = polls
+        self.last_seconds = seconds
+
+    @property
+    def polls_per_flush(self):
+        return self.polls / self.flushes if self.flushes else 0.0
+
+    @property
+    def seconds_per_flush(self):
+        return self.seconds / self.flushes if self.flushes else 0.0
+
+    def as_dict(self):
+        return {
+            "flushes": self.flushes,
+            "polls": self.polls,
+            "seconds": self.seconds,
+            "polls_per_flush": self.polls_per_flush,
+            "seconds_per_flush": self.seconds_per_flush,
+            "max_polls": self.max_polls,
+            "max_seconds": self.max_seconds,
+            "last_polls": self.last_polls,
+            "last_seconds": self.last_seconds,
+        }
+
+
+def poll(check, policy, stats=None):
+    """
+    Calls check until it returns something other than None, sleeping
+    between calls as described by policy, and returns that value.
+    Raises FlushTimeout when the policy's deadline or max_polls are reached,
+    check is called one last time at the deadline.
+    """
+    start = time.perf_counter()
+    polls = 0
+    while True:
+        res = check()
+        polls += 1
+        elapsed = time.perf_counter() - start
+        if res is not None:
+            if stats is not None:
+                stats.record(polls, elapsed)
+            return res
+        if policy.max_polls is not None and polls >= policy.max_polls:
+            raise FlushTimeout(
+                "flush not completed after {} polls in {:.3}s".format(polls, elapsed)
+            )
+        delay = policy.delay(polls)
+        if policy.deadline is not None:
+            # the last sleep is cut short, so that the last poll is at the deadline
+            remaining = policy.deadline - elapsed
+            if remaining <= 0:
+                raise FlushTimeout(
+                    "flush not completed after {} polls in {:.3}s".format(
+                        polls, elapsed
+                    )
+                )
+            delay = min(delay, remaining)
+        time.sleep(delay)
+
+
+class CompletionError(Exception):
+    pass
+
+
+class FlushTimeout(CompletionError):
+    pass
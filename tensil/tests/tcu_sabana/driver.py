@@ -12,14 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+
 import numpy as np
 from sabana import Instance, Program
-from tcu_pynq.util import (
-    div_ceil,
-    parent_dir,
-    vector_to_fixed_point,
-    vector_from_fixed_point,
-)
+from tcu_pynq.util import div_ceil, parent_dir
 
 from tcu_pynq.data_type import data_type_numpy
 from tcu_pynq.instruction import Layout
@@ -28,6 +28,11 @@ from tcu_pynq.config import Register, Constant
 from tcu_pynq.model import model_from_json
 from tcu_pynq.data_type import DataType
 from tcu_pynq.architecture import Architecture
+from tcu_sabana.encoder import InstructionEncoder
+from tcu_sabana.completion import PollPolicy, FlushStats, poll
+from tcu_sabana.fixed import FixedPointCodec
+from tcu_sabana.trace import Tracer, execute, traced
+from tcu_sabana.simulator import SimulatedInstance
 
 
 tensil = Architecture(
@@ -45,10 +50,98 @@ tensil = Architecture(
 )
 
 
-def buffer_chunk_write(data=None, buffer=None, inst=None, offset=None, chunk_size=None):
+# Largest payload supported by a single buffer write in Sabana
+MAX_CHUNK_SIZE = 1 << 20
+# Largest request accepted by the Sabana transport is 5 MBytes of JSON,
+# some headroom is left for the rest of the request
+MAX_REQUEST_SIZE = (1 << 20) * 5 - (1 << 16)
+# Smallest instructions DMA staging buffer, in instructions
+MIN_STAGING_INSTRUCTIONS = 32
+
+WriteBatch = namedtuple("WriteBatch", ["chunks", "nbytes", "request_bytes", "seconds"])
+# A flush probe: the source vector, holding the current generation, is
+# copied to the target vector by instructions resident in buffer_name,
+# sent to the DMA after the instructions to flush
+FlushProbe = namedtuple(
+    "FlushProbe", ["source_array_addr", "target_array_addr", "source", "buffer_name"]
+)
+# A pipeline slot: a dram0 region, offset in vectors, with its own
+# resident program and flush probe
+Slot = namedtuple("Slot", ["offset", "program_buffer_name", "probe"])
+# A model loaded in the driver: its consts start dram1_offset vectors
+# past the bases in the model file, its program is resident in
+# program_buffer_name
+LoadedModel = namedtuple(
+    "LoadedModel",
+    ["model", "program", "program_buffer_name", "dram1_offset", "slots"],
+)
+
+
+def map_file(filename):
+    """
+    Returns the contents of a file as a read-only np.uint8 array, mapped
+    instead of read. Empty files, which can not be mapped, give an empty array
+    """
+    if os.path.getsize(filename) == 0:
+        data = np.fromfile(filename, dtype=np.uint8)
+        data.flags.writeable = False
+        return data
+    return np.memmap(filename, dtype=np.uint8, mode="r")
+
+
+@lru_cache(maxsize=None)
+def literal_sizes(dtype):
+    """
+    Returns a table with the length of the decimal literal of every value
+    of a 8 or 16 bits integer dtype, indexed by its unsigned bit pattern
+    """
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype("u{}".format(dtype.itemsize))
+    values = np.arange(1 << (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+    return np.array([len(str(v)) for v in values.tolist()], dtype=np.int64)
+
+
+def encoded_size(data):
+    """
+    Estimates the number of bytes data takes once serialized into the JSON
+    request sent to Sabana: one decimal literal and a separator per element
+    """
+    if np.issubdtype(data.dtype, np.integer) and data.dtype.itemsize <= 2:
+        unsigned = np.dtype("u{}".format(data.dtype.itemsize))
+        counts = np.bincount(
+            data.reshape(-1).view(unsigned), minlength=1 << (8 * data.itemsize)
+        )
+        return int(counts @ literal_sizes(data.dtype.str)) + 2 * data.size
+    if np.issubdtype(data.dtype, np.integer):
+        # wide integers are bounded by their longest literal, 64 bits
+        # integers are quoted by protobuf's JSON mapping
+        widest = len(str(np.iinfo(data.dtype).min)) + 2 * (data.itemsize == 8)
+        return (widest + 2) * data.size
+    # shortest round-trip repr of a float32 is at most 15 characters
+    return 17 * data.size
+
+
+def buffer_chunk_write(
+    data=None,
+    buffer=None,
+    inst=None,
+    offset=None,
+    chunk_size=None,
+    request_size=None,
+    debug=False,
+    tracer=None,
+):
     """
     Executes buffer writes in chunks of 1MBytes, the largest
-    supported payload by xfer in Sabana
+    supported payload by xfer in Sabana.
+
+    Chunks whose literals alone do not fit in a request are split in
+    halves until they do. Chunks are coalesced into as few programs as
+    possible, each one holding as many buffer writes as fit in a single
+    request to Sabana.
+    Returns a list of WriteBatch with the number of chunks, the bytes
+    written, the estimated request size and the latency of every program.
+    Every program is recorded by tracer as an upload round trip.
     """
     if not isinstance(data, np.ndarray):
         raise RuntimeError("Buffer chunk write error: data must be a numpy array")
@@ -58,7 +151,7 @@ def buffer_chunk_write(data=None, buffer=None, inst=None, offset=None, chunk_siz
         raise RuntimeError(
             "Buffer chunk write error: offset needds to be a positive integer"
         )
-    if not isinstance(inst, Instance):
+    if not isinstance(inst, (Instance, SimulatedInstance)):
         raise RuntimeError(
             "Buffer chunk write error: inst must be of type sabana.Instance"
         )
@@ -67,33 +160,76 @@ def buffer_chunk_write(data=None, buffer=None, inst=None, offset=None, chunk_siz
             "Buffer chunk write error: the instance must be up before invoking buffer-chunk-write"
         )
 
-    max_chunk_size = 1 << 20
     if chunk_size is None:
-        chunk_size = max_chunk_size
+        chunk_size = MAX_CHUNK_SIZE
     else:
-        if chunk_size > max_chunk_size:
+        if chunk_size > MAX_CHUNK_SIZE:
             raise RuntimeError(
-                f"Chunk size must be a positive integer smaller than: {max_chunk_size}"
+                f"Chunk size must be a positive integer smaller than: {MAX_CHUNK_SIZE}"
             )
-    total_length = data.nbytes
-    bytes_left = total_length
-    for i in range(div_ceil(total_length, chunk_size)):
-        prog = Program()
-        iter_offset = i * chunk_size
-        chunk = chunk_size if bytes_left > chunk_size else bytes_left
-        top = iter_offset + chunk
-        prog.buffer_write(
-            data=data[iter_offset:top], name=buffer, offset=offset + iter_offset
-        )
+    if request_size is None:
+        request_size = MAX_REQUEST_SIZE
+    if tracer is None:
+        tracer = Tracer(enabled=False)
+
+    # chunks are sliced in elements of data, offsets are given in bytes
+    data = data.reshape(-1)
+    chunk_elements = max(chunk_size // data.itemsize, 1)
+    batches = []
+    prog = Program()
+    chunks = 0
+    nbytes = 0
+    request_bytes = 0
+
+    def execute_batch():
+        start = time.perf_counter()
         try:
-            inst.execute(program=prog)
+            execute(inst, prog, tracer, "upload", buffer=buffer, bytes=nbytes)
         except Exception as e:
-            print(f"Failed buffer chunk write on iteration {i}")
+            print(f"Failed buffer chunk write on batch {len(batches)}")
             print(str(e))
             inst.down()
             raise RuntimeError() from e
-        else:
-            bytes_left = bytes_left - chunk
+        batch = WriteBatch(chunks, nbytes, request_bytes, time.perf_counter() - start)
+        tracer.count("bytes_written", nbytes)
+        if debug:
+            print(
+                "{} buffer: wrote {} chunks, {} bytes in {:.3}s".format(
+                    buffer, batch.chunks, batch.nbytes, batch.seconds
+                )
+            )
+        batches.append(batch)
+
+    def split(start, chunk):
+        """Yields the pieces of a chunk that fit in a request, by offset"""
+        size = encoded_size(chunk)
+        if size <= request_size or chunk.size == 1:
+            yield start, chunk, size
+            return
+        half = chunk.size // 2
+        yield from split(start, chunk[:half])
+        yield from split(start + half, chunk[half:])
+
+    for i in range(div_ceil(data.size, chunk_elements)):
+        chunk = data[i * chunk_elements : (i + 1) * chunk_elements]
+        for start, piece, size in split(i * chunk_elements, chunk):
+            if chunks > 0 and request_bytes + size > request_size:
+                execute_batch()
+                prog = Program()
+                chunks = 0
+                nbytes = 0
+                request_bytes = 0
+            prog.buffer_write(
+                data=piece,
+                name=buffer,
+                offset=offset + start * data.itemsize,
+            )
+            chunks += 1
+            nbytes += piece.nbytes
+            request_bytes += size
+    if chunks > 0:
+        execute_batch()
+    return batches
 
 
 class Mem:
@@ -107,6 +243,7 @@ class Mem:
         data_type,
         name,
         debug=False,
+        tracer=None,
     ):
         """
         Instantiates the contiguous array of memory that will be accessible to the fabric,
@@ -122,8 +259,10 @@ class Mem:
             The name of the buffer to use in the deployed instance
         debug: bool
             Whether to print debug messages
+        tracer: Tracer
+            Records reads and writes, disabled by default
         """
-        if isinstance(inst, Instance):
+        if isinstance(inst, (Instance, SimulatedInstance)):
             self.inst = inst
         else:
             raise RuntimeError("inst is not a sabana Instance object")
@@ -135,6 +274,7 @@ class Mem:
 
         self.data_type = data_type
         self.debug = debug
+        self.tracer = Tracer(enabled=False) if tracer is None else tracer
         self.data_type_numpy = data_type_numpy(self.data_type)
         self.data_type_numpy_size_bytes = self.data_type_numpy(0).nbytes
 
@@ -153,14 +293,20 @@ class Mem:
             offset_bytes = offset * self.data_type_numpy_size_bytes
         if self.debug:
             print(f"{self.name} Mem: doing write of {data.nbytes} bytes")
-        buffer_chunk_write(
-            data=data, buffer=self.name, offset=offset_bytes, inst=self.inst
+        return buffer_chunk_write(
+            data=data,
+            buffer=self.name,
+            offset=offset_bytes,
+            inst=self.inst,
+            debug=self.debug,
+            tracer=self.tracer,
         )
 
     def write_bytes(self, offset_bytes, data):
         """
         writes bytes to this mem object
-        data must be a bytes object
+        data must be a bytes object or a np.uint8 array, such as a np.memmap,
+        which is written without copies
         offset_bytes must be a positive int
         """
         if offset_bytes % self.data_type_numpy_size_bytes != 0:
@@ -171,13 +317,19 @@ class Mem:
                     self.data_type_numpy_size_bytes,
                 )
             )
-        if not isinstance(data, bytes):
-            raise MemException("data needs to be bytes fro write_bytes")
-        data = np.frombuffer(data, dtype=np.uint8)
+        if isinstance(data, bytes):
+            data = np.frombuffer(data, dtype=np.uint8)
+        elif not isinstance(data, np.ndarray) or data.dtype != np.uint8:
+            raise MemException("data needs to be bytes or np.uint8 for write_bytes")
         if self.debug:
             print(f"{self.name} Mem: doing write-bytes of {data.nbytes} bytes")
-        buffer_chunk_write(
-            data=data, buffer=self.name, offset=offset_bytes, inst=self.inst
+        return buffer_chunk_write(
+            data=data,
+            buffer=self.name,
+            offset=offset_bytes,
+            inst=self.inst,
+            debug=self.debug,
+            tracer=self.tracer,
         )
 
     def read(self, offset, size):
@@ -187,13 +339,53 @@ class Mem:
         else:
             offset_bytes = offset * self.data_type_numpy_size_bytes
         prog = Program()
+        self.add_read(prog, offset, size)
+        res = execute(self.inst, prog, self.tracer, "read", buffer=self.name)
+        self.tracer.count("bytes_read", res[0].nbytes)
+        return res[0]
+
+    def read_many(self, reads):
+        """
+        reads a list of (offset, size) pairs in a single program,
+        returns a list of np.array of type self.data_type_numpy
+        """
+        prog = Program()
+        for offset, size in reads:
+            self.add_read(prog, offset, size)
+        res = execute(self.inst, prog, self.tracer, "read", buffer=self.name)
+        self.tracer.count("bytes_read", sum(r.nbytes for r in res))
+        return res
+
+    def add_write(self, prog, offset, data):
+        """
+        appends a write of data at offset to the program prog,
+        data must be an np.array of type self.data_type_numpy
+        """
+        if data.dtype != self.data_type_numpy:
+            raise MemException(
+                "data type must be {}, got {}".format(self.data_type_numpy, data.dtype)
+            )
+        if not isinstance(offset, int) or offset < 0:
+            raise RuntimeError("offset must be a positive integer")
+        prog.buffer_write(
+            data.reshape(-1),
+            name=self.name,
+            offset=offset * self.data_type_numpy_size_bytes,
+        )
+
+    def add_read(self, prog, offset, size):
+        """
+        appends a read of size elements at offset to the program prog,
+        its result is an np.array of type self.data_type_numpy
+        """
+        if not isinstance(offset, int) or offset < 0:
+            raise RuntimeError("offset must be a positive integer")
         prog.buffer_read(
             name=self.name,
-            offset=offset_bytes,
+            offset=offset * self.data_type_numpy_size_bytes,
             dtype=self.data_type_numpy,
             shape=(size,),
         )
-        return self.inst.execute(prog)[0]
 
     def compare(self, offset, data):
         """returns boolean"""
@@ -231,8 +423,11 @@ class Driver:
 
     def __init__(
         self,
-        image,
+        image=None,
         debug=False,
+        poll_policy=None,
+        tracer=None,
+        instance=None,
     ):
         """
         Sets up drivers for the AXI DMA core using the Xlnk memory mapper helper
@@ -244,13 +439,24 @@ class Driver:
             An instance of Architecture containing architecture parameters
         debug : bool (optional)
             Enable debug messages
+        poll_policy : PollPolicy (optional)
+            How to poll for flush completion, defaults to PollPolicy()
+        tracer : Tracer (optional)
+            Records the time spent in every phase of the driver, bytes
+            moved and round trips, disabled by default
+        instance : SimulatedInstance (optional)
+            Runs the driver against a simulated instance instead of
+            deploying image
         """
         if debug:
             print("initializing instance")
 
-        if not isinstance(image, str) or len(image) == 0:
+        if instance is not None:
+            self.inst = instance
+        elif not isinstance(image, str) or len(image) == 0:
             raise RuntimeError("image must be a non-empty string")
-        self.inst = Instance(image=image, verbose=debug)
+        else:
+            self.inst = Instance(image=image, verbose=debug)
         self.is_up = False
         self.arch = tensil
         self.dma_name = "inst"
@@ -261,8 +467,28 @@ class Driver:
         self.array_size_in_bytes = self.array_size_in_scalar * self.scalar_bytes
         self.debug = debug
         self.model = None
+        self.program = None
+        # buffer the programs of load_model are loaded to by default
+        self.program_buffer_name = "b_prog"
+        # buffer holding the instructions of the loaded model
+        self.model_buffer_name = self.program_buffer_name
+        # vectors by which the consts of the loaded model are moved up in dram1
+        self.dram1_offset = 0
+        # sizes of the resident program buffers
+        self.program_buffers = dict()
+        # slots used by run_stream, created on first use
+        self.slots = None
+        # instructions DMA staging buffers, by name, with the number of
+        # bytes past which they hold only no-ops, or None once a failed
+        # write left them in an unknown state
+        self.staging_buffers = dict()
+        self.poll_policy = PollPolicy() if poll_policy is None else poll_policy
+        self.flush_stats = FlushStats()
+        self.tracer = Tracer(enabled=False) if tracer is None else tracer
 
+        self.codec = FixedPointCodec(self.arch.data_type)
         self.layout = Layout(self.arch)
+        self.encoder = InstructionEncoder(self.layout)
         if self.debug:
             print("Instruction size in bits, operand sizes in bits:")
             print(self.layout)
@@ -288,7 +514,7 @@ class Driver:
             # deploy instance
             self.inst.up()
             print("Instance deployed...")
-            res = self.inst.execute(prog)
+            res = execute(self.inst, prog, self.tracer, "allocate")
         except Exception as e:
             print(str(e))
             print("resource allocation failed")
@@ -321,17 +547,20 @@ class Driver:
             self.arch.data_type,
             self.dram0_name,
             debug=self.debug,
+            tracer=self.tracer,
         )
         self.dram1 = Mem(
             self.inst,
             self.arch.data_type,
             self.dram1_name,
             debug=self.debug,
+            tracer=self.tracer,
         )
 
         if self.debug:
             print(f"dram0 instruction offset: {self.dram0_addr_offset}")
             print(f"dram1 instruction offset: {self.dram1_addr_offset}")
+        self.init_flush_probe()
         # set address offsets
         self.configure(
             (Register.DRAM0_ADDRESS_OFFSET, self.dram0_addr_offset),
@@ -345,223 +574,694 @@ class Driver:
         self.close()
 
     def close(self):
-        if isinstance(self.inst, Instance) and self.inst.is_up:
+        if isinstance(self.inst, (Instance, SimulatedInstance)) and self.inst.is_up:
             self.inst.down()
             self.inst = None
             self.is_up = False
 
-    def dma_write(self, data):
+    def staging_buffer(self, nbytes):
+        """
+        Returns the name and size of the staging buffer for a DMA write of
+        nbytes. Staging buffers are kept in the instance and their sizes are
+        powers of two instructions, so most writes reuse a buffer and are
+        padded with at most as many no-ops as instructions written
+        """
+        count = max(
+            div_ceil(nbytes, self.layout.instruction_size_bytes),
+            MIN_STAGING_INSTRUCTIONS,
+        )
+        size = self.encoder.nbytes(1 << (count - 1).bit_length())
+        return "b_inst{}".format(size), size
+
+    def drop_staging_buffer(self, buffer_name):
+        """
+        Deallocates a staging buffer left in an unknown state by a failed
+        write. The failed request may not have allocated it, so a failed
+        deallocation is ignored
+        """
+        prog = Program()
+        prog.buffer_dealloc(name=buffer_name)
+        try:
+            execute(self.inst, prog, self.tracer, "deallocate")
+        except Exception as e:
+            if self.debug:
+                print(f"{buffer_name} was not allocated: {e}")
+        self.staging_buffers.pop(buffer_name, None)
+
+    @traced("dma_write")
+    def dma_write(self, data, prog=None):
         """
-        Writes a numpy array to the instructions DMA
+        Writes a numpy array of instructions to the instructions DMA, through
+        a staging buffer that stays allocated in the instance. The DMA sends
+        the whole buffer, so the rest of it is filled with no-ops.
+
+        prog is an optional Program with operations to execute in the
+        same request, right before the DMA send
         """
-        # TODO: Improve handling dealloc if anything fails
         if self.debug:
             print("-- dma-write")
-        sprog = Program()
-        buffer_name = "b_inst"
-        sprog.buffer_alloc(name=buffer_name, size=data.nbytes)
+        buffer_name, size = self.staging_buffer(data.nbytes)
+        if buffer_name in self.staging_buffers and (
+            self.staging_buffers[buffer_name] is None
+        ):
+            self.drop_staging_buffer(buffer_name)
+        new = buffer_name not in self.staging_buffers
+        if new:
+            # the contents of a new buffer are unknown
+            self.staging_buffers[buffer_name] = size
+
+        # only the no-ops overwriting a previous, longer, write are needed
+        padded = max(data.nbytes, self.staging_buffers[buffer_name])
+        if padded > data.nbytes:
+            no_op = self.encoder.encode([self.layout.no_op()])
+            staged = np.tile(no_op, padded // no_op.size)
+            staged[: data.nbytes] = data.reshape(-1).view(np.uint8)
+        else:
+            staged = data.reshape(-1).view(np.uint8)
 
+        sprog = Program() if prog is None else prog
         try:
-            self.inst.execute(program=sprog)
+            # small writes go in the same request as the DMA send
+            if encoded_size(staged) < MAX_REQUEST_SIZE // 2:
+                if new:
+                    sprog.buffer_alloc(name=buffer_name, size=size)
+                sprog.buffer_write(staged, name=buffer_name, offset=0)
+                self.tracer.count("bytes_written", staged.nbytes)
+            else:
+                if new:
+                    aprog = Program()
+                    aprog.buffer_alloc(name=buffer_name, size=size)
+                    execute(self.inst, aprog, self.tracer, "allocate")
+                buffer_chunk_write(
+                    data=staged,
+                    buffer=buffer_name,
+                    offset=0,
+                    inst=self.inst,
+                    debug=self.debug,
+                    tracer=self.tracer,
+                )
+            sprog.dma_send_write(name=self.dma_name, src=buffer_name)
+            sprog.dma_send_wait(name=self.dma_name, timeout=3)
+            execute(self.inst, sprog, self.tracer, "dma_send", bytes=size)
         except Exception as e:
-            msg = "Error during buffer allocation for dma-write"
+            # the buffer may be allocated, it is reallocated on its next use
+            self.staging_buffers[buffer_name] = None
+            msg = "Error during dma write for dma-write"
             print(msg)
             print(str(e))
             raise RuntimeError(msg)
+        self.staging_buffers[buffer_name] = data.nbytes
 
-        buffer_chunk_write(data=data, buffer=buffer_name, offset=0, inst=self.inst)
+    def dma_send(self, buffer_names, prog=None):
+        """
+        Sends the contents of a list of already written buffers, in order,
+        to the instructions DMA in a single request
+
+        prog is an optional Program with operations to execute in the
+        same request, right before the DMA send
+        """
+        if self.debug:
+            print(f"-- dma-send from {buffer_names}")
+        sprog = Program() if prog is None else prog
+        for buffer_name in buffer_names:
+            sprog.dma_send_write(name=self.dma_name, src=buffer_name)
+            sprog.dma_send_wait(name=self.dma_name, timeout=3)
+        nbytes = sum(self.program_buffers.get(name, 0) for name in buffer_names)
+        try:
+            execute(self.inst, sprog, self.tracer, "dma_send", bytes=nbytes)
+        except Exception as e:
+            msg = "Error during dma send for dma-send"
+            print(msg)
+            print(str(e))
+            raise RuntimeError(msg)
+
+    @traced("load_program")
+    def load_program(self, data, buffer_name=None):
+        """
+        Writes a numpy array of instructions to a buffer that stays resident
+        in the instance, replacing the program previously loaded in it.
+        The program is executed with dma_send([buffer_name]).
 
+        buffer_name defaults to self.program_buffer_name
+        """
+        if buffer_name is None:
+            buffer_name = self.program_buffer_name
+        if self.debug:
+            print(f"-- load program of {data.nbytes} bytes to {buffer_name}")
         sprog = Program()
-        sprog.dma_send_write(name=self.dma_name, src="b_inst")
-        sprog.dma_send_wait(name=self.dma_name, timeout=3)
-        sprog.buffer_dealloc(name="b_inst")
+        if buffer_name in self.program_buffers:
+            sprog.buffer_dealloc(name=buffer_name)
+        sprog.buffer_alloc(name=buffer_name, size=data.nbytes)
         try:
-            self.inst.execute(program=sprog)
+            execute(self.inst, sprog, self.tracer, "allocate")
         except Exception as e:
-            msg = "Error during dma write for dma-write"
+            self.program_buffers.pop(buffer_name, None)
+            msg = "Error during buffer allocation for load-program"
             print(msg)
             print(str(e))
             raise RuntimeError(msg)
+        self.program_buffers[buffer_name] = data.nbytes
+
+        buffer_chunk_write(
+            data=data,
+            buffer=buffer_name,
+            offset=0,
+            inst=self.inst,
+            debug=self.debug,
+            tracer=self.tracer,
+        )
+
+    def write_instructions(self, instructions, prog=None):
+        """
+        instructions should be a sequence of ints, or a structured array
+        of dtype self.encoder.dtype
 
-    def write_instructions(self, instructions):
-        """instructions should be a sequence of ints"""
+        prog is an optional Program with operations to execute in the
+        same request as the instructions DMA send
+        """
         if self.debug:
             print("-- write instructions")
-        prog = bytes()
-        for i in instructions:
-            prog = prog + self.layout.to_bytes(i)
+        with self.tracer.span("encode", instructions=len(instructions)):
+            prog_numpy = self.encoder.encode(instructions)
 
         if self.debug:
             print("Instruction Size Bytes: ", self.layout.instruction_size_bytes)
-        prog_numpy = np.frombuffer(prog, dtype=np.uint8)
-        self.dma_write(prog_numpy)
+        self.dma_write(prog_numpy, prog)
 
     def configure(self, *pairs):
         if self.debug:
             print("-- configure")
             print(pairs)
+        prog = Program()
         program = [
             self.layout.configure(register.value, value) for register, value in pairs
-        ] + self.prepare_flush_probe()
-        self.write_instructions(program)
+        ] + self.prepare_flush_probe(prog)
+        self.write_instructions(program, prog)
         self.wait_for_flush()
 
     def run_load_consts(self, offset, size):
         if self.debug:
             print("loading constants to local")
+        prog = Program()
         program = [
             self.layout.data_move(
                 DataMoveFlag.dram1_to_memory, offset, offset, size - 1
             )
-        ] + self.prepare_flush_probe()
-        self.write_instructions(program)
+        ] + self.prepare_flush_probe(prog)
+        self.write_instructions(program, prog)
         self.wait_for_flush()
 
-    def load_model(self, model_filename):
-        self.model_filename = model_filename
-        with open(self.model_filename, "r") as f:
-            self.model = model_from_json(f.read())
+    def read_model(self, model_filename):
+        """
+        Reads a model file, checking that it targets the driver architecture.
+        Returns the model and its program image, mapped read-only
+        """
+        with open(model_filename, "r") as f:
+            model = model_from_json(f.read())
         # check that model arch matches driver arch
-        if not (self.model.arch == self.arch):
+        if not (model.arch == self.arch):
             raise Exception(
                 "model requires architecture {} but current architecture is {}".format(
-                    self.model.arch, self.arch
+                    model.arch, self.arch
                 )
             )
+        d = parent_dir(model_filename) + "/"
+        program = map_file(d + model.prog.file_name)
+        return model, program
+
+    def const_moves(self, model, dram1_offset=0):
+        """
+        Returns the instructions moving the consts of model, loaded
+        dram1_offset vectors up in dram1, to their bases in local memory
+        """
+        return [
+            self.layout.data_move(
+                DataMoveFlag.dram1_to_memory,
+                const.base,
+                const.base + dram1_offset,
+                const.size - 1,
+            )
+            for const in model.consts
+        ]
+
+    @traced("load_model")
+    def load_model(self, model_filename, dram1_offset=0, program_buffer_name=None):
+        """
+        Loads the consts and the program of a model.
+
+        dram1_offset moves the consts, and every dram1 address in the
+        program, that many vectors up in dram1, so that several models can
+        be resident at once. The program is loaded to program_buffer_name,
+        which defaults to self.program_buffer_name: the name is only used
+        for this model, the next load_model without one uses the default
+        """
+        model, program = self.read_model(model_filename)
+        if program_buffer_name is None:
+            program_buffer_name = self.program_buffer_name
+        if dram1_offset != 0:
+            instructions = self.encoder.decode(program)
+            size = self.dram_extent(instructions, 1, model)
+            if dram1_offset < 0 or dram1_offset + size > self.arch.dram1_depth:
+                raise RuntimeError(
+                    "model uses {} vectors of dram1, which do not fit at {}".format(
+                        size, dram1_offset
+                    )
+                )
+            instructions["operand1"][self.dram_moves(instructions, 1)] += np.uint64(
+                dram1_offset
+            )
+            with self.tracer.span("encode", instructions=instructions.size):
+                program = self.encoder.encode(instructions)
+            program.flags.writeable = False
+        self.model_filename = model_filename
+        self.model = model
+        self.dram1_offset = dram1_offset
+
         # load consts and program
         d = parent_dir(self.model_filename) + "/"
         for const in self.model.consts:
-            with open(d + const.file_name, "rb") as f:
-                self.dram1.write_bytes(
-                    const.base
-                    * self.arch.array_size
-                    * self.dram1.data_type_numpy_size_bytes,
-                    f.read(),
+            self.dram1.write_bytes(
+                (const.base + dram1_offset)
+                * self.arch.array_size
+                * self.dram1.data_type_numpy_size_bytes,
+                map_file(d + const.file_name),
+            )
+        # all consts are moved to local with a single flush, which runs
+        # while the program is being uploaded
+        moves = []
+        if self.model.load_consts_to_local:
+            moves = self.const_moves(self.model, dram1_offset)
+        if len(moves) > 0:
+            if self.debug:
+                print("loading constants to local")
+            prog = Program()
+            self.write_instructions(moves + self.prepare_flush_probe(prog), prog)
+        # without an offset the program image is mapped read-only, never
+        # copied in memory
+        self.program = memoryview(program)
+
+        # keep the program resident in the instance, every run only needs
+        # to send it, followed by the flush probe, to the DMA
+        self.slots = None
+        self.model_buffer_name = program_buffer_name
+        self.load_program(
+            np.frombuffer(self.program, dtype=np.uint8), program_buffer_name
+        )
+        if len(moves) > 0:
+            self.wait_for_flush()
+
+    def loaded_model(self):
+        """Returns the LoadedModel currently used by run"""
+        return LoadedModel(
+            self.model,
+            self.program,
+            self.model_buffer_name,
+            self.dram1_offset,
+            self.slots,
+        )
+
+    def activate_model(self, loaded):
+        """
+        Makes a LoadedModel, whose consts and program are still resident,
+        the one used by run. Consts of models that load them to local
+        memory are moved there again, as other models may have overwritten it
+        """
+        self.model = loaded.model
+        self.program = loaded.program
+        self.model_buffer_name = loaded.program_buffer_name
+        self.dram1_offset = loaded.dram1_offset
+        self.slots = loaded.slots
+        if self.model.load_consts_to_local and len(self.model.consts) > 0:
+            if self.debug:
+                print("reloading constants to local")
+            prog = Program()
+            moves = self.const_moves(self.model, self.dram1_offset)
+            self.write_instructions(moves + self.prepare_flush_probe(prog), prog)
+            self.wait_for_flush()
+
+    def unload_program(self, buffer_name):
+        """Deallocates a resident program buffer, if it exists"""
+        if buffer_name not in self.program_buffers:
+            return
+        prog = Program()
+        prog.buffer_dealloc(name=buffer_name)
+        try:
+            execute(self.inst, prog, self.tracer, "deallocate")
+        except Exception as e:
+            msg = "Error during buffer deallocation for unload-program"
+            print(msg)
+            print(str(e))
+            raise RuntimeError(msg)
+        finally:
+            self.program_buffers.pop(buffer_name, None)
+
+    def dram_moves(self, instructions, dram=0):
+        """
+        Returns a boolean mask of the data moves from or to dram0, or dram1
+        if dram is 1, in a structured array of instructions
+        """
+        if dram == 0:
+            flags = [DataMoveFlag.dram0_to_memory, DataMoveFlag.memory_to_dram0]
+        else:
+            flags = [DataMoveFlag.dram1_to_memory, DataMoveFlag.memory_to_dram1]
+        return (instructions["opcode"] == self.encoder.opcodes["data_move"]) & np.isin(
+            instructions["flags"], [f.value for f in flags]
+        )
+
+    def dram_extent(self, instructions, dram=0, model=None):
+        """
+        Returns the number of vectors of dram0, or dram1 if dram is 1,
+        used by model, from its inputs and outputs, or its consts, and the
+        data moves in instructions. model defaults to the loaded model.
+        Addresses are followed by the log2 of the stride in the operand
+        """
+        model = self.model if model is None else model
+        moves = self.dram_moves(instructions, dram)
+        depth = self.arch.dram0_depth if dram == 0 else self.arch.dram1_depth
+        address_bits = (depth - 1).bit_length()
+        operand = instructions["operand1"][moves]
+        address = operand & np.uint64((1 << address_bits) - 1)
+        stride = np.uint64(1) << (operand >> np.uint64(address_bits))
+        end = address + instructions["operand2"][moves] * stride + np.uint64(1)
+        extent = int(end.max()) if end.size > 0 else 0
+        regions = model.inputs + model.outputs if dram == 0 else model.consts
+        for region in regions:
+            extent = max(extent, region.base + region.size)
+        return extent
+
+    def pipeline_slots(self):
+        """
+        Returns the two slots used by run_stream. Slot 0 is the program
+        loaded by load_model, slot 1 a copy of it with every dram0 address
+        moved past the region of dram0 used by the model, and its own
+        flush probe. The copy is made and loaded on the first call.
+        """
+        if self.slots is not None:
+            return self.slots
+        if self.model is None:
+            raise Exception("model not loaded: please run driver.load_model first")
+        instructions = self.encoder.decode(np.frombuffer(self.program, np.uint8))
+        region = self.dram_extent(instructions)
+        probe = FlushProbe(
+            self.probe_source_array_addr - 2,
+            self.probe_target_array_addr - 2,
+            self.probe_source.copy(),
+            self.flush_probe.buffer_name + "1",
+        )
+        if 2 * region > probe.target_array_addr:
+            raise RuntimeError(
+                "model uses {} vectors of dram0, too many to double buffer".format(
+                    region
                 )
-            if self.model.load_consts_to_local:
-                self.run_load_consts(const.base, const.size)
-        with open(d + self.model.prog.file_name, "rb") as f:
-            self.program = f.read()
+            )
+        instructions["operand1"][self.dram_moves(instructions)] += np.uint64(region)
+        slot = Slot(region, self.model_buffer_name + "1", probe)
+        with self.tracer.span("encode", instructions=instructions.size):
+            program = self.encoder.encode(instructions)
+        self.load_program(program, slot.program_buffer_name)
+        self.load_program(
+            self.encoder.encode(self.flush_probe_instructions(probe)),
+            probe.buffer_name,
+        )
+        self.slots = [Slot(0, self.model_buffer_name, self.flush_probe), slot]
+        return self.slots
 
     def scalar_address(self, array_address):
         return array_address * self.arch.array_size
 
-    def prepare_flush_probe(self):
+    def init_flush_probe(self):
+        """
+        Sets up the flush probe: a vector copied from the probe source to
+        the probe target by the last instructions of every flush. The first
+        element of the source holds a generation number, bumped on every
+        flush, so a target written by a previous flush never matches.
+        """
         if self.debug:
-            print("-- prepare flush probe")
-        # initialize flush probe
+            print("-- init flush probe")
         self.probe_source_array_addr = self.arch.dram0_depth - 1
         self.probe_target_array_addr = self.arch.dram0_depth - 2
         self.local_address = self.arch.local_depth - 1
+        self.probe_generation = 0
         self.probe_source = np.full(
             self.arch.array_size,
             np.iinfo(data_type_numpy(self.arch.data_type)).max,
             dtype=data_type_numpy(self.arch.data_type),
         )
+        self.probe_source[0] = self.probe_generation
+        # zeros never match the source, which is max but for the generation
         self.probe_target = np.full(
             self.arch.array_size, 0, dtype=data_type_numpy(self.arch.data_type)
         )
-
-        # write flush probe
-        self.dram0.write(
-            self.scalar_address(self.probe_source_array_addr), self.probe_source
+        self.flush_probe = FlushProbe(
+            self.probe_source_array_addr,
+            self.probe_target_array_addr,
+            self.probe_source,
+            "b_probe",
         )
-        self.dram0.write(
-            self.scalar_address(self.probe_target_array_addr), self.probe_target
+
+        # the probe instructions stay resident, sent after every program
+        instructions = self.encoder.encode(self.flush_probe_instructions())
+        prog = Program()
+        prog.buffer_alloc(name=self.flush_probe.buffer_name, size=instructions.nbytes)
+        prog.buffer_write(instructions, name=self.flush_probe.buffer_name, offset=0)
+        self.add_probe_write(prog, self.probe_target_array_addr, self.probe_target)
+        self.add_probe_write(prog, self.probe_source_array_addr, self.probe_source)
+        try:
+            execute(self.inst, prog, self.tracer, "upload")
+        except Exception as e:
+            msg = "Error during flush probe initialization"
+            print(msg)
+            print(str(e))
+            raise RuntimeError(msg)
+        self.program_buffers[self.flush_probe.buffer_name] = instructions.nbytes
+
+    def add_probe_write(self, prog, array_addr, data):
+        prog.buffer_write(
+            data,
+            name=self.dram0_name,
+            offset=self.scalar_address(array_addr) * self.scalar_bytes,
         )
 
-        # flush probe instructions
+    def prepare_flush_probe(self, prog=None, probe=None):
+        """
+        Bumps the probe generation and writes the new probe source, returns
+        the flush probe instructions.
+
+        If prog is given the write is appended to it, to be executed in the
+        same request as the instructions DMA send, instead of right away.
+        probe defaults to self.flush_probe
+        """
+        if self.debug:
+            print("-- prepare flush probe")
+        if probe is None:
+            probe = self.flush_probe
+        # int16 generations, 0 is only used before the first flush
+        self.probe_generation = self.probe_generation % 32767 + 1
+        probe.source[0] = self.probe_generation
+        if prog is None:
+            self.dram0.write(self.scalar_address(probe.source_array_addr), probe.source)
+        else:
+            self.add_probe_write(prog, probe.source_array_addr, probe.source)
+        return self.flush_probe_instructions(probe)
+
+    def flush_probe_instructions(self, probe=None):
+        """
+        Returns the instructions that copy the flush probe source to the
+        flush probe target once all previous instructions are done.
+        probe defaults to self.flush_probe
+        """
+        if probe is None:
+            probe = self.flush_probe
         return [
             self.layout.data_move(
                 DataMoveFlag.dram0_to_memory,
                 self.local_address,
-                self.probe_source_array_addr,
+                probe.source_array_addr,
                 0,
             ),
             self.layout.data_move(
                 DataMoveFlag.memory_to_dram0,
                 self.local_address,
-                self.probe_target_array_addr,
+                probe.target_array_addr,
                 0,
             ),
         ]
 
-    def wait_for_flush(self):
-        while not self.dram0.compare(
-            self.scalar_address(self.probe_source_array_addr), self.probe_source
-        ):
+    @traced("flush_wait")
+    def wait_for_flush(self, reads=None, probe=None):
+        """
+        Polls the flush probe target, as described by self.poll_policy, until
+        it holds the probe source, meaning all instructions sent before the
+        flush probe are done. Polling stats are kept in self.flush_stats.
+
+        reads is an optional list of (offset, size) pairs of dram0 reads that
+        are done in the same program as the probe readback. Returns the list
+        of arrays read once the flush is complete.
+        probe defaults to self.flush_probe
+        """
+        reads = [] if reads is None else reads
+        if probe is None:
+            probe = self.flush_probe
+
+        def check():
             if self.debug:
                 print("-- wait for flush")
-            pass
+            prog = Program()
+            self.dram0.add_read(
+                prog,
+                self.scalar_address(probe.target_array_addr),
+                probe.source.size,
+            )
+            for offset, size in reads:
+                self.dram0.add_read(prog, offset, size)
+            res = execute(self.inst, prog, self.tracer, "flush_poll")
+            if np.array_equal(res[0], probe.source):
+                self.tracer.count("bytes_read", sum(r.nbytes for r in res[1:]))
+                return res[1:]
+            return None
 
-    def to_fixed(self, arr):
-        return vector_to_fixed_point(
-            self.arch.data_type.value.width, self.arch.data_type.value.binary_point
-        )(arr)
+        return poll(check, self.poll_policy, self.flush_stats)
 
-    def from_fixed(self, arr):
-        return vector_from_fixed_point(
-            self.arch.data_type.value.width, self.arch.data_type.value.binary_point
-        )(arr)
+    def to_fixed(self, arr, out=None):
+        return self.codec.to_fixed(arr, out)
 
-    def run(self, inputs):
+    def from_fixed(self, arr, out=None):
+        return self.codec.from_fixed(arr, out)
+
+    @traced("run")
+    def run(self, inputs, outputs=None):
         """
         Runs the model and returns outputs as a dict.
 
         inputs must be a dictionary containing a key for every input
         specified in the tmodel file. Each value in the dict must be
-        a numpy array
+        a numpy array. outputs is an optional dict of arrays the outputs
+        are decoded into, see output_arrays
         """
-        import time
-
         if self.debug:
             print("-- doing run")
 
-        start = time.time()
-        prev = start
-
-        def timestamp(event):
-            nonlocal prev
-            now = time.time()
-            print("{}\t{:.3}s\t{:.3}s".format(event, now - prev, now - start))
-            prev = now
-
         if self.model is None:
             raise Exception("model not loaded: please run driver.load_model first")
 
         # load inputs
-        for inp in self.model.inputs:
-            data = self.to_fixed(inputs[inp.name]).astype(
-                data_type_numpy(self.arch.data_type)
-            )
-            self.dram0.write(self.scalar_address(inp.base), data)
-        timestamp("wrote inputs")
+        with self.tracer.span("write_inputs"):
+            for inp in self.model.inputs:
+                data = self.to_fixed(inputs[inp.name])
+                self.dram0.write(self.scalar_address(inp.base), data)
 
-        # append flush probe instructions
-        prog = self.program
-        for i in self.prepare_flush_probe():
-            prog = prog + self.layout.to_bytes(i)
+        # bump the flush probe, its instructions are resident next to the
+        # program loaded by load_model
+        prog = Program()
+        self.prepare_flush_probe(prog)
 
-        # write program
-        prog_numpy = np.frombuffer(prog, dtype=np.uint8)
+        # send program
         if self.debug:
-            print(f"writing flush program, of length {prog_numpy.nbytes} bytes")
-        self.dma_write(prog_numpy)
+            size = self.program_buffers[self.model_buffer_name]
+            print(f"sending flush program, of length {size} bytes")
+        self.dma_send([self.model_buffer_name, self.flush_probe.buffer_name], prog)
+        return self.read_outputs(outputs=outputs)
 
-        self.wait_for_flush()
-        timestamp("wrote program")
-
-        # return outputs
-        outputs = dict()
+    def output_arrays(self, outputs=None):
+        """
+        Returns a dict with a float array for every output name of the
+        model, with room for all the segments of dram0 it is made of.
+        Arrays given in the dict outputs are checked and used instead
+        """
+        sizes = dict()
         for out in self.model.outputs:
-            data = self.from_fixed(
-                self.dram0.read(
-                    self.scalar_address(out.base), self.scalar_address(out.size)
-                )
-            )
-            if out.name in outputs:
-                outputs[out.name] = np.concatenate([outputs[out.name], data])
+            sizes[out.name] = sizes.get(out.name, 0) + self.scalar_address(out.size)
+        arrays = dict()
+        for name, size in sizes.items():
+            if outputs is not None and name in outputs:
+                arr = outputs[name]
+                if arr.size != size or not arr.flags.c_contiguous:
+                    raise RuntimeError(
+                        "output {} must be a contiguous array of {} elements".format(
+                            name, size
+                        )
+                    )
+                arrays[name] = arr
             else:
-                outputs[out.name] = data
-        timestamp("read outputs")
+                arrays[name] = np.empty(size, dtype=np.float64)
+        return arrays
+
+    @traced("readback")
+    def read_outputs(self, slot=None, outputs=None):
+        """
+        Waits for the flush of a run and returns its outputs as a dict.
+        All the output segments are read with a single program and decoded
+        in place into the arrays of output_arrays(outputs).
+        slot defaults to the program loaded by load_model
+        """
+        offset = 0 if slot is None else slot.offset
+        probe = None if slot is None else slot.probe
+        reads = [
+            (self.scalar_address(out.base + offset), self.scalar_address(out.size))
+            for out in self.model.outputs
+        ]
+        if self.poll_policy.fold_reads:
+            results = self.wait_for_flush(reads, probe)
+        else:
+            self.wait_for_flush(probe=probe)
+            results = self.dram0.read_many(reads)
+
+        outputs = self.output_arrays(outputs)
+        position = dict.fromkeys(outputs, 0)
+        for out, res in zip(self.model.outputs, results):
+            start = position[out.name]
+            flat = outputs[out.name].reshape(-1)
+            self.from_fixed(res, flat[start : start + res.size])
+            position[out.name] = start + res.size
         return outputs
+
+    @traced("submit")
+    def submit(self, inputs, slot):
+        """
+        Writes inputs to the dram0 region of slot and sends its program,
+        without waiting for it to finish
+        """
+        prog = Program()
+        writes = []
+        for inp in self.model.inputs:
+            data = self.to_fixed(inputs[inp.name])
+            writes.append((self.scalar_address(inp.base + slot.offset), data))
+        # small inputs go in the same request as the program send
+        if sum(encoded_size(data) for _, data in writes) < MAX_REQUEST_SIZE // 2:
+            for offset, data in writes:
+                self.dram0.add_write(prog, offset, data)
+        else:
+            for offset, data in writes:
+                self.dram0.write(offset, data)
+        self.prepare_flush_probe(prog, slot.probe)
+        self.dma_send([slot.program_buffer_name, slot.probe.buffer_name], prog)
+
+    def run_stream(self, inputs):
+        """
+        Runs the model on every dict of inputs in the iterable inputs,
+        yielding a dict of outputs for each one, in order.
+
+        Consecutive runs alternate between two regions of dram0, each one
+        with its own copy of the program: the inputs of a run are written
+        and its program queued while the previous run executes, whose
+        outputs are then read while this one executes.
+        """
+        if self.model is None:
+            raise Exception("model not loaded: please run driver.load_model first")
+        slots = self.pipeline_slots()
+        pending = None
+        for n, item in enumerate(inputs):
+            slot = slots[n % len(slots)]
+            self.submit(item, slot)
+            if pending is not None:
+                yield self.read_outputs(pending)
+            pending = slot
+        if pending is not None:
+            yield self.read_outputs(pending)
+
+    def run_batch(self, batch):
+        """
+        Runs the model on every dict of inputs in the list batch,
+        returns a list with a dict of outputs for each one
+        """
+        return list(self.run_stream(batch))
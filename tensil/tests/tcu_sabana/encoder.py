@@ -0,0 +1,157 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from tcu_pynq.instruction import DataMoveFlag
+
+
+class InstructionEncoder:
+    """
+    InstructionEncoder packs tensil instructions into an instruction image
+    in a single preallocated buffer, with the same encoding as Layout.to_bytes.
+
+    Instructions can be given as a sequence of ints as returned by Layout,
+    as an array of unsigned ints, or as a structured array of dtype
+    self.dtype with one field per instruction field.
+
+    Parameters
+    ----------
+    layout : Layout
+        The instruction layout of the target architecture
+    """
+
+    fields = ["opcode", "flags", "operand0", "operand1", "operand2"]
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.instruction_size_bytes = layout.instruction_size_bytes
+        self.words = -(-self.instruction_size_bytes // 8)
+
+        # bit offsets are found by encoding instructions with a single bit
+        # set on each operand. The header is a 4 bits opcode followed by
+        # 4 bits of flags, configure has the all ones opcode
+        flag = DataMoveFlag.dram0_to_memory
+        base = layout.data_move(flag, 0, 0, 0)
+        operand0 = layout.data_move(flag, 1, 0, 0) ^ base
+        operand1 = layout.data_move(flag, 0, 1, 0) ^ base
+        operand2 = layout.data_move(flag, 0, 0, 1) ^ base
+        opcode = layout.configure(0, 0).bit_length() - 4
+        self.offsets = {
+            "opcode": opcode,
+            "flags": opcode - 4,
+            "operand0": operand0.bit_length() - 1,
+            "operand1": operand1.bit_length() - 1,
+            "operand2": operand2.bit_length() - 1,
+        }
+        self.widths = {
+            "opcode": 4,
+            "flags": 4,
+            "operand0": self.offsets["operand1"] - self.offsets["operand0"],
+            "operand1": self.offsets["operand2"] - self.offsets["operand1"],
+            "operand2": self.offsets["flags"] - self.offsets["operand2"],
+        }
+        self.dtype = np.dtype([(f, np.uint64) for f in self.fields])
+        self.opcodes = {
+            "no_op": self.opcode(layout.no_op()),
+            "matmul": self.opcode(layout.matmul(False, 0, 0, 0)),
+            "data_move": self.opcode(base),
+            "load_weight": self.opcode(layout.load_weight(False, 0, 0)),
+            "configure": self.opcode(layout.configure(0, 0)),
+        }
+        # Layout does not build SIMD instructions, their opcode follows the
+        # one of load_weight
+        self.opcodes["simd"] = self.opcodes["load_weight"] + 1
+
+    def opcode(self, instruction):
+        """Returns the opcode of an instruction given as an int"""
+        return (instruction >> self.offsets["opcode"]) & 0xF
+
+    def nbytes(self, count):
+        """Returns the size in bytes of an image of count instructions"""
+        return count * self.instruction_size_bytes
+
+    def words_from_fields(self, instructions):
+        """Packs a structured array of fields into 64 bits words"""
+        if self.words > 1:
+            raise EncoderError(
+                "structured instructions are only supported up to 64 bits"
+            )
+        res = np.zeros(instructions.shape[0], dtype=np.uint64)
+        for f in self.fields:
+            mask = np.uint64((1 << self.widths[f]) - 1)
+            res |= (instructions[f].astype(np.uint64) & mask) << np.uint64(
+                self.offsets[f]
+            )
+        return res.reshape((-1, 1))
+
+    def words_from_ints(self, instructions):
+        """Splits a sequence of ints into little endian 64 bits words"""
+        if self.words == 1:
+            return np.array(instructions, dtype=np.uint64).reshape((-1, 1))
+        values = np.array(instructions, dtype=object)
+        res = np.empty((values.shape[0], self.words), dtype=np.uint64)
+        for w in range(self.words):
+            res[:, w] = (values >> (64 * w)) & ((1 << 64) - 1)
+        return res
+
+    def decode(self, image):
+        """
+        Returns a structured array of dtype self.dtype with the fields of
+        every instruction in a np.uint8 instruction image
+        """
+        if self.words > 1:
+            raise EncoderError(
+                "structured instructions are only supported up to 64 bits"
+            )
+        count = image.size // self.instruction_size_bytes
+        raw = np.zeros((count, 8), dtype=np.uint8)
+        raw[:, : self.instruction_size_bytes] = image[: self.nbytes(count)].reshape(
+            (count, self.instruction_size_bytes)
+        )
+        words = raw.view("<u8").reshape(-1)
+        res = np.empty(count, dtype=self.dtype)
+        for f in self.fields:
+            mask = np.uint64((1 << self.widths[f]) - 1)
+            res[f] = (words >> np.uint64(self.offsets[f])) & mask
+        return res
+
+    def encode(self, instructions, out=None):
+        """
+        Returns a np.uint8 array with the encoded instructions.
+
+        If out is given, the instructions are encoded in place into
+        out[: self.nbytes(len(instructions))] and out is returned
+        """
+        if isinstance(instructions, np.ndarray) and instructions.dtype.names:
+            words = self.words_from_fields(instructions)
+        else:
+            words = self.words_from_ints(instructions)
+        count = words.shape[0]
+        size = self.nbytes(count)
+        if out is None:
+            out = np.empty(size, dtype=np.uint8)
+        elif out.dtype != np.uint8 or out.size < size:
+            raise EncoderError(
+                "out must be a np.uint8 array of at least {} bytes".format(size)
+            )
+        image = out[:size].reshape((count, self.instruction_size_bytes))
+        raw = words.astype("<u8", copy=False).view(np.uint8)
+        image[:] = raw.reshape((count, 8 * self.words))[
+            :, : self.instruction_size_bytes
+        ]
+        return out
+
+
+class EncoderError(Exception):
+    pass
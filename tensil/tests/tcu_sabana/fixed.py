@@ -0,0 +1,60 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from tcu_pynq.data_type import data_type_numpy
+
+
+class FixedPointCodec:
+    """
+    FixedPointCodec converts whole arrays between floats and the fixed
+    point data type of an architecture, such as FP16BP8, with the same
+    results as vector_to_fixed_point and vector_from_fixed_point: values
+    are scaled, rounded half to even and saturated to the range of the
+    data type.
+
+    Parameters
+    ----------
+    data_type : DataType
+        The fixed point data type of the architecture
+    """
+
+    def __init__(self, data_type):
+        self.width = data_type.value.width
+        self.binary_point = data_type.value.binary_point
+        self.dtype = np.dtype(data_type_numpy(data_type))
+        self.scale = float(1 << self.binary_point)
+        self.inverse_scale = 1.0 / self.scale
+        self.min = -(1 << (self.width - 1))
+        self.max = (1 << (self.width - 1)) - 1
+
+    def to_fixed(self, arr, out=None):
+        """
+        Returns arr, an array of floats, converted to fixed point.
+        If out is given, the result is written to it and out is returned
+        """
+        scaled = np.multiply(arr, self.scale, dtype=np.float64)
+        np.rint(scaled, out=scaled)
+        np.clip(scaled, self.min, self.max, out=scaled)
+        if out is None:
+            return scaled.astype(self.dtype)
+        np.copyto(out, scaled, casting="unsafe")
+        return out
+
+    def from_fixed(self, arr, out=None):
+        """
+        Returns arr, an array of fixed point values, converted to floats.
+        If out is given, the result is written to it and out is returned
+        """
+        return np.multiply(arr, self.inverse_scale, out=out, dtype=np.float64)
@@ -0,0 +1,175 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+
+class ResidentModel:
+    """
+    A model registered in a ModelRegistry: the range of dram1 holding its
+    consts and, while resident, its state in the driver.
+    """
+
+    def __init__(self, name, model_filename, dram1_offset, dram1_size, loaded):
+        self.name = name
+        self.model_filename = model_filename
+        self.dram1_offset = dram1_offset
+        self.dram1_size = dram1_size
+        self.loaded = loaded
+
+    @property
+    def program_buffer_names(self):
+        names = [self.loaded.program_buffer_name]
+        if self.loaded.slots is not None:
+            names += [slot.program_buffer_name for slot in self.loaded.slots[1:]]
+        return names
+
+
+class ModelRegistry:
+    """
+    ModelRegistry keeps several models resident in a single tensil Driver.
+    The consts of every model are packed into their own range of dram1 and
+    its program stays in its own buffer, so switching between models does
+    not upload anything. When dram1 is full, the least recently run models
+    are evicted, and loaded again the next time they are run.
+
+    The registry owns dram1: models must not be loaded with
+    driver.load_model while it is in use.
+
+    Parameters
+    ----------
+    driver : Driver
+        The tensil driver holding the models
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        # registered model filenames, by name
+        self.filenames = dict()
+        # resident models, least recently run first
+        self.resident = OrderedDict()
+        self.active = None
+
+    def __contains__(self, name):
+        return name in self.filenames
+
+    def names(self):
+        return list(self.filenames)
+
+    def register(self, name, model_filename):
+        """
+        Registers a model under name and loads it, evicting the least
+        recently run models if dram1 is full
+        """
+        if name in self.filenames:
+            raise RegistryError("model {} is already registered".format(name))
+        self.filenames[name] = model_filename
+        try:
+            self.load(name)
+        except Exception:
+            del self.filenames[name]
+            raise
+
+    def unregister(self, name):
+        self.evict(name)
+        del self.filenames[name]
+
+    def load(self, name):
+        """Makes a registered model resident, returns its ResidentModel"""
+        driver = self.driver
+        model_filename = self.filenames[name]
+        model, program = driver.read_model(model_filename)
+        size = driver.dram_extent(driver.encoder.decode(program), 1, model)
+        if size > driver.arch.dram1_depth:
+            raise RegistryError(
+                "model {} uses {} vectors of dram1, but there are only {}".format(
+                    name, size, driver.arch.dram1_depth
+                )
+            )
+        offset = self.allocate(size)
+        while offset is None:
+            self.evict(next(iter(self.resident)))
+            offset = self.allocate(size)
+
+        self.save_active()
+        driver.load_model(
+            model_filename,
+            dram1_offset=offset,
+            program_buffer_name="b_prog_{}".format(name),
+        )
+        entry = ResidentModel(name, model_filename, offset, size, None)
+        entry.loaded = driver.loaded_model()
+        self.resident[name] = entry
+        self.active = name
+        return entry
+
+    def allocate(self, size):
+        """
+        Returns the lowest dram1 offset with size free vectors,
+        or None if there is no such gap between resident models
+        """
+        offset = 0
+        for entry in sorted(self.resident.values(), key=lambda e: e.dram1_offset):
+            if entry.dram1_offset - offset >= size:
+                return offset
+            offset = max(offset, entry.dram1_offset + entry.dram1_size)
+        if self.driver.arch.dram1_depth - offset >= size:
+            return offset
+        return None
+
+    def evict(self, name):
+        """Frees the dram1 range and the program buffers of a resident model"""
+        entry = self.resident.pop(name, None)
+        if entry is None:
+            return
+        if self.active == name:
+            entry.loaded = self.driver.loaded_model()
+            self.active = None
+            self.driver.model = None
+        for buffer_name in entry.program_buffer_names:
+            self.driver.unload_program(buffer_name)
+
+    def save_active(self):
+        # slots are created by the driver on first use, keep them
+        if self.active is not None:
+            self.resident[self.active].loaded = self.driver.loaded_model()
+
+    def activate(self, name):
+        """Makes the model registered under name the one run by the driver"""
+        if name not in self.filenames:
+            raise RegistryError("model {} is not registered".format(name))
+        if name not in self.resident:
+            self.load(name)
+        elif self.active != name:
+            self.save_active()
+            self.driver.activate_model(self.resident[name].loaded)
+            self.active = name
+        self.resident.move_to_end(name)
+
+    def run(self, model_name, inputs, outputs=None):
+        """
+        Runs the model registered under model_name and returns its outputs
+        as a dict, see Driver.run
+        """
+        self.activate(model_name)
+        return self.driver.run(inputs, outputs)
+
+    def run_batch(self, model_name, batch):
+        """Runs the model registered under model_name on a list of inputs"""
+        self.activate(model_name)
+        return self.driver.run_batch(batch)
+
+
+class RegistryError(Exception):
+    pass
@@ -0,0 +1,423 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sabana.common import ndarray_from_values, dtype_from_ty
+from sabana.responses import (
+    is_alloc,
+    is_buffer,
+    is_dealloc,
+    is_dma_send,
+    is_read,
+    is_wait,
+    is_write,
+)
+from tcu_pynq.config import Constant
+from tcu_pynq.data_type import data_type_numpy
+from tcu_pynq.instruction import Layout, DataMoveFlag
+from tcu_sabana.encoder import InstructionEncoder
+
+# SIMD operations, by their code in the SIMD instruction
+SIMD_OPS = [
+    "no_op",
+    "zero",
+    "move",
+    "not",
+    "and",
+    "or",
+    "increment",
+    "decrement",
+    "add",
+    "subtract",
+    "multiply",
+    "abs",
+    "greater",
+    "greater_equal",
+    "min",
+    "max",
+]
+SIMD_READ = 0x1
+SIMD_WRITE = 0x2
+SIMD_ACCUMULATE = 0x4
+MATMUL_ACCUMULATE = 0x1
+MATMUL_ZEROES = 0x2
+LOAD_WEIGHT_ZEROES = 0x1
+
+
+class TCUSimulator:
+    """
+    TCUSimulator executes tensil instructions on NumPy arrays: data_move,
+    load_weight, matmul, simd, configure and no_op.
+
+    The drams are given as np.uint8 arrays, viewed as vectors of
+    arch.array_size scalars. Local memory, accumulators, the weights of
+    the systolic array and the SIMD registers are held by the simulator.
+    Fixed point products are rounded to nearest and every result is
+    saturated, partial sums of matmul are not, so results may differ from
+    the hardware in the last bit.
+
+    Parameters
+    ----------
+    arch : Architecture
+        The architecture to simulate
+    """
+
+    def __init__(self, arch):
+        self.arch = arch
+        self.layout = Layout(arch)
+        self.encoder = InstructionEncoder(self.layout)
+        self.dtype = np.dtype(data_type_numpy(arch.data_type))
+        self.binary_point = arch.data_type.value.binary_point
+        self.one = 1 << self.binary_point
+        self.min = int(np.iinfo(self.dtype).min)
+        self.max = int(np.iinfo(self.dtype).max)
+
+        # operand0 addresses local memory, operand1 drams or accumulators,
+        # strides are stored as their log2 above the widest address
+        self.operand0_bits = (arch.local_depth - 1).bit_length()
+        self.operand1_bits = max(
+            (depth - 1).bit_length()
+            for depth in (arch.dram0_depth, arch.dram1_depth, arch.accumulator_depth)
+        )
+        self.register_bits = max(arch.simd_registers_depth.bit_length(), 1)
+
+        size = arch.array_size
+        self.local = np.zeros((arch.local_depth, size), dtype=self.dtype)
+        self.accumulators = np.zeros((arch.accumulator_depth, size), dtype=self.dtype)
+        # the bias followed by a row of weights for every input element
+        self.weights = np.zeros((size + 1, size), dtype=np.int64)
+        self.registers = np.zeros((arch.simd_registers_depth + 1, size), np.int64)
+        self.config = dict()
+        self.drams = [None, None]
+        self.instructions = 0
+
+    def attach(self, dram0, dram1):
+        """Sets the np.uint8 arrays holding dram0 and dram1"""
+        self.drams = [self.vectors(dram0), self.vectors(dram1)]
+
+    def vectors(self, data):
+        vector_bytes = self.arch.array_size * self.dtype.itemsize
+        count = data.size // vector_bytes
+        return data[: count * vector_bytes].view(self.dtype).reshape((count, -1))
+
+    def saturate(self, values):
+        return np.clip(values, self.min, self.max)
+
+    def addresses(self, operand, bits, size, depth):
+        """Returns the addresses of size vectors from an address operand"""
+        address = operand & ((1 << bits) - 1)
+        stride = 1 << (operand >> bits)
+        res = address + stride * np.arange(size)
+        if res[-1] >= depth:
+            raise SimulatorError(
+                "address {} out of a memory of {} vectors".format(res[-1], depth)
+            )
+        return res
+
+    def execute(self, image):
+        """Executes an instruction image, given as a np.uint8 array"""
+        self.run(self.encoder.decode(image))
+
+    def run(self, instructions):
+        """Executes a structured array of dtype self.encoder.dtype"""
+        opcodes = self.encoder.opcodes
+        handlers = {
+            opcodes["no_op"]: None,
+            opcodes["matmul"]: self.matmul,
+            opcodes["data_move"]: self.data_move,
+            opcodes["load_weight"]: self.load_weight,
+            opcodes["configure"]: self.configure,
+            opcodes["simd"]: self.simd,
+        }
+        fields = [instructions[f].tolist() for f in self.encoder.fields]
+        for opcode, flags, operand0, operand1, operand2 in zip(*fields):
+            if opcode not in handlers:
+                raise SimulatorError("unsupported opcode {}".format(opcode))
+            handler = handlers[opcode]
+            if handler is not None:
+                handler(flags, operand0, operand1, operand2)
+        self.instructions += len(instructions)
+
+    def configure(self, flags, register, value, _):
+        self.config[register] = value
+
+    def data_move(self, flags, local_operand, operand, size):
+        size += 1
+        local = self.addresses(
+            local_operand, self.operand0_bits, size, self.arch.local_depth
+        )
+        if flags in (
+            DataMoveFlag.dram0_to_memory.value,
+            DataMoveFlag.dram1_to_memory.value,
+        ):
+            dram = self.drams[flags // 2]
+            self.local[local] = dram[
+                self.addresses(operand, self.operand1_bits, size, dram.shape[0])
+            ]
+        elif flags in (
+            DataMoveFlag.memory_to_dram0.value,
+            DataMoveFlag.memory_to_dram1.value,
+        ):
+            dram = self.drams[flags // 2]
+            dram[
+                self.addresses(operand, self.operand1_bits, size, dram.shape[0])
+            ] = self.local[local]
+        else:
+            acc = self.addresses(
+                operand, self.operand1_bits, size, self.arch.accumulator_depth
+            )
+            if flags == DataMoveFlag.accumulator_to_memory.value:
+                self.local[local] = self.accumulators[acc]
+            elif flags == DataMoveFlag.memory_to_accumulator.value:
+                self.accumulators[acc] = self.local[local]
+            elif flags == DataMoveFlag.memory_to_accumulator_accumulate.value:
+                self.accumulators[acc] = self.saturate(
+                    self.accumulators[acc].astype(np.int64) + self.local[local]
+                )
+            else:
+                raise SimulatorError("unsupported data move flags {}".format(flags))
+
+    def load_weight(self, flags, local_operand, size, _):
+        """
+        Pushes size + 1 vectors into the systolic array, ahead of the ones
+        already there. The first vector is the bias
+        """
+        size += 1
+        if flags & LOAD_WEIGHT_ZEROES:
+            vectors = np.zeros((size, self.arch.array_size), dtype=np.int64)
+        else:
+            local = self.addresses(
+                local_operand, self.operand0_bits, size, self.arch.local_depth
+            )
+            vectors = self.local[local]
+        self.weights = np.concatenate([vectors, self.weights])[: len(self.weights)]
+
+    def matmul(self, flags, local_operand, acc_operand, size):
+        size += 1
+        acc = self.addresses(
+            acc_operand, self.operand1_bits, size, self.arch.accumulator_depth
+        )
+        if flags & MATMUL_ZEROES:
+            inputs = np.zeros((size, self.arch.array_size), dtype=np.int64)
+        else:
+            local = self.addresses(
+                local_operand, self.operand0_bits, size, self.arch.local_depth
+            )
+            inputs = self.local[local].astype(np.int64)
+        res = self.round(inputs @ self.weights[1:]) + self.weights[0]
+        if flags & MATMUL_ACCUMULATE:
+            res += self.accumulators[acc]
+        self.accumulators[acc] = self.saturate(res)
+
+    def round(self, products):
+        """Rounds products of two fixed point values back to fixed point"""
+        return (products + (1 << (self.binary_point - 1))) >> self.binary_point
+
+    def simd(self, flags, write_address, read_address, operand):
+        """
+        Applies a SIMD operation to the vector read from the accumulators
+        and the SIMD registers. Register 0 stands for the vector read when
+        used as a source, and for the vector written when used as the
+        destination
+        """
+        mask = (1 << self.register_bits) - 1
+        dest = operand & mask
+        right = (operand >> self.register_bits) & mask
+        left = (operand >> (2 * self.register_bits)) & mask
+        op = operand >> (3 * self.register_bits)
+        if op >= len(SIMD_OPS):
+            raise SimulatorError("unsupported SIMD operation {}".format(op))
+
+        depth = self.arch.accumulator_depth
+        if flags & SIMD_READ:
+            self.registers[0] = self.accumulators[read_address % depth]
+        else:
+            self.registers[0] = 0
+        a = self.registers[left]
+        b = self.registers[right]
+        op = SIMD_OPS[op]
+        if op == "no_op":
+            return
+        elif op == "zero":
+            res = np.zeros_like(a)
+        elif op == "move":
+            res = a
+        elif op == "not":
+            res = np.where(a == 0, self.one, 0)
+        elif op == "and":
+            res = np.where((a != 0) & (b != 0), self.one, 0)
+        elif op == "or":
+            res = np.where((a != 0) | (b != 0), self.one, 0)
+        elif op == "increment":
+            res = a + self.one
+        elif op == "decrement":
+            res = a - self.one
+        elif op == "add":
+            res = a + b
+        elif op == "subtract":
+            res = a - b
+        elif op == "multiply":
+            res = self.round(a * b)
+        elif op == "abs":
+            res = np.abs(a)
+        elif op == "greater":
+            res = np.where(a > b, self.one, 0)
+        elif op == "greater_equal":
+            res = np.where(a >= b, self.one, 0)
+        elif op == "min":
+            res = np.minimum(a, b)
+        else:
+            res = np.maximum(a, b)
+        res = self.saturate(res)
+
+        if dest != 0:
+            self.registers[dest] = res
+        elif flags & SIMD_WRITE:
+            address = write_address % depth
+            if flags & SIMD_ACCUMULATE:
+                res = self.saturate(res + self.accumulators[address])
+            self.accumulators[address] = res
+
+
+class SimulatedInstance:
+    """
+    SimulatedInstance runs Sabana programs in process, as a drop-in
+    replacement of sabana.Instance for the tensil Driver: buffers live in
+    host memory and instructions sent to the DMA are executed by a
+    TCUSimulator, before execute returns.
+
+    Parameters
+    ----------
+    arch : Architecture
+        The architecture to simulate
+    dma_name : String
+        The name of the instructions DMA
+    dram0_name : String
+        The name of the buffer holding dram0
+    dram1_name : String
+        The name of the buffer holding dram1
+    """
+
+    def __init__(self, arch, dma_name="inst", dram0_name="d0", dram1_name="d1"):
+        self.tcu = TCUSimulator(arch)
+        self.dma_name = dma_name
+        self.dram0_name = dram0_name
+        self.dram1_name = dram1_name
+        self.is_up = False
+        self.buffers = dict()
+        self.addresses = dict()
+        self.dmas = set()
+        # decoded instructions by buffer name, dropped when it is written
+        self.decoded = dict()
+        self.next_address = Constant.TCU_BLOCK_SIZE.value
+
+    def up(self):
+        self.is_up = True
+
+    def down(self):
+        self.is_up = False
+        self.buffers.clear()
+        self.decoded.clear()
+
+    def execute(self, program):
+        if not self.is_up:
+            raise SimulatorError("Need to deploy an instance to execute this program")
+        values = []
+        for i, req in enumerate(program.req.requests):
+            try:
+                value = self.request(req)
+            except Exception as e:
+                raise SimulatorError(
+                    "\nOperation number {}: \n{}\nfailed with: {}\n".format(i, req, e)
+                )
+            if value is not None:
+                values.append(value)
+        return values
+
+    def request(self, req):
+        if is_buffer(req):
+            return self.buffer_request(req)
+        elif is_dma_send(req):
+            return self.dma_send_request(req)
+        raise SimulatorError("only buffer and dma send operations are supported")
+
+    def buffer(self, name):
+        if name not in self.buffers:
+            raise SimulatorError("buffer {} is not allocated".format(name))
+        return self.buffers[name]
+
+    def buffer_request(self, req):
+        if is_alloc(req):
+            name = req.alloc.name
+            if name in self.buffers:
+                raise SimulatorError("buffer {} is already allocated".format(name))
+            self.buffers[name] = np.zeros(req.alloc.size, dtype=np.uint8)
+            self.addresses[name] = self.next_address
+            # keep buffers aligned to TCU blocks, as drams are addressed by block
+            block = Constant.TCU_BLOCK_SIZE.value
+            self.next_address += -(-max(req.alloc.size, 1) // block) * block
+            if self.dram0_name in self.buffers and self.dram1_name in self.buffers:
+                self.tcu.attach(
+                    self.buffers[self.dram0_name], self.buffers[self.dram1_name]
+                )
+            return np.array(self.addresses[name], np.uint64)
+        elif is_dealloc(req):
+            self.buffer(req.dealloc.name)
+            del self.buffers[req.dealloc.name]
+            self.decoded.pop(req.dealloc.name, None)
+        elif is_write(req):
+            data = ndarray_from_values(req.write.values, req.write.datatype)
+            raw = data.view(np.uint8)
+            buf = self.buffer(req.write.name)
+            if req.write.offset + raw.size > buf.size:
+                raise SimulatorError("write past the end of {}".format(req.write.name))
+            buf[req.write.offset : req.write.offset + raw.size] = raw
+            self.decoded.pop(req.write.name, None)
+        elif is_read(req):
+            dtype = np.dtype(dtype_from_ty(req.read.datatype))
+            shape = tuple(req.read.shape)
+            size = int(np.prod(shape)) * dtype.itemsize
+            buf = self.buffer(req.read.name)
+            if req.read.offset + size > buf.size:
+                raise SimulatorError("read past the end of {}".format(req.read.name))
+            data = buf[req.read.offset : req.read.offset + size]
+            return data.view(dtype).reshape(shape).copy()
+        elif is_wait(req):
+            data = ndarray_from_values(req.wait.values, req.wait.datatype)
+            raw = data.view(np.uint8)
+            buf = self.buffer(req.wait.name)
+            if not np.array_equal(
+                buf[req.wait.offset : req.wait.offset + raw.size], raw
+            ):
+                raise SimulatorError("timeout waiting on {}".format(req.wait.name))
+        return None
+
+    def dma_send_request(self, req):
+        if is_alloc(req):
+            self.dmas.add(req.alloc.name)
+        elif is_dealloc(req):
+            self.dmas.discard(req.dealloc.name)
+        elif is_write(req):
+            if req.write.name != self.dma_name:
+                raise SimulatorError("unknown dma {}".format(req.write.name))
+            src = req.write.src
+            if src not in self.decoded:
+                self.decoded[src] = self.tcu.encoder.decode(self.buffer(src))
+            # instructions complete before the send does
+            self.tcu.run(self.decoded[src])
+        return None
+
+
+class SimulatorError(Exception):
+    pass
@@ -0,0 +1,162 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# A timed phase of the driver, times are perf_counter_ns values
+Span = namedtuple("Span", ["name", "category", "start_ns", "end_ns", "thread", "args"])
+
+
+class Tracer:
+    """
+    Tracer records what the driver spends its time on: spans of the
+    phases of every operation, such as encode, upload, dma_send,
+    flush_wait and readback, and counters such as bytes moved and round
+    trips to the instance. Records can be exported as a dict or as a
+    Chrome trace, to be opened in chrome://tracing or Perfetto.
+
+    A disabled tracer records nothing, drivers use one by default.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether spans and counters are recorded
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.spans = []
+        self.counters = dict()
+        self.origin_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name, category="driver", **args):
+        """
+        Records the time spent in the body of a with statement as a span.
+        Yields the dict of args of the span, to which values known at the
+        end of the span, such as bytes moved, can be added
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter_ns()
+            self.spans.append(
+                Span(name, category, start, end, threading.get_ident(), args)
+            )
+
+    def count(self, name, value=1):
+        """Adds value to the counter name"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def totals(self):
+        """Returns the count, total and maximum duration of spans by name"""
+        totals = dict()
+        for span in self.spans:
+            ns = span.end_ns - span.start_ns
+            total = totals.setdefault(span.name, {"count": 0, "ns": 0, "max_ns": 0})
+            total["count"] += 1
+            total["ns"] += ns
+            total["max_ns"] = max(total["max_ns"], ns)
+        return totals
+
+    def as_dict(self):
+        return {
+            "counters": dict(self.counters),
+            "totals": self.totals(),
+            "spans": [
+                {
+                    "name": span.name,
+                    "category": span.category,
+                    "start_ns": span.start_ns - self.origin_ns,
+                    "duration_ns": span.end_ns - span.start_ns,
+                    "thread": span.thread,
+                    "args": dict(span.args),
+                }
+                for span in self.spans
+            ],
+        }
+
+    def chrome_trace(self):
+        """Returns the records in the Chrome trace event format"""
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start_ns - self.origin_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread,
+                "args": dict(span.args),
+            }
+            for span in self.spans
+        ]
+        end = max((span.end_ns for span in self.spans), default=self.origin_ns)
+        for name, value in self.counters.items():
+            events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": (end - self.origin_ns) / 1000,
+                    "pid": pid,
+                    "args": {name: value},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def traced(name, category="driver"):
+    """
+    Decorates a method of an object with a tracer attribute, so that its
+    calls are recorded as spans named name
+    """
+
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name, category):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def execute(inst, program, tracer, name, **args):
+    """
+    Executes program in inst, recorded by tracer as a round trip named name
+    """
+    with tracer.span(name, "round_trip", **args):
+        res = inst.execute(program=program)
+    tracer.count("round_trips")
+    return res
@@ -0,0 +1,135 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tcu_sabana import completion
+from tcu_sabana.completion import (
+    PollPolicy,
+    FlushStats,
+    CompletionError,
+    FlushTimeout,
+    poll,
+)
+import pytest
+
+
+class FakeClock:
+    """Replaces the time module of completion, sleeps only move the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Check:
+    """A check that completes on its polls-th call, or never with None"""
+
+    def __init__(self, clock, polls=None):
+        self.clock = clock
+        self.polls = polls
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(self.clock.now)
+        if self.polls is not None and len(self.calls) >= self.polls:
+            return len(self.calls)
+        return None
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(completion, "time", fake)
+    return fake
+
+
+def test_poll_backoff(clock):
+    policy = PollPolicy(initial_delay=0.001, backoff=2.0, max_delay=0.005)
+    stats = FlushStats()
+    assert poll(Check(clock, polls=6), policy, stats) == 6
+    # the delay doubles after every poll, up to max_delay
+    assert clock.sleeps == pytest.approx([0.001, 0.002, 0.004, 0.005, 0.005])
+    assert stats.flushes == 1
+    assert stats.last_polls == 6
+    assert stats.last_seconds == pytest.approx(0.017)
+
+
+def test_poll_max_polls(clock):
+    check = Check(clock)
+    with pytest.raises(FlushTimeout, match="after 3 polls"):
+        poll(check, PollPolicy(max_polls=3, deadline=None))
+    assert len(check.calls) == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_poll_deadline(clock):
+    check = Check(clock)
+    policy = PollPolicy(initial_delay=0.01, backoff=2.0, max_delay=0.04, deadline=0.1)
+    with pytest.raises(FlushTimeout):
+        poll(check, policy)
+    # 0, 0.01, 0.03, 0.07, and a last poll at the deadline
+    assert check.calls == pytest.approx([0.0, 0.01, 0.03, 0.07, 0.1])
+    assert clock.sleeps[-1] == pytest.approx(0.03)
+
+    # a flush that completes at the deadline is not a timeout
+    clock.now = 0.0
+    assert poll(Check(clock, polls=5), policy) == 5
+
+
+def test_poll_first(clock):
+    stats = FlushStats()
+    assert poll(Check(clock, polls=1), PollPolicy(), stats) == 1
+    assert clock.sleeps == []
+    assert stats.as_dict()["last_polls"] == 1
+
+
+def test_poll_policy_arguments():
+    with pytest.raises(CompletionError):
+        PollPolicy(initial_delay=-1)
+    with pytest.raises(CompletionError):
+        PollPolicy(initial_delay=0.2, max_delay=0.1)
+    with pytest.raises(CompletionError):
+        PollPolicy(backoff=0.5)
+    with pytest.raises(CompletionError):
+        PollPolicy(max_polls=0)
+    assert PollPolicy(backoff=1.0).delay(10) == PollPolicy().initial_delay
+
+
+def test_flush_stats():
+    stats = FlushStats()
+    assert stats.polls_per_flush == 0.0
+    assert stats.seconds_per_flush == 0.0
+    stats.record(2, 0.5)
+    stats.record(4, 0.1)
+    assert stats.as_dict() == pytest.approx(
+        {
+            "flushes": 2,
+            "polls": 6,
+            "seconds": 0.6,
+            "polls_per_flush": 3.0,
+            "seconds_per_flush": 0.3,
+            "max_polls": 4,
+            "max_seconds": 0.5,
+            "last_polls": 4,
+            "last_seconds": 0.1,
+        }
+    )
+    stats.reset()
+    assert stats.flushes == 0 and stats.max_seconds == 0.0
@@ -13,23 +13,78 @@
 # limitations under the License.
 
 from tcu_pynq.data_type import data_type_numpy, one
+from tcu_pynq.config import Register
 from tcu_pynq.instruction import DataMoveFlag
 from tcu_pynq.util import pad_to
-from tcu_sabana.driver import Driver
+from tcu_sabana.driver import Driver, tensil, buffer_chunk_write, map_file
+from tcu_sabana.registry import ModelRegistry
+from tcu_sabana.simulator import SimulatedInstance
+from tcu_sabana.trace import Tracer
 from collections import namedtuple
+import json
 import numpy as np
+import os
 import pytest
+import tempfile
 
 TCase = namedtuple("TestCase", ["input", "expected"])
 
+XOR_CASES = [
+    TCase(input=(0, 0), expected=(0,)),
+    TCase(input=(0, 1), expected=(1,)),
+    TCase(input=(1, 0), expected=(1,)),
+    TCase(input=(1, 1), expected=(0,)),
+]
+
 
 @pytest.fixture(scope="module")
 def driver():
-    drv = Driver(image="luis/tensil:0.1.0", debug=False)
+    # TENSIL_SIMULATOR=1 runs the tests without deploying an instance
+    if os.environ.get("TENSIL_SIMULATOR"):
+        drv = Driver(instance=SimulatedInstance(tensil), debug=False)
+    else:
+        drv = Driver(image="luis/tensil:0.1.0", debug=False)
     yield drv
     drv.close()
 
 
+def test_encoder(driver):
+    layout, encoder = driver.layout, driver.encoder
+    rng = np.random.default_rng(0)
+
+    def operands(count=3):
+        return [int(v) for v in rng.integers(0, 256, size=count)]
+
+    # every opcode and flag Layout builds, with random operands
+    program = [layout.no_op()]
+    for flag in DataMoveFlag:
+        program.append(layout.data_move(flag, *operands()))
+    for flag in (False, True):
+        program.append(layout.matmul(flag, *operands()))
+        program.append(layout.load_weight(flag, *operands(2)))
+    for register in Register:
+        program.append(layout.configure(register.value, *operands(1)))
+    expected = b"".join(layout.to_bytes(i) for i in program)
+    image = encoder.encode(program)
+    np.testing.assert_array_equal(image, np.frombuffer(expected, dtype=np.uint8))
+
+    # the fields decoded from the image encode the same image
+    fields = encoder.decode(image)
+    assert [encoder.opcode(i) for i in program] == list(fields["opcode"])
+    np.testing.assert_array_equal(encoder.encode(fields), image)
+
+    # all the flags of all the opcodes, simd included, round trip
+    opcodes = sorted(set(encoder.opcodes.values()))
+    fields = np.zeros(len(opcodes) * 16, dtype=encoder.dtype)
+    fields["opcode"] = np.repeat(opcodes, 16)
+    fields["flags"] = np.tile(np.arange(16), len(opcodes))
+    for f in ["operand0", "operand1", "operand2"]:
+        fields[f] = rng.integers(0, 1 << encoder.widths[f], size=fields.size)
+    out = np.zeros(encoder.nbytes(fields.size) + 1, dtype=np.uint8)
+    assert encoder.encode(fields, out=out) is out
+    np.testing.assert_array_equal(encoder.decode(out[:-1]), fields)
+
+
 def test_local_memory(driver):
     size = driver.arch.local_depth * driver.arch.array_size
     data = np.arange(size, dtype=data_type_numpy(driver.arch.data_type))
@@ -158,6 +213,63 @@ def test_dram1(driver):
     np.testing.assert_array_equal(result, data)
 
 
+def test_chunk_split(driver):
+    # 4096 literals of 3 digits do not fit in a request of 8 KiB
+    data = np.full(4096, 200, dtype=np.uint8)
+    batches = buffer_chunk_write(
+        data=data,
+        buffer=driver.dram0.name,
+        inst=driver.inst,
+        offset=0,
+        request_size=8192,
+    )
+    assert len(batches) > 1
+    assert all(batch.request_bytes <= 8192 for batch in batches)
+    assert sum(batch.nbytes for batch in batches) == data.nbytes
+    result = driver.dram0.read(
+        0, data.nbytes // driver.dram0.data_type_numpy_size_bytes
+    )
+    np.testing.assert_array_equal(result.view(np.uint8), data)
+
+
+def test_map_file():
+    with tempfile.TemporaryDirectory() as d:
+        empty = os.path.join(d, "empty.tprog")
+        open(empty, "wb").close()
+        assert map_file(empty).size == 0
+        data = os.path.join(d, "data.tdata")
+        with open(data, "wb") as f:
+            f.write(bytes(range(16)))
+        mapped = map_file(data)
+        np.testing.assert_array_equal(mapped, np.arange(16, dtype=np.uint8))
+        assert not mapped.flags.writeable
+        del mapped
+
+
+def test_dma_write_recovery(driver):
+    instructions = driver.encoder.encode([driver.layout.no_op()] * 3)
+    name, _ = driver.staging_buffer(instructions.nbytes)
+    if name in driver.staging_buffers:
+        driver.drop_staging_buffer(name)
+    execute = driver.inst.execute
+
+    def failing(program):
+        # the request allocates the buffer, then the send times out
+        execute(program=program)
+        raise RuntimeError("timeout")
+
+    driver.inst.execute = failing
+    try:
+        with pytest.raises(RuntimeError):
+            driver.dma_write(instructions)
+    finally:
+        driver.inst.execute = execute
+    assert driver.staging_buffers[name] is None
+    # the buffer is reallocated, instead of failing on its allocation
+    driver.dma_write(instructions)
+    assert driver.staging_buffers[name] == instructions.nbytes
+
+
 def test_xor(driver):
     test_case = [
         TCase(input=(0, 0), expected=(0,)),
@@ -174,14 +286,126 @@ def test_xor(driver):
         np.testing.assert_allclose(expected, output, atol=1e-02)
 
 
+@pytest.mark.parametrize("cases", [XOR_CASES[:1], XOR_CASES])
+def test_xor_batch(driver, cases):
+    driver.load_model("./xor4_pb_tensil.tmodel")
+    dtype = data_type_numpy(driver.arch.data_type)
+    batch = [
+        {"x": pad_to(np.array(case.input, dtype=dtype), driver.arch.array_size)}
+        for case in cases
+    ]
+    outputs = driver.run_batch(batch)
+    assert len(outputs) == len(cases)
+    for case, output in zip(cases, outputs):
+        expected = pad_to(np.array(case.expected, dtype=dtype), driver.arch.array_size)
+        np.testing.assert_allclose(expected, output["Identity"], atol=1e-02)
+
+
+def test_registry(driver):
+    # the same model twice, with its consts in two ranges of dram1
+    registry = ModelRegistry(driver)
+    registry.register("xor_a", "./xor4_pb_tensil.tmodel")
+    registry.register("xor_b", "./xor4_pb_tensil.tmodel")
+    assert registry.resident["xor_b"].dram1_offset > 0
+    dtype = data_type_numpy(driver.arch.data_type)
+    for case in XOR_CASES:
+        x = pad_to(np.array(case.input, dtype=dtype), driver.arch.array_size)
+        expected = pad_to(np.array(case.expected, dtype=dtype), driver.arch.array_size)
+        for name in ["xor_a", "xor_b", "xor_a"]:
+            output = registry.run(name, {"x": x})
+            np.testing.assert_allclose(expected, output["Identity"], atol=1e-02)
+    registry.unregister("xor_a")
+    registry.unregister("xor_b")
+
+
+def test_registry_then_load_model(driver):
+    registry = ModelRegistry(driver)
+    registry.register("xor_a", "./xor4_pb_tensil.tmodel")
+    registry.unregister("xor_a")
+    # the program goes to the default buffer, not to the one of xor_a
+    driver.load_model("./xor4_pb_tensil.tmodel")
+    assert driver.model_buffer_name == driver.program_buffer_name
+    assert "b_prog_xor_a" not in driver.program_buffers
+    dtype = data_type_numpy(driver.arch.data_type)
+    for case in XOR_CASES:
+        x = pad_to(np.array(case.input, dtype=dtype), driver.arch.array_size)
+        expected = pad_to(np.array(case.expected, dtype=dtype), driver.arch.array_size)
+        output = driver.run({"x": x})["Identity"]
+        np.testing.assert_allclose(expected, output, atol=1e-02)
+
+
+class CountingInstance(SimulatedInstance):
+    """A SimulatedInstance that counts the programs it executes"""
+
+    def __init__(self, arch):
+        super().__init__(arch)
+        self.executed = 0
+
+    def execute(self, program):
+        self.executed += 1
+        return super().execute(program)
+
+
+def test_tracer():
+    # always on the simulator, to count the round trips of the driver
+    tracer = Tracer()
+    inst = CountingInstance(tensil)
+    drv = Driver(instance=inst, tracer=tracer, debug=False)
+    try:
+        drv.load_model("./xor4_pb_tensil.tmodel")
+        assert tracer.counters["round_trips"] == inst.executed
+        tracer.reset()
+        executed = inst.executed
+        dtype = data_type_numpy(drv.arch.data_type)
+        x = pad_to(np.array((0, 1), dtype=dtype), drv.arch.array_size)
+        drv.run({"x": x})
+    finally:
+        drv.close()
+
+    trace = tracer.as_dict()
+    counters, totals = trace["counters"], trace["totals"]
+    round_trips = [s for s in trace["spans"] if s["category"] == "round_trip"]
+    assert counters["round_trips"] == inst.executed - executed == len(round_trips)
+    # inputs are uploaded, the program sent, the flush polled and the
+    # outputs read back, each in its own round trip
+    assert totals["upload"]["count"] == 1
+    assert totals["dma_send"]["count"] == 1
+    assert totals["flush_poll"]["count"] == drv.flush_stats.last_polls
+    assert totals["read"]["count"] == 1
+    assert totals["run"]["count"] == 1
+    assert counters["bytes_written"] >= x.size * drv.scalar_bytes
+    outputs = sum(drv.scalar_address(out.size) for out in drv.model.outputs)
+    assert counters["bytes_read"] == outputs * drv.scalar_bytes
+
+    chrome = json.loads(json.dumps(tracer.chrome_trace()))
+    spans = [e for e in chrome["traceEvents"] if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == [s["name"] for s in trace["spans"]]
+    assert all(e["dur"] >= 0 and e["ts"] >= 0 for e in spans)
+    values = {
+        e["name"]: e["args"][e["name"]] for e in chrome["traceEvents"] if e["ph"] == "C"
+    }
+    assert values == counters
+
+
 if __name__ == "__main__":
     try:
-        drv = Driver(image="robot/tensil:0.1.0", debug=False)
+        if os.environ.get("TENSIL_SIMULATOR"):
+            drv = Driver(instance=SimulatedInstance(tensil), debug=False)
+        else:
+            drv = Driver(image="robot/tensil:0.1.0", debug=False)
+        test_encoder(drv)
         test_local_memory(drv)
         test_matmul(drv)
         test_accumulator_memory(drv)
         test_dram1(drv)
+        test_chunk_split(drv)
+        test_map_file()
+        test_dma_write_recovery(drv)
         test_xor(drv)
+        test_xor_batch(drv, XOR_CASES)
+        test_registry(drv)
+        test_registry_then_load_model(drv)
+        test_tracer()
     finally:
         if isinstance(drv, Driver):
             drv.close()
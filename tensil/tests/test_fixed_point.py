@@ -0,0 +1,67 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tcu_pynq.util import vector_to_fixed_point, vector_from_fixed_point
+from tcu_sabana.driver import tensil
+from tcu_sabana.fixed import FixedPointCodec
+import numpy as np
+
+
+def reference(codec):
+    to_fixed = vector_to_fixed_point(codec.width, codec.binary_point)
+    from_fixed = vector_from_fixed_point(codec.width, codec.binary_point)
+    return lambda x: to_fixed(x).astype(codec.dtype), from_fixed
+
+
+def test_to_fixed():
+    codec = FixedPointCodec(tensil.data_type)
+    to_fixed, _ = reference(codec)
+    ulp = codec.inverse_scale
+    limit = codec.max * ulp
+    # ties of half an ulp, both ways of zero and around odd and even values
+    ties = (np.arange(-8, 8) + 0.5) * ulp
+    # saturation at both ends of the range
+    saturated = np.array(
+        [
+            limit,
+            limit + ulp / 2,
+            limit + ulp,
+            1e6,
+            -limit - ulp,
+            -limit - 1.5 * ulp,
+            -1e6,
+        ]
+    )
+    rng = np.random.default_rng(0)
+    x = np.concatenate([ties, saturated, rng.uniform(-2 * limit, 2 * limit, 1000)])
+    np.testing.assert_array_equal(codec.to_fixed(x), to_fixed(x))
+    assert codec.to_fixed(x).dtype == codec.dtype
+
+    # in place, into an array that is written and returned
+    out = np.empty(x.shape, dtype=codec.dtype)
+    assert codec.to_fixed(x, out) is out
+    np.testing.assert_array_equal(out, to_fixed(x))
+
+
+def test_from_fixed():
+    codec = FixedPointCodec(tensil.data_type)
+    _, from_fixed = reference(codec)
+    fixed = np.arange(codec.min, codec.max + 1, dtype=codec.dtype)
+    np.testing.assert_array_equal(codec.from_fixed(fixed), from_fixed(fixed))
+
+    out = np.empty(fixed.shape, dtype=np.float64)
+    assert codec.from_fixed(fixed, out) is out
+    np.testing.assert_array_equal(out, from_fixed(fixed))
+    # the round trip of fixed point values is exact
+    np.testing.assert_array_equal(codec.to_fixed(out), fixed)
@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from tcu_sabana.driver import Driver
+from tcu_sabana.driver import Driver, tensil
+from tcu_sabana.simulator import SimulatedInstance
 import numpy as np
+import os
 import pickle
 import time
 
@@ -89,7 +91,11 @@ def test_resnet(driver):
 
 if __name__ == "__main__":
     try:
-        drv = Driver(image="robot/tensil:0.1.0", debug=False)
+        # TENSIL_SIMULATOR=1 runs the model without deploying an instance
+        if os.environ.get("TENSIL_SIMULATOR"):
+            drv = Driver(instance=SimulatedInstance(tensil), debug=False)
+        else:
+            drv = Driver(image="robot/tensil:0.1.0", debug=False)
         test_resnet(drv)
     finally:
         if isinstance(drv, Driver):
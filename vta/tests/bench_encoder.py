@@ -0,0 +1,61 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import numpy as np
+from vta_encoder import encoder_for_spec
+from vta_testing import read_spec, random_instructions, packbits_per_bit
+
+
+def bench(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def bench_encoder(counts=(1000, 10000)):
+    spec = read_spec()
+    encoder = encoder_for_spec(spec)
+    row = "{:>8}{:>14}{:>14}{:>14}"
+    print(row.format("count", "per bit", "packbits", "structured"))
+    for count in counts:
+        instructions = random_instructions(spec, count)
+        fields = encoder.empty(count)
+        for i, instr in enumerate(instructions):
+            for f, v in instr.values.items():
+                fields[f][i] = v
+
+        def per_bit():
+            return np.concatenate([packbits_per_bit(i) for i in instructions])
+
+        def packbits():
+            return np.concatenate([i.packbits() for i in instructions])
+
+        expected, per_bit_time = bench(per_bit)
+        res, packbits_time = bench(packbits)
+        np.testing.assert_array_equal(res, expected)
+        res, structured_time = bench(encoder.encode, fields)
+        np.testing.assert_array_equal(res, expected)
+        print(
+            row.format(
+                count,
+                "{:.4f}s".format(per_bit_time),
+                "{:.4f}s".format(packbits_time),
+                "{:.4f}s".format(structured_time),
+            )
+        )
+
+
+if __name__ == "__main__":
+    bench_encoder()
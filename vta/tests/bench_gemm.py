@@ -0,0 +1,49 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from vta_gemm import VTAGemm
+from vta_session import VTASession
+from vta_testing import read_spec, SimulatedDriver
+
+
+def bench_gemm(shapes=((64, 256, 256), (128, 512, 256), (256, 1024, 256))):
+    spec = read_spec()
+    rng = np.random.default_rng(0)
+    driver = SimulatedDriver(spec)
+    row = "{:>16}{:>10}{:>12}{:>10}{:>10}"
+    print(row.format("m x k x n", "buffers", "cycles", "load", "compute"))
+    with VTASession(driver) as session:
+        for m, k, n in shapes:
+            a = rng.integers(-8, 8, size=(m, k), dtype=np.int8)
+            b = rng.integers(-8, 8, size=(k, n), dtype=np.int8)
+            expected = (a.astype(np.int32) @ b.astype(np.int32)).astype(np.int8)
+            for double_buffered in (False, True):
+                gemm = VTAGemm(session, spec, double_buffered=double_buffered)
+                np.testing.assert_array_equal(gemm.matmul(a, b), expected)
+                gemm.free()
+                report = driver.inst.last_report
+                print(
+                    row.format(
+                        "{}x{}x{}".format(m, k, n),
+                        2 if double_buffered else 1,
+                        report["cycles"],
+                        "{:.1%}".format(report["utilization"]["load"]),
+                        "{:.1%}".format(report["utilization"]["compute"]),
+                    )
+                )
+
+
+if __name__ == "__main__":
+    bench_gemm()
@@ -0,0 +1,61 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from vta import Load, VTAError
+from vta_encoder import EncoderError, encoder_for_spec
+from vta_testing import read_spec, packbits_per_bit, random_instructions
+
+
+def test_encoder():
+    spec = read_spec()
+    encoder = encoder_for_spec(spec)
+    instructions = random_instructions(spec, 64)
+
+    # single instructions are packed as before
+    for instr in instructions:
+        np.testing.assert_array_equal(instr.packbits(), packbits_per_bit(instr))
+
+    # and so are whole programs given as structured arrays
+    fields = encoder.empty(len(instructions))
+    for i, instr in enumerate(instructions):
+        for f, v in instr.values.items():
+            fields[f][i] = v
+    image = encoder.encode(fields)
+    expected = np.concatenate([packbits_per_bit(instr) for instr in instructions])
+    np.testing.assert_array_equal(image, expected)
+
+    decoded = encoder.decode(image)
+    for i, instr in enumerate(instructions):
+        for f, v in instr.values.items():
+            assert decoded[f][i] == v
+
+    out = np.zeros(encoder.nbytes(len(instructions)) + 16, dtype=np.uint8)
+    encoder.encode(fields, out=out)
+    np.testing.assert_array_equal(out[: image.size], image)
+
+
+def test_encoder_errors():
+    spec = read_spec()
+    encoder = encoder_for_spec(spec)
+    load = Load(spec)
+    with pytest.raises(VTAError):
+        load.set_field("y_size", 1 << 16)
+    with pytest.raises(VTAError):
+        load.set_field("imm", 1)
+    fields = encoder.empty(1)
+    fields["opcode"] = 7
+    with pytest.raises(EncoderError):
+        encoder.encode(fields)
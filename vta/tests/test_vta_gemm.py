@@ -0,0 +1,92 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from vta_gemm import VTAGemm, GemmError
+from vta_program import LOAD, COMPUTE, STORE
+from vta_session import VTASession
+from vta_testing import read_spec, SimulatedDriver
+
+
+def random_matrix(rng, shape):
+    return rng.integers(-8, 8, size=shape, dtype=np.int8)
+
+
+def expected(a, b, shift=0):
+    return ((a.astype(np.int32) @ b.astype(np.int32)) >> shift).astype(np.int8)
+
+
+def test_gemm():
+    spec = read_spec()
+    rng = np.random.default_rng(0)
+    driver = SimulatedDriver(spec)
+    with VTASession(driver) as session:
+        # tiles with partial rows, blocks of columns and steps of k
+        gemm = VTAGemm(session, spec, tile=(2, 2, 2))
+        for m, k, n in [(5, 40, 37), (1, 16, 16), (4, 64, 32)]:
+            a, b = random_matrix(rng, (m, k)), random_matrix(rng, (k, n))
+            np.testing.assert_array_equal(gemm.matmul(a, b), expected(a, b))
+        gemm.free()
+
+        gemm = VTAGemm(session, spec, shift=4)
+        a, b = random_matrix(rng, (70, 300)), random_matrix(rng, (300, 50))
+        assert gemm.tiles(70, 300, 50) == (64, 16, 4)
+        np.testing.assert_array_equal(gemm.matmul(a, b), expected(a, b, 4))
+        report = driver.inst.last_report
+        assert report["finished"]
+        assert report["instructions"] == {LOAD: 8, COMPUTE: 10, STORE: 2}
+
+        # the image is built once per shape
+        gemm.matmul(b.T, a.T)
+        gemm.matmul(b.T, a.T)
+        assert len(gemm.images) == 1
+        assert gemm.programs == 3
+        gemm.free()
+
+        gemm = VTAGemm(session, spec, double_buffered=False)
+        assert gemm.tiles(70, 300, 50) == (70, 16, 4)
+        np.testing.assert_array_equal(gemm.matmul(a, b), expected(a, b))
+
+
+def test_unaligned_buffers():
+    spec = read_spec()
+    rng = np.random.default_rng(0)
+    driver = SimulatedDriver(spec)
+    with VTASession(driver) as session:
+        # buffers are no longer aligned to the 256 bytes of a wgt tensor
+        driver.inst.dram.next_address += 16
+        gemm = VTAGemm(session, spec, tile=(2, 2, 2))
+        a, b = random_matrix(rng, (5, 40)), random_matrix(rng, (40, 37))
+        np.testing.assert_array_equal(gemm.matmul(a, b), expected(a, b))
+        address, offset, _ = gemm.buffers["gemm_wgt"]
+        assert address % 256 == 0 and offset == 256 - 16
+        gemm.free()
+
+
+def test_double_buffering():
+    spec = read_spec()
+    gemm = VTAGemm(None, spec, tile=(4, 2, 2))
+    program = gemm.create_program(8, 128, 64, (0, 0, 0, 0))
+    fields = program.fields()
+    opcodes = spec["value"]["opcode"]
+    # the loads of the next step are ahead of the gemm of the current one
+    gemms = np.flatnonzero(fields["opcode"] == opcodes["gemm"])
+    loads = np.flatnonzero(fields["opcode"] == opcodes["load"])
+    assert loads[3] < gemms[1] and loads[4] < gemms[1]
+
+    with pytest.raises(GemmError):
+        VTAGemm(None, spec, tile=(64, 32, 1)).tiles(64, 512, 16)
+    with pytest.raises(GemmError):
+        VTAGemm(None, spec, tile=(1024, 2, 2)).tiles(1024, 32, 32)
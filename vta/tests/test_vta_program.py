@@ -0,0 +1,81 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from vta import Load, Addi, Store, Finish
+from vta_program import VTAProgram, LOAD, COMPUTE, STORE
+from vta_testing import read_spec, double_buffered
+
+FLAGS = ["pop_prev_dep", "pop_next_dep", "push_prev_dep", "push_next_dep"]
+
+
+def test_load_store_flags():
+    """The flags that were set by hand in test_vta.load_store"""
+    spec = read_spec()
+    load = Load(spec, dram_base=5, y_size=1, x_size=1)
+    addi = Addi(spec, uop_end=1, iter_in=1, iter_out=1, push_next_dep=1)
+    store = Store(spec, dram_base=9, y_size=1, x_size=1)
+    store.set_field("pop_prev_dep", 1)
+    store.set_field("push_prev_dep", 1)
+    finish = Finish(spec, pop_next_dep=1)
+    expected = np.concatenate([i.packbits() for i in (load, addi, store, finish)])
+
+    program = VTAProgram(spec, capacity=2)
+    program.load("acc", 0, 5, x_stride=0)
+    program.alu("add", 0, 1, imm=0)
+    program.store(0, 9, x_stride=0)
+    program.finish()
+    np.testing.assert_array_equal(program.encode(), expected)
+
+    program = VTAProgram(spec)
+    for instr in (load, addi, store, finish):
+        program.append(instr)
+    np.testing.assert_array_equal(program.encode(), expected)
+
+
+def test_double_buffering():
+    spec = read_spec()
+    opcodes = spec["value"]["opcode"]
+    program = double_buffered(spec, reorder=True)
+    fields = program.fields()
+    modules = [program.modules[i] for i in program.schedule()]
+
+    # the loads of the second buffer are moved ahead of the first gemm
+    assert fields["opcode"].tolist()[:6] == [opcodes["load"]] * 5 + [opcodes["gemm"]]
+
+    # every token pushed is popped
+    def count(module, flag):
+        return sum(fields[flag][i] for i, m in enumerate(modules) if m == module)
+
+    assert count(LOAD, "push_next_dep") == count(COMPUTE, "pop_prev_dep")
+    assert count(COMPUTE, "push_prev_dep") == count(LOAD, "pop_next_dep")
+    assert count(COMPUTE, "push_next_dep") == count(STORE, "pop_prev_dep")
+    assert count(STORE, "push_prev_dep") == count(COMPUTE, "pop_next_dep")
+
+    # loads only wait for the gemm that used their buffer two tiles before
+    assert count(LOAD, "pop_next_dep") == 2
+
+    serial = double_buffered(spec, reorder=False).fields()
+    assert serial["opcode"].tolist()[:4] == [opcodes["load"]] * 3 + [opcodes["gemm"]]
+
+
+def test_loads_keep_their_order():
+    """
+    The load module runs its loads in order, so a load hoisted ahead of an
+    earlier one delays the gemm that needs the earlier one
+    """
+    spec = read_spec()
+    program = double_buffered(spec, reorder=True)
+    loads = [i for i in program.schedule() if program.modules[i] == LOAD]
+    assert loads == sorted(loads)
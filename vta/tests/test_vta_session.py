@@ -0,0 +1,87 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sabana.requests import is_alloc, is_mmio, is_write
+from vta import Finish
+from vta_program import VTAProgram
+from vta_session import VTASession
+from vta_testing import read_spec, SimulatedDriver
+
+
+def allocs(program):
+    return sum(1 for req in program.req.requests if is_alloc(req))
+
+
+def mmio_writes(program):
+    return sum(1 for req in program.req.requests if is_mmio(req) and is_write(req))
+
+
+def add(spec, session, value):
+    program = VTAProgram(spec)
+    program.load("acc", 0, session.buffers["inp"][0] // 64)
+    program.alu("add", 0, 1, imm=value)
+    program.store(0, session.buffers["out"][0] // 16)
+    program.finish()
+    return program.encode()
+
+
+def test_session():
+    spec = read_spec()
+    driver = SimulatedDriver(spec)
+    with VTASession(driver) as session:
+        session.alloc("inp", 64)
+        session.alloc("out", 16)
+        first = len(driver.programs)
+        image = add(spec, session, 1)
+        for i in range(3):
+            data = np.arange(16, dtype=np.int32) * i
+            res = session.run(
+                image, writes=[("inp", data)], reads=[("out", np.int8, (16,))]
+            )
+            np.testing.assert_array_equal(res[0], data + 1)
+
+        # one program per batch, which writes instructions and registers once
+        batches = driver.programs[first:]
+        assert len(batches) == 3
+        assert all(allocs(p) == 0 for p in batches)
+        assert [mmio_writes(p) for p in batches] == [3, 1, 1]
+        assert session.instructions_written == 4
+
+        res = session.run(add(spec, session, 2), reads=[("out", np.int8, (16,))])
+        np.testing.assert_array_equal(res[0], np.arange(16) * 2 + 2)
+        assert mmio_writes(driver.programs[-1]) == 2
+    assert session.batches == 4
+
+
+def test_ring():
+    spec = read_spec()
+    driver = SimulatedDriver(spec)
+    finish = Finish(spec).packbits()
+    session = VTASession(driver, capacity=4)
+    session.open()
+    address = session.ring_address
+    images = [np.tile(finish, n) for n in (1, 2, 3)]
+    for image in images:
+        session.run(image)
+    # the third image does not fit after the first two
+    assert session.resident == {images[2].tobytes(): 0}
+    assert driver.inst.last_report["finished"]
+
+    session.run(np.tile(finish, 6))
+    assert session.capacity == 8 * 16
+    assert session.ring_address != address
+    assert driver.inst.last_report["finished"]
+    session.close()
+    assert not driver.inst.buffers
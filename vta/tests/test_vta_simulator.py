@@ -0,0 +1,170 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from sabana import Program
+from vta_program import VTAProgram, LOAD, COMPUTE, STORE
+from vta_simulator import DRAM, VTASimulator, SimulatedInstance, SimulatorError
+from vta_testing import read_spec, double_buffered
+
+
+def uops(spec, indices):
+    """Returns the (dst, src, wgt) indices of uops as np.uint32"""
+    dst_bits = spec["width"]["dst_factor"]
+    src_bits = spec["width"]["src_factor"]
+    return np.array(
+        [d | (s << dst_bits) | (w << (dst_bits + src_bits)) for d, s, w in indices],
+        np.uint32,
+    )
+
+
+def test_load_store():
+    """The load_store program of test_vta, on a SimulatedInstance"""
+    spec = read_spec()
+    inst = SimulatedInstance(spec)
+    inst.up()
+
+    prog = Program()
+    prog.buffer_alloc(name="inp", size=256)
+    prog.buffer_alloc(name="out", size=256)
+    prog.buffer_write(np.arange(64, dtype=np.int32), name="inp", offset=0)
+    load_addr, store_addr = inst.execute(prog)
+
+    program = VTAProgram(spec)
+    program.load("acc", 0, int(load_addr) // 64)
+    program.alu("add", 0, 1, imm=0)
+    program.store(0, int(store_addr) // 16)
+    program.finish()
+    image = program.encode()
+
+    prog = Program()
+    prog.mmio_alloc(name="c0", size=0x00010000, base_address=0xA0000000)
+    prog.buffer_alloc(name="instr", size=image.shape[0])
+    prog.buffer_write(image, name="instr", offset=0)
+    prog.mmio_write(np.array([image.shape[0] // 16], np.uint32), name="c0", offset=0x8)
+    instr_addr = inst.execute(prog)[0]
+
+    prog = Program()
+    prog.mmio_write(np.array([instr_addr], np.uint32), name="c0", offset=0xC)
+    prog.mmio_write(np.array([1], np.uint32), name="c0", offset=0x0)
+    prog.mmio_wait(np.array([2], np.uint32), name="c0", offset=0x0, timeout=4)
+    prog.buffer_read(name="out", offset=0, dtype=np.uint8, shape=(256,))
+    result = inst.execute(prog)[0]
+    inst.down()
+
+    np.testing.assert_array_equal(result[0:16], np.arange(16, dtype=np.uint8))
+    assert inst.last_report["finished"]
+    assert inst.last_report["instructions"] == {LOAD: 0, COMPUTE: 3, STORE: 1}
+
+
+def test_gemm():
+    """A (4, 32) by (32, 32) int8 multiplication, in blocks of 16"""
+    spec = read_spec()
+    sim = VTASimulator(spec)
+    rng = np.random.default_rng(0)
+    a = rng.integers(-4, 4, size=(4, 32), dtype=np.int8)
+    w = rng.integers(-4, 4, size=(32, 32), dtype=np.int8)
+
+    # inp tensor m * 2 + k holds a[m, k], wgt tensor n * 2 + k holds w[k, n].T
+    inp = a.reshape(4, 2, 16)
+    wgt = w.reshape(2, 16, 2, 16).transpose(2, 0, 3, 1)
+    uop = uops(spec, [(0, 0, 0), (0, 1, 1)])
+    addresses = []
+    for data in (uop, inp, wgt):
+        address = sim.dram.alloc(data.nbytes)
+        sim.dram.view(address, data.nbytes)[:] = data.view(np.uint8).reshape(-1)
+        addresses.append(address)
+    out = sim.dram.alloc(4 * 2 * 16)
+
+    program = VTAProgram(spec)
+    program.load("uop", 0, addresses[0] // 4, 1, 2)
+    program.load("inp", 0, addresses[1] // 16, 1, 8)
+    program.load("wgt", 0, addresses[2] // 256, 1, 4)
+    loops = dict(iter_out=4, iter_in=2, dst_factor=(2, 1))
+    program.gemm(0, 1, reset=True, **loops)
+    program.gemm(0, 2, src_factor=(2, 0), wgt_factor=(0, 2), **loops)
+    program.store(0, out // 16, 1, 8)
+    program.finish()
+    report = sim.run(program.encode())
+
+    result = sim.dram.view(out, 4 * 2 * 16).view(np.int8).reshape(4, 32)
+    expected = a.astype(np.int32) @ w.astype(np.int32)
+    np.testing.assert_array_equal(result, expected.astype(np.int8))
+    np.testing.assert_array_equal(sim.acc[:8, 0].reshape(4, 32), expected)
+    assert report["finished"]
+    assert report["instructions"] == {LOAD: 2, COMPUTE: 4, STORE: 1}
+
+
+def test_alu():
+    spec = read_spec()
+    sim = VTASimulator(spec)
+    acc = np.arange(-64, 64, dtype=np.int32).reshape(8, 16)
+    address = sim.dram.alloc(acc.nbytes)
+    sim.dram.view(address, acc.nbytes)[:] = acc.view(np.uint8).reshape(-1)
+    sim.uop[:4] = uops(spec, [(i, i + 4, 0) for i in range(4)])
+
+    program = VTAProgram(spec)
+    program.load("acc", 0, address // 64, 1, 8)
+    # relu of the first 4 tensors, then the max of every pair of tensors
+    program.alu("max", 0, 4, imm=0)
+    program.alu("max", 0, 4)
+    program.alu("shr", 0, 4, imm=-1)
+    program.finish()
+    sim.run(program.encode())
+
+    expected = np.maximum(np.maximum(acc[:4], 0), acc[4:]) << 1
+    np.testing.assert_array_equal(sim.acc[:4, 0], expected)
+    np.testing.assert_array_equal(sim.out[:4, 0], expected.astype(np.int8))
+
+    # uops that reduce into the same tensor, as in pooling
+    sim.uop[4:8] = uops(spec, [(0, i, 0) for i in range(4, 8)])
+    program = VTAProgram(spec)
+    program.alu("max", 4, 8)
+    program.finish()
+    sim.run(program.encode())
+    np.testing.assert_array_equal(
+        sim.acc[0, 0], np.max(np.vstack([expected[:1], acc[4:]]), 0)
+    )
+
+
+def test_report():
+    spec = read_spec()
+    program = double_buffered(spec, reorder=True)
+    # the program loads from the first bytes of DRAM
+    sim = VTASimulator(spec, DRAM(base=0))
+    report = sim.run(program.encode())
+    assert report["finished"]
+    assert report["instructions"] == {LOAD: 8, COMPUTE: 6, STORE: 1}
+    for module in (LOAD, COMPUTE, STORE):
+        assert report["busy"][module] + report["stall"][module] <= report["cycles"]
+        assert 0 < report["utilization"][module] <= 1
+
+
+def test_deadlock():
+    spec = read_spec()
+    sim = VTASimulator(spec)
+    program = VTAProgram(spec)
+    program.store(0, 0)
+    program.finish()
+    fields = program.fields()
+    # a store that waits on compute, which pushes nothing
+    fields["pop_prev_dep"][0] = 1
+    with pytest.raises(SimulatorError, match="deadlock"):
+        sim.run_fields(fields)
+
+    program = VTAProgram(spec)
+    program.load("inp", 2040, 0, 1, 16)
+    with pytest.raises(SimulatorError, match="out of inp"):
+        sim.run(program.encode())
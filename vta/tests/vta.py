@@ -13,223 +13,117 @@
 # limitations under the License.
 
 import numpy as np
+from vta_encoder import LAYOUTS, encoder_for_spec
 
 
 class Instruction:
-    def __init__(self):
-        self.fields = {}
-        self.values = {}
-        self.widths = {}
+    """
+    A VTA instruction. Every field of the layout of the instruction is an
+    attribute, stored in __slots__, and the widths and offsets of the
+    fields are shared by all the instructions of a spec. Fields can be
+    given as keyword arguments, and are checked against their widths.
+
+    defaults are the (field, value) pairs that a subclass sets before the
+    keyword arguments, where a value is an int or the (table, name) of a
+    value in spec["value"].
+    """
+
+    __slots__ = ("encoder",)
+    kind = None
+    fields = ()
+    defaults = ()
+
+    def __init__(self, spec, **values):
+        self.encoder = encoder_for_spec(spec)
+        for f in self.fields:
+            setattr(self, f, 0)
+        for f, value in self.defaults:
+            if not isinstance(value, int):
+                value = spec["value"][value[0]][value[1]]
+            setattr(self, f, value)
+        for key, value in values.items():
+            self.set_field(key, value)
+
+    @property
+    def widths(self):
+        return self.encoder.widths[self.kind]
+
+    @property
+    def values(self):
+        """A new dict of the fields, read-only: use set_field to change them"""
+        return {f: getattr(self, f) for f in self.fields}
 
     def set_field(self, key, value):
-        if not key in self.values:
+        if key not in self.widths:
             raise VTAError("field {} not found".format(key))
-        self.values[key] = value
+        value = int(value)
+        if value < 0 or value >> self.widths[key]:
+            raise VTAError(
+                "value {} does not fit in the {} bits of field {}".format(
+                    value, self.widths[key], key
+                )
+            )
+        setattr(self, key, value)
 
     def unpackbits(self):
-        res = np.array([], dtype=np.uint8)
+        return np.unpackbits(self.packbits(), bitorder="little")
+
+    def pack(self):
+        """Returns the instruction as an int"""
+        offsets = self.encoder.offsets[self.kind]
+        res = 0
         for f in self.fields:
-            val = np.array([self.values[f]], dtype=np.uint32)
-            val = np.frombuffer(val.tobytes(), dtype=np.uint8)
-            bit = np.unpackbits(val, bitorder="little", count=self.widths[f])
-            res = np.concatenate((res, bit), dtype=np.uint8)
+            res |= getattr(self, f) << offsets[f]
         return res
 
     def packbits(self):
-        res = self.unpackbits()
-        return np.packbits(res, bitorder="little")
+        raw = self.pack().to_bytes(self.encoder.instruction_size_bytes, "little")
+        return np.frombuffer(raw, dtype=np.uint8).copy()
 
 
 class VTAError(Exception):
     pass
 
 
-class MemInstr(Instruction):
-    def __init__(self, spec):
-        super().__init__()
-        self.fields = [
-            "opcode",
-            "pop_prev_dep",
-            "pop_next_dep",
-            "push_prev_dep",
-            "push_next_dep",
-            "mem_type",
-            "sram_base",
-            "dram_base",
-            "empty",
-            "y_size",
-            "x_size",
-            "x_stride",
-            "y_pad_0",
-            "y_pad_1",
-            "x_pad_0",
-            "x_pad_1",
-        ]
-        for f in self.fields:
-            self.values[f] = 0
-            if f == "opcode":
-                self.widths[f] = spec["width"]["opcode"]
-            elif (
-                f == "pop_prev_dep"
-                or f == "pop_next_dep"
-                or f == "push_prev_dep"
-                or f == "push_next_dep"
-            ):
-                self.widths[f] = spec["width"]["flag"]
-            elif f == "mem_type":
-                self.widths[f] = spec["width"]["mem_id"]
-            elif f == "sram_base":
-                self.widths[f] = spec["width"]["mem_sram"]
-            elif f == "dram_base":
-                self.widths[f] = spec["width"]["mem_dram"]
-            elif f == "y_size":
-                self.widths[f] = spec["width"]["mem_size"]
-            elif f == "x_size":
-                self.widths[f] = spec["width"]["mem_size"]
-            elif f == "x_stride":
-                self.widths[f] = spec["width"]["mem_stride"]
-            elif f == "y_pad_0" or f == "y_pad_1" or f == "x_pad_0" or f == "x_pad_1":
-                self.widths[f] = spec["width"]["mem_pad"]
-            elif f == "empty":
-                self.widths[f] = spec["width"]["mem_empty"]
-        assert len(self.values) == len(self.widths) and len(self.values) == len(
-            self.fields
-        )
-
-
-class GemmInstr(Instruction):
-    def __init__(self, spec):
-        super().__init__()
-        self.fields = [
-            "opcode",
-            "pop_prev_dep",
-            "pop_next_dep",
-            "push_prev_dep",
-            "push_next_dep",
-            "reset_flag",
-            "uop_bgn",
-            "uop_end",
-            "iter_out",
-            "iter_in",
-            "empty",
-            "dst_factor_out",
-            "dst_factor_in",
-            "src_factor_out",
-            "src_factor_in",
-            "wgt_factor_out",
-            "wgt_factor_in",
-        ]
-        for f in self.fields:
-            self.values[f] = 0
-            if f == "opcode":
-                self.widths[f] = spec["width"]["opcode"]
-            elif (
-                f == "pop_prev_dep"
-                or f == "pop_next_dep"
-                or f == "push_prev_dep"
-                or f == "push_next_dep"
-                or f == "reset_flag"
-            ):
-                self.widths[f] = spec["width"]["flag"]
-            elif f == "uop_bgn":
-                self.widths[f] = spec["width"]["uop_begin"]
-            elif f == "uop_end":
-                self.widths[f] = spec["width"]["uop_end"]
-            elif f == "iter_out" or f == "iter_in":
-                self.widths[f] = spec["width"]["iter"]
-            elif f == "dst_factor_out" or f == "dst_factor_in":
-                self.widths[f] = spec["width"]["dst_factor"]
-            elif f == "src_factor_out" or f == "src_factor_in":
-                self.widths[f] = spec["width"]["src_factor"]
-            elif f == "wgt_factor_out" or f == "wgt_factor_in":
-                self.widths[f] = spec["width"]["wgt_factor"]
-            elif f == "empty":
-                self.widths[f] = spec["width"]["gemm_empty"]
-        assert len(self.values) == len(self.widths) and len(self.values) == len(
-            self.fields
-        )
-
-
-class AluInstr(Instruction):
-    def __init__(self, spec):
-        super().__init__()
-        self.fields = [
-            "opcode",
-            "pop_prev_dep",
-            "pop_next_dep",
-            "push_prev_dep",
-            "push_next_dep",
-            "reset_reg",
-            "uop_bgn",
-            "uop_end",
-            "iter_out",
-            "iter_in",
-            "empty",
-            "dst_factor_out",
-            "dst_factor_in",
-            "src_factor_out",
-            "src_factor_in",
-            "alu_opcode",
-            "use_imm",
-            "imm",
-        ]
-        for f in self.fields:
-            self.values[f] = 0
-            if f == "opcode":
-                self.widths[f] = spec["width"]["opcode"]
-            elif (
-                f == "pop_prev_dep"
-                or f == "pop_next_dep"
-                or f == "push_prev_dep"
-                or f == "push_next_dep"
-                or f == "reset_reg"
-                or f == "use_imm"
-            ):
-                self.widths[f] = spec["width"]["flag"]
-            elif f == "uop_bgn":
-                self.widths[f] = spec["width"]["uop_begin"]
-            elif f == "uop_end":
-                self.widths[f] = spec["width"]["uop_end"]
-            elif f == "iter_out" or f == "iter_in":
-                self.widths[f] = spec["width"]["iter"]
-            elif f == "dst_factor_out" or f == "dst_factor_in":
-                self.widths[f] = spec["width"]["dst_factor"]
-            elif f == "src_factor_out" or f == "src_factor_in":
-                self.widths[f] = spec["width"]["src_factor"]
-            elif f == "alu_opcode":
-                self.widths[f] = spec["width"]["alu_opcode"]
-            elif f == "imm":
-                self.widths[f] = spec["width"]["alu_imm"]
-            elif f == "empty":
-                self.widths[f] = spec["width"]["alu_empty"]
-        assert len(self.values) == len(self.widths) and len(self.values) == len(
-            self.fields
-        )
+def instruction_class(name, kind):
+    """Returns a subclass of Instruction with the fields of the layout kind"""
+    fields = tuple(f for f, _ in LAYOUTS[kind])
+    return type(
+        name,
+        (Instruction,),
+        {
+            "__slots__": fields,
+            "__doc__": "A VTA instruction with the {} layout".format(kind),
+            "kind": kind,
+            "fields": fields,
+        },
+    )
+
+
+MemInstr = instruction_class("MemInstr", "mem")
+GemmInstr = instruction_class("GemmInstr", "gemm")
+AluInstr = instruction_class("AluInstr", "alu")
 
 
 class Finish(GemmInstr):
-    def __init__(self, spec):
-        super().__init__(spec)
-        self.set_field("opcode", spec["value"]["opcode"]["finish"])
+    __slots__ = ()
+    defaults = (("opcode", ("opcode", "finish")),)
 
 
 class Load(MemInstr):
-    def __init__(self, spec):
-        super().__init__(spec)
-        self.set_field("opcode", spec["value"]["opcode"]["load"])
-        self.set_field("mem_type", spec["value"]["mem_id"]["acc"])
+    __slots__ = ()
+    defaults = (("opcode", ("opcode", "load")), ("mem_type", ("mem_id", "acc")))
 
 
 class Store(MemInstr):
-    def __init__(self, spec):
-        super().__init__(spec)
-        self.set_field("opcode", spec["value"]["opcode"]["store"])
-        self.set_field("mem_type", spec["value"]["mem_id"]["out"])
+    __slots__ = ()
+    defaults = (("opcode", ("opcode", "store")), ("mem_type", ("mem_id", "out")))
 
 
 class Addi(AluInstr):
-    def __init__(self, spec):
-        super().__init__(spec)
-        self.set_field("opcode", spec["value"]["opcode"]["alu"])
-        self.set_field("alu_opcode", spec["value"]["alu_opcode"]["add"])
-        self.set_field("use_imm", 1)
+    __slots__ = ()
+    defaults = (
+        ("opcode", ("opcode", "alu")),
+        ("alu_opcode", ("alu_opcode", "add")),
+        ("use_imm", 1),
+    )
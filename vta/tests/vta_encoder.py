@@ -0,0 +1,278 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+DEPENDENCY_FLAGS = [
+    ("pop_prev_dep", "flag"),
+    ("pop_next_dep", "flag"),
+    ("push_prev_dep", "flag"),
+    ("push_next_dep", "flag"),
+]
+
+# Fields of every kind of instruction, from the least significant bit,
+# with the key of their width in the "width" section of vta_spec.json
+LAYOUTS = {
+    "mem": [("opcode", "opcode")]
+    + DEPENDENCY_FLAGS
+    + [
+        ("mem_type", "mem_id"),
+        ("sram_base", "mem_sram"),
+        ("dram_base", "mem_dram"),
+        ("empty", "mem_empty"),
+        ("y_size", "mem_size"),
+        ("x_size", "mem_size"),
+        ("x_stride", "mem_stride"),
+        ("y_pad_0", "mem_pad"),
+        ("y_pad_1", "mem_pad"),
+        ("x_pad_0", "mem_pad"),
+        ("x_pad_1", "mem_pad"),
+    ],
+    "gemm": [("opcode", "opcode")]
+    + DEPENDENCY_FLAGS
+    + [
+        ("reset_flag", "flag"),
+        ("uop_bgn", "uop_begin"),
+        ("uop_end", "uop_end"),
+        ("iter_out", "iter"),
+        ("iter_in", "iter"),
+        ("empty", "gemm_empty"),
+        ("dst_factor_out", "dst_factor"),
+        ("dst_factor_in", "dst_factor"),
+        ("src_factor_out", "src_factor"),
+        ("src_factor_in", "src_factor"),
+        ("wgt_factor_out", "wgt_factor"),
+        ("wgt_factor_in", "wgt_factor"),
+    ],
+    "alu": [("opcode", "opcode")]
+    + DEPENDENCY_FLAGS
+    + [
+        ("reset_reg", "flag"),
+        ("uop_bgn", "uop_begin"),
+        ("uop_end", "uop_end"),
+        ("iter_out", "iter"),
+        ("iter_in", "iter"),
+        ("empty", "alu_empty"),
+        ("dst_factor_out", "dst_factor"),
+        ("dst_factor_in", "dst_factor"),
+        ("src_factor_out", "src_factor"),
+        ("src_factor_in", "src_factor"),
+        ("alu_opcode", "alu_opcode"),
+        ("use_imm", "flag"),
+        ("imm", "alu_imm"),
+    ],
+}
+
+# The layout of the instructions of every opcode
+OPCODE_LAYOUTS = {
+    "load": "mem",
+    "store": "mem",
+    "gemm": "gemm",
+    "finish": "gemm",
+    "alu": "alu",
+}
+
+
+class InstructionEncoder:
+    """
+    InstructionEncoder packs VTA instructions into an instruction image,
+    with the same encoding as Instruction.packbits in the original per bit
+    implementation: the fields of an instruction are laid out one after
+    the other from its least significant bit, and instructions are stored
+    little endian, 16 bytes each.
+
+    The offset and mask of every field are computed once from the spec.
+    Whole programs are given as structured arrays of dtype self.dtype,
+    with one row per instruction and one field per instruction field of
+    any kind. The layout of a row is selected by its opcode, and fields
+    that are not part of that layout are ignored.
+
+    Parameters
+    ----------
+    spec : dict
+        The contents of vta_spec.json
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.instruction_bits = spec["width"]["instruction"]
+        self.instruction_size_bytes = self.instruction_bits // 8
+        self.words = -(-self.instruction_bits // 64)
+        self.opcodes = dict(spec["value"]["opcode"])
+
+        self.widths = dict()
+        self.offsets = dict()
+        names = []
+        for kind, layout in LAYOUTS.items():
+            offset = 0
+            self.widths[kind] = dict()
+            self.offsets[kind] = dict()
+            for field, key in layout:
+                self.widths[kind][field] = spec["width"][key]
+                self.offsets[kind][field] = offset
+                offset += spec["width"][key]
+                if field not in names:
+                    names.append(field)
+            if offset > self.instruction_bits:
+                raise EncoderError(
+                    "{} instructions take {} bits, more than {}".format(
+                        kind, offset, self.instruction_bits
+                    )
+                )
+        self.fields = {kind: [f for f, _ in layout] for kind, layout in LAYOUTS.items()}
+        self.dtype = np.dtype([(f, np.uint64) for f in names])
+        self.kinds = {
+            self.opcodes[name]: kind
+            for name, kind in OPCODE_LAYOUTS.items()
+            if name in self.opcodes
+        }
+
+    def nbytes(self, count):
+        """Returns the size in bytes of an image of count instructions"""
+        return count * self.instruction_size_bytes
+
+    def empty(self, count):
+        """Returns a structured array of count instructions, all fields zero"""
+        return np.zeros(count, dtype=self.dtype)
+
+    def kind(self, opcode):
+        if opcode not in self.kinds:
+            raise EncoderError("unknown opcode {}".format(opcode))
+        return self.kinds[opcode]
+
+    def check(self, kind, values):
+        for field, value in values.items():
+            if field not in self.widths[kind]:
+                raise EncoderError(
+                    "field {} is not part of {} instructions".format(field, kind)
+                )
+            if value < 0 or value >> self.widths[kind][field]:
+                raise EncoderError(
+                    "value {} does not fit in the {} bits of field {}".format(
+                        value, self.widths[kind][field], field
+                    )
+                )
+
+    def pack(self, kind, values):
+        """Returns an instruction given as a dict of field values as an int"""
+        values = {field: int(value) for field, value in values.items()}
+        self.check(kind, values)
+        offsets = self.offsets[kind]
+        res = 0
+        for field, value in values.items():
+            res |= value << offsets[field]
+        return res
+
+    def packbits(self, kind, values):
+        """Returns an instruction given as a dict of field values as np.uint8"""
+        raw = self.pack(kind, values).to_bytes(self.instruction_size_bytes, "little")
+        return np.frombuffer(raw, dtype=np.uint8).copy()
+
+    def words_from_fields(self, instructions):
+        """Packs a structured array of fields into 64 bits words"""
+        count = instructions.shape[0]
+        words = np.zeros((count, self.words), dtype=np.uint64)
+        opcodes = instructions["opcode"]
+        unknown = ~np.isin(opcodes, list(self.kinds))
+        if unknown.any():
+            raise EncoderError("unknown opcode {}".format(opcodes[unknown][0]))
+        for kind in set(self.kinds.values()):
+            opcodes_of_kind = [op for op, k in self.kinds.items() if k == kind]
+            rows = np.flatnonzero(np.isin(opcodes, opcodes_of_kind))
+            if rows.size == 0:
+                continue
+            for field in self.fields[kind]:
+                if field not in instructions.dtype.names:
+                    continue
+                values = instructions[field][rows].astype(np.uint64)
+                width = self.widths[kind][field]
+                if (values >> np.uint64(width)).any():
+                    raise EncoderError(
+                        "values do not fit in the {} bits of field {}".format(
+                            width, field
+                        )
+                    )
+                word, shift = divmod(self.offsets[kind][field], 64)
+                words[rows, word] |= values << np.uint64(shift)
+                if shift + width > 64:
+                    words[rows, word + 1] |= values >> np.uint64(64 - shift)
+        return words
+
+    def encode(self, instructions, out=None):
+        """
+        Returns a np.uint8 array with the encoded instructions, a structured
+        array with an opcode field and any of the fields of self.dtype.
+
+        If out is given, the instructions are encoded in place into
+        out[: self.nbytes(len(instructions))] and out is returned
+        """
+        words = self.words_from_fields(instructions)
+        count = words.shape[0]
+        size = self.nbytes(count)
+        if out is None:
+            out = np.empty(size, dtype=np.uint8)
+        elif out.dtype != np.uint8 or out.size < size:
+            raise EncoderError(
+                "out must be a np.uint8 array of at least {} bytes".format(size)
+            )
+        image = out[:size].reshape((count, self.instruction_size_bytes))
+        raw = words.astype("<u8", copy=False).view(np.uint8)
+        image[:] = raw.reshape((count, 8 * self.words))[
+            :, : self.instruction_size_bytes
+        ]
+        return out
+
+    def decode(self, image):
+        """
+        Returns a structured array of dtype self.dtype with the fields of
+        every instruction in a np.uint8 instruction image
+        """
+        count = image.size // self.instruction_size_bytes
+        raw = np.zeros((count, 8 * self.words), dtype=np.uint8)
+        raw[:, : self.instruction_size_bytes] = image[: self.nbytes(count)].reshape(
+            (count, self.instruction_size_bytes)
+        )
+        words = raw.view("<u8").reshape((count, self.words))
+        res = self.empty(count)
+        mask = np.uint64((1 << self.spec["width"]["opcode"]) - 1)
+        res["opcode"] = words[:, 0] & mask
+        for kind in set(self.kinds.values()):
+            opcodes_of_kind = [op for op, k in self.kinds.items() if k == kind]
+            rows = np.flatnonzero(np.isin(res["opcode"], opcodes_of_kind))
+            if rows.size == 0:
+                continue
+            for field in self.fields[kind]:
+                width = self.widths[kind][field]
+                word, shift = divmod(self.offsets[kind][field], 64)
+                values = words[rows, word] >> np.uint64(shift)
+                if shift + width > 64:
+                    values |= words[rows, word + 1] << np.uint64(64 - shift)
+                res[field][rows] = values & np.uint64((1 << width) - 1)
+        return res
+
+
+_encoders = dict()
+
+
+def encoder_for_spec(spec):
+    """Returns the InstructionEncoder of spec, built once per spec"""
+    cached = _encoders.get(id(spec))
+    if cached is None or cached.spec is not spec:
+        cached = InstructionEncoder(spec)
+        _encoders[id(spec)] = cached
+    return cached
+
+
+class EncoderError(Exception):
+    pass
@@ -0,0 +1,303 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from vta_program import VTAProgram
+from vta_simulator import HARDWARE
+
+# Bytes of the DRAM units of the uop, inp, wgt and out memories
+UOP_BYTES = 4
+INP_BYTES = 16
+WGT_BYTES = 256
+OUT_BYTES = 16
+
+
+class VTAGemm:
+    """
+    VTAGemm multiplies int8 matrices of any size on a vta instance. A
+    multiplication of an MxK matrix by a KxN matrix is lowered into a
+    single program, that computes C in tiles of tm rows by tn blocks of 16
+    columns, and goes through K in steps of tk blocks of 16:
+
+    - every step loads tm x tk inp tensors and tn x tk wgt tensors, with
+      x_stride set to the blocks of K, and the last step pads the missing
+      blocks of K with zeros
+    - a gemm instruction runs tk uops in a loop of iter_out rows by
+      iter_in blocks of columns, with the factors of the tile layout
+    - once K is done the tile is shifted right by shift, if not 0, and
+      stored from out to C
+
+    inp and wgt are double buffered: the loads of a step go to the buffer
+    that the previous step does not use, so that they overlap with its
+    gemm. acc is double buffered as well, so that the store of a tile
+    overlaps with the next one. With double_buffered=False every memory
+    holds a single buffer, twice as large, and the modules wait for each
+    other. Results are the low 8 bits of the acc values, as out holds them.
+
+    A is written to DRAM as it is, with K padded to blocks of 16, and B as
+    wgt tensors of 16x16 transposed blocks. The buffers are allocated in
+    the session, and grow with the matrices. Each buffer is allocated
+    with room to align its address to the DRAM unit of its memory.
+
+    Parameters
+    ----------
+    session : VTASession
+        The session of the instance
+    spec : dict
+        The contents of vta_spec.json
+    tile : tuple (optional)
+        (tm, tk, tn) of the tiles, chosen from the matrices if not given
+    shift : int
+        Right shift of the acc values before they are stored
+    double_buffered : bool
+        Whether inp, wgt and acc hold two buffers
+    hardware : dict (optional)
+        Overrides of HARDWARE
+    """
+
+    def __init__(
+        self,
+        session,
+        spec,
+        tile=None,
+        shift=0,
+        double_buffered=True,
+        hardware=None,
+    ):
+        self.session = session
+        self.spec = spec
+        self.tile = tile
+        self.shift = shift
+        self.buffers_per_memory = 2 if double_buffered else 1
+        self.hw = dict(HARDWARE, **(hardware or {}))
+        if self.hw["batch"] != 1 or self.hw["block_in"] != self.hw["block_out"]:
+            raise GemmError("only a batch of 1 and square blocks are supported")
+        self.block = self.hw["block_in"]
+        self.max_pad = (1 << spec["width"]["mem_pad"]) - 1
+        self.buffers = dict()
+        self.images = dict()
+        self.programs = 0
+
+    def blocks(self, size):
+        return -(-size // self.block)
+
+    def tiles(self, m, k, n):
+        """
+        Returns (tm, tk, tn) for a multiplication of m x k by k x n
+        matrices, the largest tiles whose buffers fit in the scratchpads
+        """
+        n_buf = self.buffers_per_memory
+        if self.tile is not None:
+            tm, tk, tn = self.tile
+        else:
+            kb, nb = self.blocks(k), self.blocks(n)
+            tk = min(kb, self.max_pad + 1)
+            tn = min(nb, self.hw["wgt_depth"] // (n_buf * tk))
+            tm = min(
+                m,
+                self.hw["inp_depth"] // (n_buf * tk),
+                self.hw["acc_depth"] // (n_buf * tn),
+            )
+        if (
+            min(tm, tk, tn) < 1
+            or n_buf * tm * tk > self.hw["inp_depth"]
+            or n_buf * tn * tk > self.hw["wgt_depth"]
+            or n_buf * tm * tn > self.hw["acc_depth"]
+        ):
+            raise GemmError(
+                "tiles {} do not fit in the scratchpads".format((tm, tk, tn))
+            )
+        if tk - 1 > self.max_pad:
+            raise GemmError(
+                "tk of {} needs more than {} blocks of padding".format(tk, self.max_pad)
+            )
+        return tm, tk, tn
+
+    def uops(self, tm, tk, tn):
+        """
+        Returns the uops of the tiles as np.uint32. The first ones reset
+        the acc buffers, then tk gemm uops for every inp and wgt buffer and
+        acc buffer, see uop_base
+        """
+        dst_bits = self.spec["width"]["dst_factor"]
+        src_bits = self.spec["width"]["src_factor"]
+        n_buf = self.buffers_per_memory
+        uops = [(ab * tm * tn, ab * tm * tn, 0) for ab in range(n_buf)]
+        for buf in range(n_buf):
+            for ab in range(n_buf):
+                uops += [
+                    (ab * tm * tn, buf * tm * tk + kk, buf * tn * tk + kk)
+                    for kk in range(tk)
+                ]
+        return np.array(
+            [d | (s << dst_bits) | (w << (dst_bits + src_bits)) for d, s, w in uops],
+            np.uint32,
+        )
+
+    def uop_base(self, buf, ab, tk):
+        n_buf = self.buffers_per_memory
+        return n_buf + (n_buf * buf + ab) * tk
+
+    def pack(self, a, b):
+        """Returns a and b as the inp and wgt tensors in DRAM"""
+        (m, k), n = a.shape, b.shape[1]
+        kb, nb = self.blocks(k), self.blocks(n)
+        inp = np.zeros((m, kb * self.block), np.int8)
+        inp[:, :k] = a
+        padded = np.zeros((kb * self.block, nb * self.block), np.int8)
+        padded[:k, :n] = b
+        wgt = padded.reshape(kb, self.block, nb, self.block).transpose(2, 0, 3, 1)
+        return inp, np.ascontiguousarray(wgt)
+
+    def create_program(self, m, k, n, addresses):
+        """
+        Returns the VTAProgram of a multiplication, given the device
+        addresses of the uop, inp, wgt and out buffers
+        """
+        tm, tk, tn = self.tiles(m, k, n)
+        kb, nb = self.blocks(k), self.blocks(n)
+        # out rows hold whole tiles, the columns past n are not read
+        out_cols = -(-nb // tn) * tn
+        uop_addr, inp_addr, wgt_addr, out_addr = addresses
+        count = self.uop_base(self.buffers_per_memory, 0, tk)
+        program = VTAProgram(self.spec)
+        program.load("uop", 0, uop_addr // UOP_BYTES, 1, count)
+        step = 0
+        for t, (mi, ni) in enumerate(
+            (mi, ni) for mi in range(0, m, tm) for ni in range(0, nb, tn)
+        ):
+            ab = t % self.buffers_per_memory
+            rows, cols = min(tm, m - mi), min(tn, nb - ni)
+            loops = dict(iter_out=rows, iter_in=cols, dst_factor=(tn, 1))
+            acc = {"acc": (ab * tm * tn, tm * tn)}
+            program.gemm(ab, ab + 1, reset=True, reads={}, writes=acc, **loops)
+            for ki in range(0, kb, tk):
+                buf = step % self.buffers_per_memory
+                step += 1
+                size = min(tk, kb - ki)
+                pad = (0, tk - size)
+                program.load(
+                    "inp",
+                    buf * tm * tk,
+                    inp_addr // INP_BYTES + mi * kb + ki,
+                    rows,
+                    size,
+                    x_stride=kb,
+                    x_pad=pad,
+                )
+                program.load(
+                    "wgt",
+                    buf * tn * tk,
+                    wgt_addr // WGT_BYTES + ni * kb + ki,
+                    cols,
+                    size,
+                    x_stride=kb,
+                    x_pad=pad,
+                )
+                base = self.uop_base(buf, ab, tk)
+                program.gemm(
+                    base,
+                    base + tk,
+                    src_factor=(tk, 0),
+                    wgt_factor=(0, tk),
+                    reads={
+                        "inp": (buf * tm * tk, tm * tk),
+                        "wgt": (buf * tn * tk, tn * tk),
+                    },
+                    writes=acc,
+                    **loops
+                )
+            if self.shift:
+                program.alu(
+                    "shr",
+                    ab,
+                    ab + 1,
+                    src_factor=(tn, 1),
+                    imm=self.shift,
+                    reads=acc,
+                    writes=acc,
+                    **loops
+                )
+            program.store(
+                ab * tm * tn,
+                out_addr // OUT_BYTES + mi * out_cols + ni,
+                rows,
+                tn,
+                x_stride=out_cols,
+            )
+        program.finish()
+        return program
+
+    def allocate(self, name, size, unit):
+        """
+        Returns the address of a buffer of at least size bytes, aligned to
+        unit bytes, and its offset from the start of the buffer. The buffer
+        is unit - 1 bytes larger, so that the address can be rounded up
+        """
+        if name in self.buffers and self.buffers[name][2] >= size:
+            return self.buffers[name][:2]
+        if name in self.buffers:
+            self.session.free(name)
+            del self.buffers[name]
+        base = self.session.alloc(name, size + unit - 1)
+        offset = -base % unit
+        self.buffers[name] = (base + offset, offset, size)
+        return base + offset, offset
+
+    def free(self):
+        """Frees the buffers of the multiplications in the session"""
+        for name in self.buffers:
+            self.session.free(name)
+        self.buffers = dict()
+        self.images = dict()
+
+    def matmul(self, a, b):
+        """Returns the product of int8 matrices a and b, as int8"""
+        if a.ndim != 2 or b.ndim != 2 or a.shape[1] != b.shape[0]:
+            raise ValueError(
+                "cannot multiply matrices of shapes {} and {}".format(a.shape, b.shape)
+            )
+        (m, k), n = a.shape, b.shape[1]
+        tm, tk, tn = self.tiles(m, k, n)
+        inp, wgt = self.pack(a, b)
+        uops = self.uops(tm, tk, tn)
+        out_cols = -(-self.blocks(n) // tn) * tn
+        out_shape = (m, out_cols * self.block)
+        buffers = (
+            self.allocate("gemm_uop", uops.nbytes, UOP_BYTES),
+            self.allocate("gemm_inp", inp.nbytes, INP_BYTES),
+            self.allocate("gemm_wgt", wgt.nbytes, WGT_BYTES),
+            self.allocate("gemm_out", int(np.prod(out_shape)), OUT_BYTES),
+        )
+        addresses = tuple(address for address, _ in buffers)
+        offsets = [offset for _, offset in buffers]
+
+        key = (m, k, n, (tm, tk, tn), self.shift, self.buffers_per_memory, addresses)
+        if key not in self.images:
+            self.images = {key: self.create_program(m, k, n, addresses).encode()}
+        res = self.session.run(
+            self.images[key],
+            writes=[
+                ("gemm_uop", uops, offsets[0]),
+                ("gemm_inp", inp, offsets[1]),
+                ("gemm_wgt", wgt, offsets[2]),
+            ],
+            reads=[("gemm_out", np.int8, out_shape, offsets[3])],
+        )
+        self.programs += 1
+        return res[0][:, :n]
+
+
+class GemmError(Exception):
+    pass
@@ -0,0 +1,377 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from vta_encoder import encoder_for_spec
+
+# The modules of VTA, in the order data flows through them
+LOAD, COMPUTE, STORE = "load", "compute", "store"
+
+# Dependency flags of an instruction of module, towards each neighbor:
+# (flag to push a token to the neighbor, flag to pop a token from it)
+QUEUE_FLAGS = {
+    (LOAD, COMPUTE): ("push_next_dep", "pop_next_dep"),
+    (COMPUTE, LOAD): ("push_prev_dep", "pop_prev_dep"),
+    (COMPUTE, STORE): ("push_next_dep", "pop_next_dep"),
+    (STORE, COMPUTE): ("push_prev_dep", "pop_prev_dep"),
+}
+
+NEIGHBORS = {LOAD: [COMPUTE], COMPUTE: [LOAD, STORE], STORE: [COMPUTE]}
+
+# Memories written by the load module, the others are loaded by compute
+LOAD_MEMORIES = ("inp", "wgt")
+
+# A range of a memory accessed by an instruction, from start to end
+# elements. An end of None stands for the end of the memory
+ALL = None
+
+
+class Access:
+    __slots__ = ("mem", "start", "end", "write")
+
+    def __init__(self, mem, start, end, write):
+        self.mem = mem
+        self.start = start
+        self.end = end
+        self.write = write
+
+    def conflicts(self, other):
+        if self.mem != other.mem or not (self.write or other.write):
+            return False
+        if self.end is not None and other.start >= self.end:
+            return False
+        if other.end is not None and self.start >= other.end:
+            return False
+        return True
+
+
+def conflicts(accesses, others):
+    return any(a.conflicts(b) for a in accesses for b in others)
+
+
+class VTAProgram:
+    """
+    VTAProgram builds a VTA instruction stream. Every instruction records
+    the ranges of the memories it reads and writes, and the dependency
+    flags are computed from them when the program is encoded: a token is
+    pushed by the last instruction of a module that an instruction of a
+    neighboring module depends on, and popped by that instruction.
+
+    Loads of inp and wgt run in the load module, stores in the store
+    module, and everything else in the compute module. The ranges of
+    inp, wgt and acc used by gemm and alu instructions are given with
+    reads and writes, as dicts of mem: (start, size). They are the whole
+    memories if not given, which serializes the modules. Writes to acc
+    are writes to out as well. DRAM is not tracked, so data stored by a
+    program must not be loaded by the same program.
+
+    With reorder, loads are moved ahead of the instructions they do not
+    depend on, so that they overlap with compute and stores.
+
+    Instructions are kept in a single structured array of encoder.dtype,
+    that grows by doubling, and are encoded at once.
+
+    Parameters
+    ----------
+    spec : dict
+        The contents of vta_spec.json
+    capacity : int
+        Initial number of instructions of the array
+    reorder : bool
+        Whether loads are moved ahead of independent instructions
+    """
+
+    def __init__(self, spec, capacity=64, reorder=True):
+        self.spec = spec
+        self.encoder = encoder_for_spec(spec)
+        self.reorder = reorder
+        self.opcodes = spec["value"]["opcode"]
+        self.mem_ids = spec["value"]["mem_id"]
+        self.alu_opcodes = spec["value"]["alu_opcode"]
+        self.instructions = self.encoder.empty(capacity)
+        self.count = 0
+        self.modules = []
+        self.accesses = []
+
+    def __len__(self):
+        return self.count
+
+    def append_fields(self, module, accesses, **fields):
+        if self.count == self.instructions.shape[0]:
+            grown = self.encoder.empty(2 * self.count)
+            grown[: self.count] = self.instructions
+            self.instructions = grown
+        row = self.instructions[self.count]
+        for f, value in fields.items():
+            row[f] = value
+        self.modules.append(module)
+        self.accesses.append(accesses)
+        self.count += 1
+        return self.count - 1
+
+    def append(self, instr, reads=None, writes=None):
+        """
+        Appends an Instruction of vta.py. Its dependency flags are ignored,
+        reads and writes are as in gemm and alu
+        """
+        values = instr.values
+        for f in ("pop_prev_dep", "pop_next_dep", "push_prev_dep", "push_next_dep"):
+            values[f] = 0
+        opcode = values["opcode"]
+        if opcode == self.opcodes["load"] or opcode == self.opcodes["store"]:
+            mem = self.mem_name(values["mem_type"])
+            accesses, module = self.mem_accesses(opcode, mem, values)
+        elif opcode == self.opcodes["finish"]:
+            module, accesses = COMPUTE, self.all_accesses()
+        else:
+            module = COMPUTE
+            accesses = self.compute_accesses(
+                values["uop_bgn"],
+                values["uop_end"],
+                reads,
+                writes,
+                gemm=opcode == self.opcodes["gemm"],
+                reset=values.get("reset_flag", 0) or values.get("reset_reg", 0),
+            )
+        return self.append_fields(module, accesses, **values)
+
+    def mem_name(self, mem_type):
+        for name, value in self.mem_ids.items():
+            if value == mem_type:
+                return name
+        raise ProgramError("unknown memory {}".format(mem_type))
+
+    def mem_accesses(self, opcode, mem, fields):
+        pads = [fields.get(p, 0) for p in ("y_pad_0", "y_pad_1", "x_pad_0", "x_pad_1")]
+        rows = fields["y_size"] + pads[0] + pads[1]
+        cols = fields["x_size"] + pads[2] + pads[3]
+        start = fields["sram_base"]
+        if opcode == self.opcodes["store"]:
+            return [Access("out", start, start + rows * cols, False)], STORE
+        module = LOAD if mem in LOAD_MEMORIES else COMPUTE
+        accesses = [Access(mem, start, start + rows * cols, True)]
+        if mem == "acc":
+            accesses.append(Access("out", start, start + rows * cols, True))
+        return accesses, module
+
+    def all_accesses(self):
+        return [
+            Access(mem, 0, ALL, True) for mem in ("uop", "inp", "wgt", "acc", "out")
+        ]
+
+    def compute_accesses(self, uop_bgn, uop_end, reads, writes, gemm, reset):
+        accesses = [Access("uop", uop_bgn, uop_end, False)]
+        if reads is None:
+            reads = {"acc": (0, ALL)}
+            if gemm and not reset:
+                reads.update({"inp": (0, ALL), "wgt": (0, ALL)})
+        if writes is None:
+            writes = {"acc": (0, ALL)}
+        for mem, (start, size) in reads.items():
+            end = None if size is ALL else start + size
+            accesses.append(Access(mem, start, end, False))
+        for mem, (start, size) in writes.items():
+            end = None if size is ALL else start + size
+            accesses.append(Access(mem, start, end, True))
+            if mem == "acc":
+                accesses.append(Access("out", start, end, True))
+        return accesses
+
+    def load(
+        self,
+        mem,
+        sram_base,
+        dram_base,
+        y_size=1,
+        x_size=1,
+        x_stride=None,
+        y_pad=(0, 0),
+        x_pad=(0, 0),
+    ):
+        """
+        Loads y_size rows of x_size elements of mem, x_stride elements
+        apart in DRAM, to sram_base, with y_pad and x_pad rows and columns
+        of zeros before and after them
+        """
+        fields = {
+            "opcode": self.opcodes["load"],
+            "mem_type": self.mem_ids[mem],
+            "sram_base": sram_base,
+            "dram_base": dram_base,
+            "y_size": y_size,
+            "x_size": x_size,
+            "x_stride": x_size if x_stride is None else x_stride,
+            "y_pad_0": y_pad[0],
+            "y_pad_1": y_pad[1],
+            "x_pad_0": x_pad[0],
+            "x_pad_1": x_pad[1],
+        }
+        accesses, module = self.mem_accesses(fields["opcode"], mem, fields)
+        return self.append_fields(module, accesses, **fields)
+
+    def store(self, sram_base, dram_base, y_size=1, x_size=1, x_stride=None):
+        """Stores y_size rows of x_size elements of out from sram_base"""
+        fields = {
+            "opcode": self.opcodes["store"],
+            "mem_type": self.mem_ids["out"],
+            "sram_base": sram_base,
+            "dram_base": dram_base,
+            "y_size": y_size,
+            "x_size": x_size,
+            "x_stride": x_size if x_stride is None else x_stride,
+        }
+        accesses, module = self.mem_accesses(fields["opcode"], "out", fields)
+        return self.append_fields(module, accesses, **fields)
+
+    def gemm(
+        self,
+        uop_bgn,
+        uop_end,
+        iter_out=1,
+        iter_in=1,
+        dst_factor=(0, 0),
+        src_factor=(0, 0),
+        wgt_factor=(0, 0),
+        reset=False,
+        reads=None,
+        writes=None,
+    ):
+        """
+        Runs the uops from uop_bgn to uop_end in a loop of iter_out by
+        iter_in iterations. Factors are (out, in) increments of the acc,
+        inp and wgt indices of the uops
+        """
+        fields = {
+            "opcode": self.opcodes["gemm"],
+            "reset_flag": int(reset),
+            "uop_bgn": uop_bgn,
+            "uop_end": uop_end,
+            "iter_out": iter_out,
+            "iter_in": iter_in,
+            "dst_factor_out": dst_factor[0],
+            "dst_factor_in": dst_factor[1],
+            "src_factor_out": src_factor[0],
+            "src_factor_in": src_factor[1],
+            "wgt_factor_out": wgt_factor[0],
+            "wgt_factor_in": wgt_factor[1],
+        }
+        accesses = self.compute_accesses(
+            uop_bgn, uop_end, reads, writes, gemm=True, reset=reset
+        )
+        return self.append_fields(COMPUTE, accesses, **fields)
+
+    def alu(
+        self,
+        op,
+        uop_bgn,
+        uop_end,
+        iter_out=1,
+        iter_in=1,
+        dst_factor=(0, 0),
+        src_factor=(0, 0),
+        imm=None,
+        reset=False,
+        reads=None,
+        writes=None,
+    ):
+        """
+        Runs the alu operation op, such as "add" or "max", on the uops from
+        uop_bgn to uop_end. The second operand is imm if given, otherwise
+        the src element of every uop
+        """
+        fields = {
+            "opcode": self.opcodes["alu"],
+            "reset_reg": int(reset),
+            "uop_bgn": uop_bgn,
+            "uop_end": uop_end,
+            "iter_out": iter_out,
+            "iter_in": iter_in,
+            "dst_factor_out": dst_factor[0],
+            "dst_factor_in": dst_factor[1],
+            "src_factor_out": src_factor[0],
+            "src_factor_in": src_factor[1],
+            "alu_opcode": self.alu_opcodes[op],
+            "use_imm": int(imm is not None),
+            "imm": 0
+            if imm is None
+            else imm & ((1 << self.spec["width"]["alu_imm"]) - 1),
+        }
+        accesses = self.compute_accesses(
+            uop_bgn, uop_end, reads, writes, gemm=False, reset=reset
+        )
+        return self.append_fields(COMPUTE, accesses, **fields)
+
+    def finish(self):
+        """Ends the program once every module is done"""
+        return self.append_fields(
+            COMPUTE, self.all_accesses(), opcode=self.opcodes["finish"]
+        )
+
+    def schedule(self):
+        """
+        Returns the order of the instructions in the encoded program.
+        Loads are moved right after the last instruction they conflict with,
+        but not ahead of other loads, since the load module runs them in
+        order and the loads before them are needed first
+        """
+        order = []
+        for i in range(self.count):
+            position = len(order)
+            if self.reorder and self.modules[i] == LOAD:
+                position = 0
+                for q in range(len(order) - 1, -1, -1):
+                    if self.modules[order[q]] == LOAD or conflicts(
+                        self.accesses[i], self.accesses[order[q]]
+                    ):
+                        position = q + 1
+                        break
+            order.insert(position, i)
+        return order
+
+    def fields(self):
+        """
+        Returns the instructions in their scheduled order, as a structured
+        array of encoder.dtype, with their dependency flags set
+        """
+        order = self.schedule()
+        res = self.instructions[order]
+        for f in ("pop_prev_dep", "pop_next_dep", "push_prev_dep", "push_next_dep"):
+            res[f] = 0
+        modules = [self.modules[i] for i in order]
+        accesses = [self.accesses[i] for i in order]
+        # positions of the instructions of every module
+        history = {LOAD: [], COMPUTE: [], STORE: []}
+        # last position of a module known to be done by another module
+        synced = {queue: -1 for queue in QUEUE_FLAGS}
+        for position, module in enumerate(modules):
+            for neighbor in NEIGHBORS[module]:
+                for j in reversed(history[neighbor]):
+                    if j <= synced[(neighbor, module)]:
+                        break
+                    if conflicts(accesses[position], accesses[j]):
+                        push, _ = QUEUE_FLAGS[(neighbor, module)]
+                        _, pop = QUEUE_FLAGS[(module, neighbor)]
+                        res[push][j] = 1
+                        res[pop][position] = 1
+                        synced[(neighbor, module)] = j
+                        break
+            history[module].append(position)
+        return res
+
+    def encode(self, out=None):
+        """Returns the encoded program as a np.uint8 array, see encoder.encode"""
+        return self.encoder.encode(self.fields(), out=out)
+
+
+class ProgramError(Exception):
+    pass
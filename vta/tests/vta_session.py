@@ -0,0 +1,219 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sabana import Program
+
+# Registers of the vta image
+CONTROL = 0x0
+COUNT = 0x8
+ADDRESS = 0xC
+
+INSTRUCTION_SIZE_BYTES = 16
+
+
+class VTASession:
+    """
+    VTASession keeps a vta instance ready to run instruction batches. The
+    c0 MMIO region is allocated once, and so are an instruction ring
+    buffer and the data buffers of the caller, which stay resident until
+    the session is closed.
+
+    Every batch is a single program: the data of the batch is written to
+    its buffers, the instructions are written to the next free part of
+    the ring, the count and address registers are updated, the control
+    register is kicked and waited on, and the outputs are read back.
+    Registers are only written when their value changes, and instructions
+    that are still in the ring from a previous batch are not written
+    again. The ring grows when a batch does not fit in it.
+
+    Parameters
+    ----------
+    driver : Driver
+        The driver of the instance, programs are executed with driver.run
+    capacity : int
+        Initial size of the ring, in instructions
+    timeout : int
+        Timeout of the wait on the control register
+    """
+
+    def __init__(self, driver, capacity=1024, timeout=4):
+        self.driver = driver
+        self.capacity = capacity * INSTRUCTION_SIZE_BYTES
+        self.timeout = timeout
+        self.is_open = False
+        self.buffers = dict()
+        self.batches = 0
+        self.instructions_written = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self.is_open:
+            return
+        program = Program()
+        program.mmio_alloc(name="c0", size=0x00010000, base_address=0xA0000000)
+        program.buffer_alloc(name="instr", size=self.capacity)
+        self.ring_address = self.check_address(self.driver.run(program)[0])
+        self.is_open = True
+        self.reset_ring()
+
+    def close(self):
+        if not self.is_open:
+            return
+        program = Program()
+        program.mmio_dealloc(name="c0")
+        program.buffer_dealloc(name="instr")
+        for name in self.buffers:
+            program.buffer_dealloc(name=name)
+        self.driver.run(program)
+        self.buffers = dict()
+        self.is_open = False
+
+    def reset_ring(self):
+        self.head = 0
+        # offsets of the images in the ring, by their bytes
+        self.resident = dict()
+        # values of the registers, None once they are unknown
+        self.registers = {COUNT: None, ADDRESS: None}
+
+    @staticmethod
+    def check_address(address):
+        address = int(address)
+        if address >> 32:
+            raise SessionError(
+                "address {:#x} does not fit in the instruction address "
+                "register".format(address)
+            )
+        return address
+
+    def alloc(self, name, size):
+        """
+        Allocates a data buffer that stays resident until the session is
+        closed, returns its device address
+        """
+        self.open()
+        if name in self.buffers or name == "instr":
+            raise SessionError("buffer {} is already allocated".format(name))
+        program = Program()
+        program.buffer_alloc(name=name, size=size)
+        address = int(self.driver.run(program)[0])
+        self.buffers[name] = (address, size)
+        return address
+
+    def free(self, name):
+        if name not in self.buffers:
+            raise SessionError("buffer {} is not allocated".format(name))
+        program = Program()
+        program.buffer_dealloc(name=name)
+        self.driver.run(program)
+        del self.buffers[name]
+
+    def grow(self, size):
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        program = Program()
+        program.buffer_dealloc(name="instr")
+        program.buffer_alloc(name="instr", size=capacity)
+        self.ring_address = self.check_address(self.driver.run(program)[0])
+        self.capacity = capacity
+        self.reset_ring()
+
+    def place(self, image):
+        """
+        Returns the offset of image in the ring, and whether it has to be
+        written there
+        """
+        key = image.tobytes()
+        if key in self.resident:
+            return self.resident[key], False
+        size = image.size
+        if size > self.capacity:
+            self.grow(size)
+        if self.head + size > self.capacity:
+            self.head = 0
+        offset = self.head
+        self.head += size
+        self.resident = {
+            k: o
+            for k, o in self.resident.items()
+            if o + len(k) <= offset or o >= offset + size
+        }
+        self.resident[key] = offset
+        return offset, True
+
+    def create_program(self, image, writes=(), reads=()):
+        """
+        Returns the program of a batch. writes are (name, data[, offset])
+        of the data buffers to write before the instructions run, and reads
+        are (name, dtype, shape[, offset]) of the data to read after
+        """
+        if image.dtype != np.uint8 or image.size % INSTRUCTION_SIZE_BYTES:
+            raise SessionError("image must be a np.uint8 array of whole instructions")
+        self.open()
+        offset, write_image = self.place(image)
+        registers = {
+            COUNT: image.size // INSTRUCTION_SIZE_BYTES,
+            ADDRESS: self.ring_address + offset,
+        }
+
+        program = Program()
+        for name, data, *data_offset in writes:
+            program.buffer_write(data, name=name, offset=(data_offset or [0])[0])
+        if write_image:
+            program.buffer_write(image, name="instr", offset=offset)
+            self.instructions_written += registers[COUNT]
+        for register, value in registers.items():
+            if self.registers[register] != value:
+                program.mmio_write(
+                    np.array([value], np.uint32), name="c0", offset=register
+                )
+                self.registers[register] = value
+        program.mmio_write(np.array([1], np.uint32), name="c0", offset=CONTROL)
+        program.mmio_wait(
+            np.array([2], np.uint32), name="c0", offset=CONTROL, timeout=self.timeout
+        )
+        for name, dtype, shape, *data_offset in reads:
+            program.buffer_read(
+                name=name,
+                offset=(data_offset or [0])[0],
+                dtype=dtype,
+                shape=shape,
+            )
+        return program
+
+    def run(self, image, writes=(), reads=()):
+        """
+        Runs the instructions of image, a np.uint8 array, and returns the
+        data of reads, see create_program
+        """
+        program = self.create_program(image, writes, reads)
+        try:
+            res = self.driver.run(program)
+        except Exception:
+            # the ring and the registers may not hold what is expected
+            self.reset_ring()
+            raise
+        self.batches += 1
+        return res
+
+
+class SessionError(Exception):
+    pass
@@ -0,0 +1,517 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+
+import numpy as np
+from sabana.common import ndarray_from_values, dtype_from_ty
+from sabana.responses import (
+    is_alloc,
+    is_dealloc,
+    is_mmio,
+    is_read,
+    is_wait,
+    is_write,
+)
+from vta_encoder import encoder_for_spec
+from vta_program import LOAD, COMPUTE, STORE, LOAD_MEMORIES
+
+# The configuration of the vta image, from the sizes of its scratchpads
+HARDWARE = {
+    "batch": 1,
+    "block_in": 16,
+    "block_out": 16,
+    "uop_depth": 8192,
+    "inp_depth": 2048,
+    "wgt_depth": 1024,
+    "acc_depth": 2048,
+}
+
+# Approximate cost of every operation, in cycles
+TIMING = {
+    # bytes moved per cycle by the 64 bits AXI master
+    "dram_bytes_per_cycle": 8,
+    # latency of every row of a load or a store
+    "dram_latency": 32,
+    # rows of zeros written per cycle by padding
+    "pad_elements_per_cycle": 1,
+    "gemm_uop": 1,
+    "alu_uop": 1,
+    "pipeline": 4,
+}
+
+# queues of tokens, by (module that pushes, module that pops), with the
+# flags of the instructions that push and pop them
+QUEUES = {
+    (LOAD, COMPUTE): ("push_next_dep", "pop_prev_dep"),
+    (COMPUTE, LOAD): ("push_prev_dep", "pop_next_dep"),
+    (COMPUTE, STORE): ("push_next_dep", "pop_prev_dep"),
+    (STORE, COMPUTE): ("push_prev_dep", "pop_next_dep"),
+}
+
+
+class DRAM:
+    """
+    A flat DRAM for the simulator, with a bump allocator. Addresses start
+    at base and buffers are aligned to 4 KiB, as the vta instructions
+    address DRAM in units of whole tensors.
+    """
+
+    def __init__(self, size=1 << 26, base=0x1000):
+        self.data = np.zeros(size, dtype=np.uint8)
+        self.base = base
+        self.next_address = base
+
+    def alloc(self, size):
+        address = self.next_address
+        self.next_address += -(-max(size, 1) // 4096) * 4096
+        if self.next_address - self.base > self.data.size:
+            raise SimulatorError("the simulated DRAM is full")
+        return address
+
+    def view(self, address, size):
+        start = address - self.base
+        if start < 0 or start + size > self.data.size:
+            raise SimulatorError(
+                "access of {} bytes at {:#x} is out of DRAM".format(size, address)
+            )
+        return self.data[start : start + size]
+
+
+class VTASimulator:
+    """
+    VTASimulator executes VTA instruction images with NumPy. The inp, wgt,
+    acc, out and uop scratchpads are modeled, and so are the load, compute
+    and store modules: each one executes its instructions in order, and
+    waits for the tokens its instructions pop. A program whose tokens can
+    not be popped raises a SimulatorError instead of hanging.
+
+    Every instruction is given an approximate cost in cycles, from the
+    bytes it moves or the uops it executes, so that run returns the
+    cycles of the program and the utilization of every module.
+
+    Parameters
+    ----------
+    spec : dict
+        The contents of vta_spec.json
+    dram : DRAM (optional)
+        The DRAM that loads and stores access
+    hardware : dict (optional)
+        Overrides of HARDWARE
+    timing : dict (optional)
+        Overrides of TIMING
+    """
+
+    def __init__(self, spec, dram=None, hardware=None, timing=None):
+        self.spec = spec
+        self.encoder = encoder_for_spec(spec)
+        self.dram = DRAM() if dram is None else dram
+        self.hw = dict(HARDWARE, **(hardware or {}))
+        self.timing = dict(TIMING, **(timing or {}))
+        self.opcodes = spec["value"]["opcode"]
+        self.mem_names = {v: k for k, v in spec["value"]["mem_id"].items()}
+        self.alu_names = {v: k for k, v in spec["value"]["alu_opcode"].items()}
+        widths = spec["width"]
+        self.uop_widths = [widths["dst_factor"], widths["src_factor"]]
+        self.imm_bits = widths["alu_imm"]
+
+        hw = self.hw
+        self.inp = np.zeros((hw["inp_depth"], hw["batch"], hw["block_in"]), np.int8)
+        self.wgt = np.zeros((hw["wgt_depth"], hw["block_out"], hw["block_in"]), np.int8)
+        self.acc = np.zeros((hw["acc_depth"], hw["batch"], hw["block_out"]), np.int32)
+        self.out = np.zeros((hw["acc_depth"], hw["batch"], hw["block_out"]), np.int8)
+        self.uop = np.zeros(hw["uop_depth"], np.uint32)
+        self.memories = {
+            "inp": self.inp,
+            "wgt": self.wgt,
+            "acc": self.acc,
+            "out": self.out,
+            "uop": self.uop,
+        }
+
+    def module(self, instr):
+        opcode = int(instr["opcode"])
+        if opcode == self.opcodes["load"]:
+            mem = self.mem_names.get(int(instr["mem_type"]))
+            return LOAD if mem in LOAD_MEMORIES else COMPUTE
+        if opcode == self.opcodes["store"]:
+            return STORE
+        return COMPUTE
+
+    def run(self, image):
+        """
+        Executes an instruction image, given as a np.uint8 array, and
+        returns a report of its cycles and of the utilization of every
+        module
+        """
+        return self.run_fields(self.encoder.decode(image))
+
+    def run_fields(self, instructions):
+        """Executes a structured array of dtype encoder.dtype, see run"""
+        queues = {module: deque() for module in (LOAD, COMPUTE, STORE)}
+        for i in range(instructions.shape[0]):
+            queues[self.module(instructions[i])].append(i)
+        # tokens pushed and not popped yet, by the cycle they are pushed
+        tokens = {queue: deque() for queue in QUEUES}
+        clock = {module: 0 for module in queues}
+        busy = {module: 0 for module in queues}
+        stall = {module: 0 for module in queues}
+        executed = {module: 0 for module in queues}
+        finished = None
+
+        while finished is None and any(queues.values()):
+            # the module whose next instruction can start first
+            best = None
+            for module, queue in queues.items():
+                if not queue:
+                    continue
+                instr = instructions[queue[0]]
+                ready = clock[module]
+                blocked = False
+                for (src, dst), (_, pop) in QUEUES.items():
+                    if dst == module and instr[pop]:
+                        if not tokens[(src, dst)]:
+                            blocked = True
+                            break
+                        ready = max(ready, tokens[(src, dst)][0])
+                if not blocked and (best is None or ready < best[1]):
+                    best = (module, ready)
+            if best is None:
+                waiting = {m: int(q[0]) for m, q in queues.items() if q}
+                raise SimulatorError(
+                    "deadlock, instructions {} wait for tokens that are never "
+                    "pushed".format(waiting)
+                )
+
+            module, start = best
+            index = queues[module].popleft()
+            instr = instructions[index]
+            for (src, dst), (_, pop) in QUEUES.items():
+                if dst == module and instr[pop]:
+                    tokens[(src, dst)].popleft()
+            try:
+                cycles = self.execute(instr)
+            except SimulatorError as e:
+                raise SimulatorError("instruction {}: {}".format(index, e))
+            end = start + cycles
+            stall[module] += start - clock[module]
+            busy[module] += cycles
+            clock[module] = end
+            executed[module] += 1
+            for (src, dst), (push, _) in QUEUES.items():
+                if src == module and instr[push]:
+                    tokens[(src, dst)].append(end)
+            if int(instr["opcode"]) == self.opcodes["finish"]:
+                finished = end
+
+        cycles = max(clock.values()) if finished is None else finished
+        return {
+            "cycles": cycles,
+            "finished": finished is not None,
+            "instructions": executed,
+            "busy": busy,
+            "stall": stall,
+            "utilization": {m: busy[m] / cycles if cycles else 0.0 for m in busy},
+        }
+
+    def execute(self, instr):
+        """Executes a single instruction, returns its cost in cycles"""
+        opcode = int(instr["opcode"])
+        if opcode == self.opcodes["load"]:
+            return self.load(instr)
+        elif opcode == self.opcodes["store"]:
+            return self.store(instr)
+        elif opcode == self.opcodes["gemm"]:
+            return self.gemm(instr)
+        elif opcode == self.opcodes["alu"]:
+            return self.alu(instr)
+        elif opcode == self.opcodes["finish"]:
+            return 1
+        raise SimulatorError("unknown opcode {}".format(opcode))
+
+    def sram(self, mem, start, count):
+        memory = self.memories[mem]
+        if start + count > memory.shape[0]:
+            raise SimulatorError(
+                "{} elements at {} are out of {}, of {} elements".format(
+                    count, start, mem, memory.shape[0]
+                )
+            )
+        return memory[start : start + count]
+
+    def load(self, instr):
+        mem = self.mem_names.get(int(instr["mem_type"]))
+        if mem not in ("inp", "wgt", "acc", "uop"):
+            raise SimulatorError("loads of {} are not supported".format(mem))
+        memory = self.memories[mem]
+        element = memory[0]
+        y_size, x_size = int(instr["y_size"]), int(instr["x_size"])
+        y_pad = int(instr["y_pad_0"]), int(instr["y_pad_1"])
+        x_pad = int(instr["x_pad_0"]), int(instr["x_pad_1"])
+        cols = x_size + x_pad[0] + x_pad[1]
+        rows = y_size + y_pad[0] + y_pad[1]
+        sram = self.sram(mem, int(instr["sram_base"]), rows * cols)
+        sram = sram.reshape((rows, cols) + element.shape)
+        sram[:] = 0
+        dram_base = int(instr["dram_base"])
+        x_stride = int(instr["x_stride"])
+        for y in range(y_size):
+            address = (dram_base + y * x_stride) * element.nbytes
+            data = self.dram.view(address, x_size * element.nbytes)
+            sram[y_pad[0] + y, x_pad[0] : x_pad[0] + x_size] = data.view(
+                memory.dtype
+            ).reshape((x_size,) + element.shape)
+        timing = self.timing
+        moved = y_size * x_size * element.nbytes
+        padded = rows * cols - y_size * x_size
+        return (
+            y_size * timing["dram_latency"]
+            + -(-moved // timing["dram_bytes_per_cycle"])
+            + -(-padded // timing["pad_elements_per_cycle"])
+        )
+
+    def store(self, instr):
+        element = self.out[0]
+        y_size, x_size = int(instr["y_size"]), int(instr["x_size"])
+        sram = self.sram("out", int(instr["sram_base"]), y_size * x_size)
+        dram_base = int(instr["dram_base"])
+        x_stride = int(instr["x_stride"])
+        for y in range(y_size):
+            address = (dram_base + y * x_stride) * element.nbytes
+            data = self.dram.view(address, x_size * element.nbytes)
+            data[:] = sram[y * x_size : (y + 1) * x_size].view(np.uint8).reshape(-1)
+        moved = y_size * x_size * element.nbytes
+        return y_size * self.timing["dram_latency"] + -(
+            -moved // self.timing["dram_bytes_per_cycle"]
+        )
+
+    def uop_indices(self, instr, fields):
+        """
+        Returns the indices of every uop iteration of a gemm or alu
+        instruction, one array per field of the uops, as (dst, src[, wgt])
+        """
+        uop_bgn, uop_end = int(instr["uop_bgn"]), int(instr["uop_end"])
+        uops = self.sram("uop", uop_bgn, uop_end - uop_bgn).astype(np.int64)
+        iter_out, iter_in = int(instr["iter_out"]), int(instr["iter_in"])
+        y = np.arange(iter_out).reshape((-1, 1, 1))
+        x = np.arange(iter_in).reshape((1, -1, 1))
+        res = []
+        offset = 0
+        for name, width in fields:
+            idx = (uops >> offset) & ((1 << width) - 1)
+            offset += width
+            factor_out = int(instr[name + "_factor_out"])
+            factor_in = int(instr[name + "_factor_in"])
+            res.append((idx + y * factor_out + x * factor_in).reshape(-1))
+        return res
+
+    def check_indices(self, mem, indices):
+        if indices.size and indices.max() >= self.memories[mem].shape[0]:
+            raise SimulatorError(
+                "index {} is out of {}".format(int(indices.max()), mem)
+            )
+
+    def gemm(self, instr):
+        widths = self.spec["width"]
+        dst, src, wgt = self.uop_indices(
+            instr,
+            [
+                ("dst", widths["dst_factor"]),
+                ("src", widths["src_factor"]),
+                ("wgt", widths["wgt_factor"]),
+            ],
+        )
+        self.check_indices("acc", dst)
+        if instr["reset_flag"]:
+            self.acc[dst] = 0
+        else:
+            self.check_indices("inp", src)
+            self.check_indices("wgt", wgt)
+            products = np.einsum(
+                "nbi,noi->nbo",
+                self.inp[src].astype(np.int32),
+                self.wgt[wgt].astype(np.int32),
+            )
+            np.add.at(self.acc, dst, products)
+        self.out[dst] = self.acc[dst].astype(np.int8)
+        return dst.size * self.timing["gemm_uop"] + self.timing["pipeline"]
+
+    def alu(self, instr):
+        widths = self.spec["width"]
+        dst, src = self.uop_indices(
+            instr, [("dst", widths["dst_factor"]), ("src", widths["src_factor"])]
+        )
+        self.check_indices("acc", dst)
+        self.check_indices("acc", src)
+        op = self.alu_names.get(int(instr["alu_opcode"]))
+        if op is None:
+            raise SimulatorError("unknown alu opcode {}".format(instr["alu_opcode"]))
+        if instr["reset_reg"]:
+            self.acc[dst] = 0
+        else:
+            imm = None
+            if instr["use_imm"]:
+                imm = int(instr["imm"])
+                if imm >> (self.imm_bits - 1):
+                    imm -= 1 << self.imm_bits
+            independent = np.unique(dst).size == dst.size and (
+                imm is not None or not np.isin(src, dst).any()
+            )
+            if independent:
+                b = self.acc[src] if imm is None else np.int32(imm)
+                self.acc[dst] = self.alu_op(op, self.acc[dst], b)
+            else:
+                # uops read the results of previous ones, as in pooling
+                for d, s in zip(dst.tolist(), src.tolist()):
+                    a = self.acc[d]
+                    b = self.acc[s] if imm is None else np.int32(imm)
+                    self.acc[d] = self.alu_op(op, a, b)
+        self.out[dst] = self.acc[dst].astype(np.int8)
+        return dst.size * self.timing["alu_uop"] + self.timing["pipeline"]
+
+    @staticmethod
+    def alu_op(op, a, b):
+        if op == "min":
+            return np.minimum(a, b)
+        elif op == "max":
+            return np.maximum(a, b)
+        elif op == "add":
+            return a + b
+        elif op == "mul":
+            return a * b
+        elif op == "shr":
+            b = np.broadcast_to(b, a.shape).astype(np.int32)
+            return np.where(b >= 0, a >> np.abs(b), a << np.abs(b))
+        raise SimulatorError("unsupported alu operation {}".format(op))
+
+
+class SimulatedInstance:
+    """
+    SimulatedInstance executes the Sabana programs of the vta tests with a
+    VTASimulator, in place of an Instance of the vta image: buffers are
+    allocated in the DRAM of the simulator, and writing 1 to the control
+    register runs the count instructions at the address written to 0x8
+    and 0xC. The report of the last run is kept in last_report.
+
+    Parameters
+    ----------
+    spec : dict
+        The contents of vta_spec.json
+    hardware, timing : dict (optional)
+        Passed to the VTASimulator
+    """
+
+    def __init__(self, spec, hardware=None, timing=None):
+        self.spec = spec
+        self.hardware = hardware
+        self.timing = timing
+        self.is_up = False
+        self.reports = []
+
+    @property
+    def last_report(self):
+        return self.reports[-1] if self.reports else None
+
+    def up(self):
+        self.dram = DRAM()
+        self.sim = VTASimulator(self.spec, self.dram, self.hardware, self.timing)
+        self.buffers = dict()
+        self.registers = dict()
+        self.is_up = True
+
+    def down(self):
+        self.is_up = False
+
+    def buffer(self, name):
+        if name not in self.buffers:
+            raise SimulatorError("buffer {} is not allocated".format(name))
+        return self.buffers[name]
+
+    def execute(self, program):
+        if not self.is_up:
+            raise SimulatorError("Need to deploy an instance to execute this program")
+        values = []
+        for i, req in enumerate(program.req.requests):
+            try:
+                value = self.request(req)
+            except Exception as e:
+                raise SimulatorError(
+                    "\nOperation number {}: \n{}\nfailed with: {}\n".format(i, req, e)
+                )
+            if value is not None:
+                values.append(value)
+        return values
+
+    def request(self, req):
+        if is_mmio(req):
+            return self.mmio_request(req)
+        if is_alloc(req):
+            address = self.dram.alloc(req.alloc.size)
+            self.buffers[req.alloc.name] = (address, req.alloc.size)
+            return np.array(address, np.uint64)
+        elif is_dealloc(req):
+            self.buffer(req.dealloc.name)
+            del self.buffers[req.dealloc.name]
+        elif is_write(req):
+            raw = ndarray_from_values(req.write.values, req.write.datatype)
+            raw = raw.view(np.uint8).reshape(-1)
+            address, size = self.buffer(req.write.name)
+            if req.write.offset + raw.size > size:
+                raise SimulatorError("write past the end of {}".format(req.write.name))
+            self.dram.view(address + req.write.offset, raw.size)[:] = raw
+        elif is_read(req):
+            dtype = np.dtype(dtype_from_ty(req.read.datatype))
+            shape = tuple(req.read.shape)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            address, size = self.buffer(req.read.name)
+            if req.read.offset + nbytes > size:
+                raise SimulatorError("read past the end of {}".format(req.read.name))
+            data = self.dram.view(address + req.read.offset, nbytes)
+            return data.view(dtype).reshape(shape).copy()
+        return None
+
+    def mmio_request(self, req):
+        if is_write(req):
+            values = ndarray_from_values(req.write.values, req.write.datatype)
+            words = values.astype(np.uint32).reshape(-1)
+            for i, word in enumerate(words.tolist()):
+                self.registers[req.write.offset + 4 * i] = word
+            if req.write.offset == 0x0 and words[0] & 1:
+                self.start()
+        elif is_read(req):
+            shape = tuple(req.read.shape)
+            dtype = np.dtype(dtype_from_ty(req.read.datatype))
+            count = int(np.prod(shape))
+            words = [
+                self.registers.get(req.read.offset + 4 * i, 0) for i in range(count)
+            ]
+            return np.array(words, np.uint32).astype(dtype).reshape(shape)
+        elif is_wait(req):
+            values = ndarray_from_values(req.wait.values, req.wait.datatype)
+            if self.registers.get(req.wait.offset, 0) != int(values.reshape(-1)[0]):
+                raise SimulatorError("timeout waiting on {:#x}".format(req.wait.offset))
+        return None
+
+    def start(self):
+        count = self.registers.get(0x8, 0)
+        address = self.registers.get(0xC, 0)
+        nbytes = self.sim.encoder.nbytes(count)
+        image = self.dram.view(address, nbytes).copy()
+        self.reports.append(self.sim.run(image))
+        # done
+        self.registers[0x0] = 2
+
+
+class SimulatorError(Exception):
+    pass
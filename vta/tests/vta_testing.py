@@ -0,0 +1,86 @@
+# Copyright 2022 Sabana Technologies, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from pathlib import Path
+
+import numpy as np
+from vta import Load, Store, Addi, Finish
+from vta_program import VTAProgram
+from vta_simulator import SimulatedInstance
+
+
+def read_spec():
+    """Returns the contents of vta_spec.json"""
+    spec = Path(__file__).resolve().parent.joinpath("vta_spec.json")
+    with open(spec, "r") as f:
+        return json.loads(f.read())
+
+
+def packbits_per_bit(instr):
+    """The original encoding, one unpackbits per field"""
+    res = np.array([], dtype=np.uint8)
+    for f in instr.fields:
+        val = np.array([instr.values[f]], dtype=np.uint32)
+        val = np.frombuffer(val.tobytes(), dtype=np.uint8)
+        bit = np.unpackbits(val, bitorder="little", count=instr.widths[f])
+        res = np.concatenate((res, bit), dtype=np.uint8)
+    return np.packbits(res, bitorder="little")
+
+
+def random_instructions(spec, count, seed=0):
+    rng = np.random.default_rng(seed)
+    instructions = []
+    for i in range(count):
+        instr = [Load, Store, Addi, Finish][i % 4](spec)
+        for f in instr.fields:
+            if f not in ("opcode", "mem_type", "alu_opcode"):
+                instr.set_field(f, int(rng.integers(0, 1 << min(instr.widths[f], 32))))
+        instructions.append(instr)
+    return instructions
+
+
+class SimulatedDriver:
+    """A driver of a SimulatedInstance, that keeps the programs it runs"""
+
+    def __init__(self, spec):
+        self.inst = SimulatedInstance(spec)
+        self.inst.up()
+        self.programs = []
+
+    def run(self, program):
+        self.programs.append(program)
+        return self.inst.execute(program)
+
+
+def double_buffered(spec, reorder, tiles=4):
+    """A program of gemms on tiles loaded into two inp and wgt buffers"""
+    program = VTAProgram(spec, reorder=reorder)
+    program.load("uop", 0, 0)
+    for t in range(tiles):
+        buf = t % 2
+        program.load("inp", buf * 16, t * 16, 1, 16)
+        program.load("wgt", buf * 16, t * 16, 1, 16)
+        program.gemm(
+            0,
+            1,
+            iter_in=16,
+            src_factor=(0, 1),
+            wgt_factor=(0, 1),
+            reads={"inp": (buf * 16, 16), "wgt": (buf * 16, 16)},
+            writes={"acc": (0, 16)},
+        )
+    program.store(0, 0, 1, 16)
+    program.finish()
+    return program